@@ -3,18 +3,30 @@ import numpy as np
 import pandas as pd
 from datetime import datetime
 import os
+import sys
+import unicodedata
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import xlsxwriter
-from typing import Dict, List, Union, Any
-import xlwings as xw
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union, Any
+from xml.etree.ElementTree import ParseError
 
-import warnings
-warnings.filterwarnings('ignore')
+from fast_excel import read_filtered_sheet, read_xlsx_header, resolve_engine
+from incremental import IncrementalStore, changed_keys, frame_signature, group_digests, row_hashes
+from input_cache import InputCache, file_digest
+from instrumentation import METRICS, RunTrace, trace_path
 
-import winreg
 
 def enable_vba_access():
-    """Enable programmatic access to the VBA project object model in Excel via registry modification."""
+    """Enable programmatic access to the VBA project object model in Excel via registry modification.
+
+    Only needed by the legacy add_vba_buttons() Excel automation (Windows only).
+    """
+    import winreg
+
     try:
         office_versions = ["16.0", "15.0", "14.0", "12.0"]  # Office 2016, 2013, 2010, 2007
         for version in office_versions:
@@ -32,45 +44,33 @@ def enable_vba_access():
     except Exception as e:
         print(f"Failed to enable VBA access: {e}")
 
-import sys
-print("Python interpreter being used:", sys.executable)
-
 
 # Get the base directory dynamically
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
 PROCESSED_FOLDER = os.path.join(BASE_DIR, "processed")
+CACHE_FOLDER = os.path.join(BASE_DIR, "cache")
 
-# Ensure directories exist
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
-
-# File paths from the uploads folder
-bank_balance_path = os.path.join(UPLOAD_FOLDER, "bank_balance.xlsx")
-account_payables_path = os.path.join(UPLOAD_FOLDER, "account_payables.xlsx")
-cash_management_path = os.path.join(UPLOAD_FOLDER, "cash_management.xlsx")
-
-# Ensure all required files exist before reading
-if not all(os.path.exists(f) for f in [bank_balance_path, account_payables_path, cash_management_path]):
-    raise FileNotFoundError("One or more required input files are missing.")
-
-# Read Bank Balance (ensure sheet name is dynamically determined)
-bb_xl = pd.ExcelFile(bank_balance_path)
-bb_sheet_name = "Balance" if "Balance" in bb_xl.sheet_names else bb_xl.sheet_names[0]
-bb_raw = pd.read_excel(bank_balance_path, sheet_name=bb_sheet_name)
-print(f"Shape of bank_balance_raw: {bb_raw.shape}\n")
-
-# Read Account Payables
-ap_raw = pd.read_excel(account_payables_path)
-print(f"Shape of ap_raw: {ap_raw.shape}\n")
+FIX_REF_ERRORS_VBA = """
+Sub FixRefErrors()
+    Dim ws As Worksheet
+    Dim cell As Range
+    For Each ws In ThisWorkbook.Sheets
+        On Error Resume Next
+        For Each cell In ws.UsedRange
+            If cell.HasFormula Then
+                If InStr(cell.Formula, "#REF!") > 0 Then
+                    cell.Formula = Replace(cell.Formula, "#REF!", "0")
+                End If
+            End If
+        Next cell
+    Next ws
+End Sub
+"""
 
-# Read Cash Management (always take the last sheet dynamically)
-cm_xl = pd.ExcelFile(cash_management_path)
-last_sheet = cm_xl.sheet_names[-1]  # Automatically selects the last sheet
-cm_raw = pd.read_excel(cash_management_path, sheet_name=last_sheet)
-print(f"Shape of cm_raw: {cm_raw.shape}\n")
+# Names of the uploaded workbooks, as saved by the web app
+INPUT_FILE_TYPES = ['bank_balance', 'account_payables', 'cash_management']
 
-# Get Account Payable DataFrame
-ap = ap_raw.copy()
 translation_dict = {
     'Code de fournisseur': 'Supplier code',
     'Immeuble': 'Building',
@@ -80,208 +80,1101 @@ translation_dict = {
     'Montant payé': 'Paid amount',
     'No facture': 'Invoice no'
 }
-ap.columns = [translation_dict.get(col, col) for col in ap.columns]
 
-ap.drop_duplicates(inplace=True)
-ap['Paid amount'] = pd.to_numeric(ap['Paid amount'], errors='coerce').fillna(0)
+merge_keys = ['Company', 'Building', 'Bank']
+
+# Columns each input must have, as named in its header: the AP columns translation_dict
+# renames plus the date and amounts the filters use, and the merge keys and looked-up
+# columns of the bank balance and cash management
+INPUT_COLUMNS = {
+    'bank_balance': ['Company', 'Building', 'Bank', 'Company Name', 'Bank Account', 'Status'],
+    'account_payables': ['Code de fournisseur', 'Nom du fournisseur', 'Compagnie', 'Immeuble', 'Date',
+                         'No facture', 'Commentaire', 'Total', 'Montant payé'],
+    'cash_management': ['Co. no.', 'Bank', 'Available'],
+}
+
+# Sheet read from each input: (sheet name, position of the sheet read when there is no
+# sheet of that name or no name is given)
+INPUT_SHEETS = {
+    'bank_balance': ('Balance', 0),
+    'account_payables': (None, 0),
+    'cash_management': (None, -1),
+}
 
-ap['Date'] = pd.to_datetime(ap['Date'], errors='coerce')
-ap = ap[ap['Date'] >= '2023-10-01']
+# Dtype plan of the ingested frames: text columns with few distinct values repeated on
+# many lines are stored as categoricals (one small integer code per line instead of an
+# 8-byte pointer), which every later copy, filter and sort carries along. A column is
+# only converted when all its values are text, so mixed columns keep the values they
+# were read with. Amounts stay float64: that is already 8 bytes per line and holds the
+# exact doubles Excel stored, which the report writes back.
+INPUT_CATEGORIES = {
+    'bank_balance': ['Company Name', 'Bank Account', 'Status'],
+    'account_payables': ['Code de fournisseur', 'Nom du fournisseur', 'Commentaire'],
+    'cash_management': [],
+}
 
-ap = ap[ap['Total'] != ap['Paid amount']]
+# AP lines dated before this are not reported
+AP_CUTOFF_DATE = '2023-10-01'
 
-# CT stands for reverse payment
-ap.loc[ap['Comment'].str[:2] == 'CT', 'Total'] = pd.to_numeric(ap['Total'], errors='coerce') * (-1)
+# Exclude PPA suppliers from the balance sheet
+PPA_supplier_codes = [
+    'ALT003', 'BEL001', 'BRA001', 'CONR001', 'ENE001', 'ENVIROCONN', 'GAZIFERE',
+    'HYDROSOL', 'HYDRO', 'HYDRO WEST', 'INTELECOM', 'MILLER WAS', 'NOVA SCOTI',
+    'PRIMACO', 'SUPERIEUR', 'VIDEOTRON']
+
+cols_to_keep = ['Company Name', 'Bank Account', 'Available', 'Supplier name', 'Date',
+                'Invoice no', 'Comment', 'Total', 'Paid amount', 'Payable Balance', 'Status']
 
-# Get Bank Balance and Cash Management DataFrames
-bb = bb_raw.copy()
-cm = cm_raw.copy()
-cm = cm.rename(columns={'Co. no.': 'Company'})
-cm['Available'] = pd.to_numeric(cm['Available'], errors='coerce')
-cm['Available'] = cm['Available'].replace(0, np.nan)
-# Flip the sign of 'Available'
-cm['Available'] = cm['Available'] * (-1)
+# Stages reported to run_pipeline's progress callback, in order
+PIPELINE_STAGES = ['ingest', 'clean', 'merge', 'render', 'finalize']
+
+# (sheet name, split_by_status key) of the report's status sheets, in order
+REPORT_SHEETS = [('Active', 'active'), ('Others', 'others'), ('Zagora_AP', 'zagora'), ('Zagora_AR', 'AR')]
+
+# Upper bounds, in days since the invoice date, of the AP aging buckets: Current is up to
+# the first bound, and the last bucket holds everything older than the last one
+AGING_BUCKET_DAYS = [30, 60, 90, 120]
+
+# Status sheets whose open lines are aged, and the sheet the aging is written to
+AGING_SHEETS = [('Active', 'active'), ('Others', 'others')]
+AGING_SHEET_NAME = 'AP_Aging'
+
+# Cash coverage of a payable line by its bank's Available, from allocate_cash
+COVERED, PARTIAL, UNCOVERED = 0, 1, 2
+COVERAGE_STYLES = ['covered', 'partial', 'uncovered']  # REPORT_STYLES of each coverage
+# Rounding slack when comparing cumulated balances with Available: half a cent
+COVERAGE_TOLERANCE = 0.005
+
+DEFAULT_OPTIONS = {
+    'add_vba_buttons': True,  # Convert the report to .xlsm with the "Fix #REF!" macro and buttons
+    # vbaProject.bin holding FixRefErrors, extracted from an .xlsm saved by Excel (xlsxwriter's
+    # vba_extract.py): embedded while the report is written, so no Excel is needed. Without
+    # one, the buttons are added through Excel with add_vba_buttons(), on Windows only
+    'vba_project': None,
+    'constant_memory': False,  # Stream rows to disk so peak memory does not grow with the report
+    'workers': 0,  # Worker processes used to prepare the report sheets in parallel
+    'input_cache': CACHE_FOLDER,  # Directory caching the parsed input workbooks, None to disable
+    'excel_engine': 'auto',  # Row engine reading account_payables: 'calamine', 'openpyxl' or 'auto'
+    'trace': False,  # Time every stage and sheet, write a JSON trace next to the report and add it to METRICS
+    'incremental_state': None,  # Directory keeping each company's prepared rows between runs, None to disable
+    'aging_buckets': AGING_BUCKET_DAYS,  # Upper bounds in days of the AP_Aging buckets, None to leave the sheet out
+    'aging_as_of': None,  # Date the lines are aged at, today when None
+    'cash_coverage': True,  # Fill each line's balance by whether its bank's Available covers it, oldest first
+}
 
-# Check if the Account is a valid four-digit number (including strings with leading zeros)
-def valid_account(val):
-    if isinstance(val, str) and val.isdigit():
-        if len(val) == 4:
-            return val
+
+def default_input_paths(upload_folder: str = UPLOAD_FOLDER) -> Dict[str, str]:
+    """Return the upload paths of the three input workbooks, keyed by file type."""
+    return {file_type: os.path.join(upload_folder, f"{file_type}.xlsx") for file_type in INPUT_FILE_TYPES}
+
+
+class InputSchema(NamedTuple):
+    sheet_name: str  # The sheet the pipeline reads
+    columns: Dict[str, str]  # Header cells renamed to the INPUT_COLUMNS name they stand for
+
+
+def header_key(name: Any) -> Any:
+    """Fold a header cell so that accents, case and spacing do not tell names apart."""
+    if not isinstance(name, str):
+        return name
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).casefold().split())
+
+
+def match_columns(header: List[Any], required: List[str]) -> Tuple[Dict[str, str], List[str]]:
+    """Find the required columns in a header row.
+
+    A column is found under its exact name, or else under the first header cell that
+    only differs by accents, case or spacing ('Montant paye', 'CO. NO. ').
+
+    Returns:
+        Tuple[Dict[str, str], List[str]]: The header cells to rename to the required
+        names, and the required columns that were not found
+    """
+    present = set(header)
+    by_key = {}
+    for name in header:
+        if isinstance(name, str):
+            by_key.setdefault(header_key(name), name)
+    columns = {}
+    missing = []
+    for col in required:
+        if col in present:
+            continue
+        if header_key(col) in by_key:
+            columns[by_key[header_key(col)]] = col
         else:
-            return val.zfill(4)
-    else:
-        return 'nan'
-
-# Ensure both dataframes are valid for iteration and modification
-def clean_column(df, column):
-    if column in df.columns:
-        df[column] = df[column].astype(str).str.strip().replace(r'\.0$', '', regex=True).str.lower()
-        if column == 'Bank':
-            df[column] = df[column].apply(valid_account)
+            missing.append(col)
+    return columns, missing
+
+
+def choose_input_sheet(file_type: str, sheet_names: List[str]) -> str:
+    """Return which of a workbook's sheets is read for an input, per INPUT_SHEETS."""
+    name, position = INPUT_SHEETS[file_type]
+    return name if name in sheet_names else sheet_names[position]
+
+
+def preflight_input(file_type: str, path: str) -> InputSchema:
+    """Check that an input workbook has the sheet and columns the pipeline reads.
+
+    Only the sheet list and the header row of the chosen sheet are read (read_xlsx_header),
+    so a wrong file is rejected in milliseconds whatever its size, before any of it is
+    parsed. A file that cannot be used raises a ValueError naming what is missing.
+
+    Args:
+        file_type (str): One of INPUT_FILE_TYPES
+        path (str): The workbook
+
+    Returns:
+        InputSchema: The sheet to read and the header cells to rename
+    """
+    try:
+        sheet_names, sheet_name, header = read_xlsx_header(path, partial(choose_input_sheet, file_type))
+    except (zipfile.BadZipFile, zlib.error, ParseError, KeyError, StopIteration, ValueError) as e:
+        # Not an archive, corrupt or malformed XML parts, missing parts, or values that do not parse
+        raise ValueError(f"{file_type}: not a readable .xlsx workbook ({e.__class__.__name__}: {e})")
+    if sheet_name is None:
+        raise ValueError(f"{file_type}: the workbook has no sheets")
+
+    columns, missing = match_columns(header, INPUT_COLUMNS[file_type])
+    if missing:
+        preferred = INPUT_SHEETS[file_type][0]
+        no_preferred = f"there is no '{preferred}' sheet and " if preferred and preferred != sheet_name else ""
+        found = ', '.join(repr(name) for name in header if name != "") or 'none'
+        raise ValueError(f"{file_type}: {no_preferred}sheet '{sheet_name}' is missing the column(s) "
+                         f"{', '.join(repr(col) for col in missing)} (columns found: {found}; "
+                         f"sheets: {', '.join(sheet_names)})")
+    return InputSchema(sheet_name, columns)
+
+
+def input_schema(file_type: str, path: str, cache: Optional[InputCache] = None,
+                 digest: Optional[str] = None) -> InputSchema:
+    """Return the preflight_input result of a file, from the cache when the same content was checked before.
+
+    Args:
+        file_type (str): One of INPUT_FILE_TYPES
+        path (str): The workbook
+        cache (Optional[InputCache]): Keeps the result, keyed by the file's content
+        digest (Optional[str]): The file's file_digest, when the caller already has it
+
+    Returns:
+        InputSchema: The sheet to read and the header cells to rename
+    """
+    if cache is None:
+        return preflight_input(file_type, path)
+    digest = digest or file_digest(path)
+    variant = f"{file_type} schema: sheet {INPUT_SHEETS[file_type]}, columns {INPUT_COLUMNS[file_type]}"
+    stored = cache.load_schema(digest, variant)
+    if stored is not None:
+        return InputSchema(**stored)
+    schema = preflight_input(file_type, path)
+    cache.store_schema(digest, variant, schema._asdict())
+    return schema
+
+
+def _renamed(df: pd.DataFrame, schema: InputSchema) -> pd.DataFrame:
+    return df.rename(columns=schema.columns) if schema.columns else df
+
+
+def read_bank_balance(path: str, schema: InputSchema = None) -> pd.DataFrame:
+    """Read the "Balance" sheet of the bank balance workbook, or its first sheet."""
+    schema = schema or preflight_input('bank_balance', path)
+    return _renamed(pd.read_excel(path, sheet_name=schema.sheet_name), schema)
+
+
+def open_items_filter(header: List[Any], cutoff: str = AP_CUTOFF_DATE):
+    """Build a row filter discarding AP lines that clean_account_payables would drop.
+
+    Only rows that are certain to be dropped are discarded: lines without a date or dated
+    before the cutoff, and lines whose numeric Total equals their numeric paid amount.
+    Anything ambiguous (text dates, text amounts) is kept and left to clean_account_payables.
+    """
+    names = [translation_dict.get(col, col) for col in header]
+    date_idx = names.index('Date') if 'Date' in names else None
+    total_idx = names.index('Total') if 'Total' in names else None
+    paid_idx = names.index('Paid amount') if 'Paid amount' in names else None
+    cutoff_date = datetime.fromisoformat(cutoff)
+
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def row_filter(row: list) -> Optional[str]:
+        if date_idx is not None:
+            value = row[date_idx] if date_idx < len(row) else ""
+            if value == "" or (isinstance(value, datetime) and value < cutoff_date):
+                return f"before {cutoff}"
+        if total_idx is not None and paid_idx is not None:
+            total = row[total_idx] if total_idx < len(row) else ""
+            paid = row[paid_idx] if paid_idx < len(row) else ""
+            if is_number(total) and is_number(paid) and total == paid:
+                return "fully paid"
+        return None
+
+    return row_filter
+
+
+def read_account_payables(path: str, engine: str = 'auto', schema: InputSchema = None) -> pd.DataFrame:
+    """Read the open lines of the account payables workbook's first sheet.
+
+    Historical and fully paid lines are filtered out while the sheet is streamed,
+    so they never become pandas objects.
+    """
+    schema = schema or preflight_input('account_payables', path)
+
+    def make_filter(header: List[Any]):
+        return open_items_filter([schema.columns.get(col, col) for col in header])
+
+    df = read_filtered_sheet(path, make_filter, engine=engine, label='account_payables', sheet=schema.sheet_name)
+    return _renamed(df, schema)
+
+
+def read_cash_management(path: str, schema: InputSchema = None) -> pd.DataFrame:
+    """Read the last sheet of the cash management workbook."""
+    schema = schema or preflight_input('cash_management', path)
+    return _renamed(pd.read_excel(path, sheet_name=schema.sheet_name), schema)
+
+
+# Reader of each input and the cache variant describing how it reads the file
+INPUT_READERS = {
+    'bank_balance': (read_bank_balance, 'sheet "Balance", else the first sheet'),
+    'account_payables': (read_account_payables, f'first sheet, open lines since {AP_CUTOFF_DATE}'),
+    'cash_management': (read_cash_management, 'last sheet'),
+}
+
+
+def categorize_text_columns(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """Convert the listed columns to categoricals when all their values are text (in place)."""
+    for col in columns:
+        if col in df.columns and pd.api.types.infer_dtype(df[col], skipna=True) == 'string':
+            df[col] = df[col].astype('category')
     return df
 
-merge_keys = ['Company', 'Building', 'Bank']
-dataframes = [ap, bb, cm]
-for df in dataframes:
+
+def _read_input(reader: Callable[[str], pd.DataFrame], file_type: str, path: str) -> pd.DataFrame:
+    return categorize_text_columns(reader(path), INPUT_CATEGORIES[file_type])
+
+
+def load_inputs(inputs: Dict[str, str], cache: Optional[InputCache] = None, excel_engine: str = 'auto'):
+    """Read the bank balance, account payables and cash management workbooks.
+
+    Args:
+        inputs (Dict[str, str]): Paths of the input workbooks, keyed by file type
+        cache (Optional[InputCache]): Reuse frames parsed from identical files in earlier runs
+        excel_engine (str): Row engine streaming the account payables sheet, 'auto' to pick the fastest installed
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: The raw bank balance, account payables
+        and cash management frames
+    """
+    # Ensure all required files exist before reading
+    if not all(os.path.exists(inputs.get(f, '')) for f in INPUT_FILE_TYPES):
+        raise FileNotFoundError("One or more required input files are missing.")
+
+    # Check the sheet and header of every workbook before parsing any of them; files
+    # already checked when they were uploaded are found in the cache
+    digests = {file_type: file_digest(inputs[file_type]) for file_type in INPUT_FILE_TYPES} if cache is not None else {}
+    schemas = {file_type: input_schema(file_type, inputs[file_type], cache, digests.get(file_type))
+               for file_type in INPUT_FILE_TYPES}
+
+    frames = {}
+    for file_type in INPUT_FILE_TYPES:
+        reader, variant = INPUT_READERS[file_type]
+        if file_type == 'account_payables':
+            engine = resolve_engine(excel_engine)
+            reader = partial(reader, engine=engine)
+            variant = f"{variant}, {engine} engine"
+        reader = partial(_read_input, partial(reader, schema=schemas[file_type]), file_type)
+        if cache is not None:
+            frames[file_type] = cache.load(inputs[file_type], variant, reader, digest=digests[file_type])
+        else:
+            frames[file_type] = reader(inputs[file_type])
+
+    bb_raw, ap_raw, cm_raw = frames['bank_balance'], frames['account_payables'], frames['cash_management']
+    print(f"Shape of bank_balance_raw: {bb_raw.shape}\n")
+    print(f"Shape of ap_raw: {ap_raw.shape}\n")
+    print(f"Shape of cm_raw: {cm_raw.shape}\n")
+
+    return bb_raw, ap_raw, cm_raw
+
+
+def clean_account_payables(ap_raw: pd.DataFrame) -> pd.DataFrame:
+    """Translate, de-duplicate and keep only the open AP lines since the cutoff date."""
+    # drop_duplicates and the selection below already return new arrays, so ap_raw is left
+    # untouched; a shallow copy marks each as a frame of its own rather than a slice to write through
+    ap = ap_raw.drop_duplicates().copy(deep=False)
+    ap.columns = [translation_dict.get(col, col) for col in ap.columns]
+
+    ap['Paid amount'] = pd.to_numeric(ap['Paid amount'], errors='coerce').fillna(0)
+    ap['Date'] = pd.to_datetime(ap['Date'], errors='coerce')
+
+    # One selection for both filters instead of a copy per filter
+    ap = ap[(ap['Date'] >= AP_CUTOFF_DATE) & (ap['Total'] != ap['Paid amount'])].copy(deep=False)
+
+    # CT stands for reverse payment
+    ap.loc[ap['Comment'].str[:2] == 'CT', 'Total'] = pd.to_numeric(ap['Total'], errors='coerce') * (-1)
+    return ap
+
+
+def clean_cash_management(cm_raw: pd.DataFrame) -> pd.DataFrame:
+    """Rename the company column and flip the sign of 'Available'."""
+    cm = cm_raw.rename(columns={'Co. no.': 'Company'})
+    cm['Available'] = pd.to_numeric(cm['Available'], errors='coerce')
+    cm['Available'] = cm['Available'].replace(0, np.nan)
+    # Flip the sign of 'Available'
+    cm['Available'] = cm['Available'] * (-1)
+    return cm
+
+
+def normalize_key_values(values: pd.Series, key: str) -> Tuple[np.ndarray, pd.Index]:
+    """Canonicalize a merge key column.
+
+    Values are stripped, lowercased and lose a trailing ".0" (Excel often stores codes as
+    floats); Bank numbers must be digits and are zero-padded to four, anything else becomes
+    'nan'. The string operations run once per distinct value rather than once per row.
+
+    Args:
+        values (pd.Series): The raw key column
+        key (str): The key name, one of merge_keys
+
+    Returns:
+        Tuple[np.ndarray, pd.Index]: For each row, the code of its normalized value, and the
+        distinct normalized values
+    """
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        # Numbers factorize exactly, so only their distinct values need converting to text
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        uniques = pd.Series(uniques).astype(str)
+    else:
+        codes, uniques = pd.factorize(values.astype(str))
+    cleaned = pd.Series(uniques, dtype=object).str.strip().replace(r'\.0$', '', regex=True).str.lower()
+    if key == 'Bank':
+        # Check if the Account is a valid four-digit number (including strings with leading zeros)
+        cleaned = cleaned.str.zfill(4).where(cleaned.str.isdigit(), 'nan')
+    # Several raw spellings may normalize to the same key
+    cleaned_codes, cleaned_uniques = pd.factorize(cleaned)
+    return cleaned_codes[codes], pd.Index(cleaned_uniques, dtype=object)
+
+
+def normalize_keys(ap: pd.DataFrame, bb: pd.DataFrame, cm: pd.DataFrame):
+    """Canonicalize the merge keys of the three input frames as shared categoricals.
+
+    Each key gets one CategoricalDtype across the frames that have it, so the merges
+    compare integer codes instead of Python strings.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: Copies of ap, bb and cm with normalized keys
+    """
+    # Assigning a column never writes into the original arrays, so shallow copies are enough
+    frames = [ap.copy(deep=False), bb.copy(deep=False), cm.copy(deep=False)]
     for key in merge_keys:
-        if key in df.columns:
-            df = clean_column(df, key)
+        holders = [df for df in frames if key in df.columns]
+        normalized = [normalize_key_values(df[key], key) for df in holders]
+        categories = sorted(set().union(*(uniques for _, uniques in normalized)))
+        key_dtype = pd.CategoricalDtype(categories)
+        for df, (codes, uniques) in zip(holders, normalized):
+            positions = key_dtype.categories.get_indexer(uniques)
+            df[key] = pd.Categorical.from_codes(positions[codes], dtype=key_dtype)
+    ap, bb, cm = frames
+    return ap, bb, cm
+
+
+def _key_codes(df: pd.DataFrame, keys: List[str]) -> np.ndarray:
+    """Combine the categorical codes of several key columns into one int64 code per row, -1 if any is missing."""
+    codes = np.zeros(len(df), dtype=np.int64)
+    missing = np.zeros(len(df), dtype=bool)
+    for key in keys:
+        column = df[key].cat
+        key_codes = column.codes.to_numpy(dtype=np.int64)
+        missing |= key_codes < 0
+        codes = codes * len(column.categories) + key_codes
+    codes[missing] = -1
+    return codes
+
+
+class LookupIndex:
+    """The distinct rows of a lookup table, indexed by their (categorical) merge keys.
+
+    Args:
+        table (pd.DataFrame): bank_balance or cash_management, after normalize_keys
+        keys (List[str]): The merge keys
+        columns (List[str]): The columns the lookup adds to the AP lines
+        name (str): Name of the table in the join report
+    """
+
+    def __init__(self, table: pd.DataFrame, keys: List[str], columns: List[str], name: str):
+        self.keys = keys
+        self.columns = columns
+        self.name = name
+        # Rows repeated in the table would only repeat AP lines: keep one of each
+        self.rows = table[keys + columns].drop_duplicates().reset_index(drop=True)
+        self.key_dtypes = [self.rows[key].dtype for key in keys]
+        self.index = pd.Index(_key_codes(self.rows, keys)) if self.indexable else None
+
+    @property
+    def indexable(self) -> bool:
+        return all(isinstance(dtype, pd.CategoricalDtype) for dtype in self.key_dtypes)
+
+    @property
+    def is_unique(self) -> bool:
+        return self.index is not None and self.index.is_unique
+
+    def conflicts(self) -> pd.DataFrame:
+        """Return the rows whose keys map to several different values."""
+        return self.rows[self.rows.duplicated(self.keys, keep=False)]
+
+    def join(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Left-join the lookup columns onto df, like pd.merge(df, rows, on=keys, how='left').
+
+        When every key is unique this is a single vectorized lookup that never adds rows.
+        Keys mapping to several rows are reported and joined with pd.merge, which repeats
+        the AP lines once per match as before.
+        """
+        clashes = [col for col in self.columns if col in df.columns]
+        same_keys = all(df[key].dtype == dtype for key, dtype in zip(self.keys, self.key_dtypes))
+        if not (self.is_unique and same_keys) or clashes:
+            if self.index is not None and not self.index.is_unique:
+                conflicts = self.conflicts()
+                print(f"Join warning: {conflicts[self.keys].drop_duplicates().shape[0]} key(s) of {self.name} "
+                      f"match several rows, their AP lines are repeated:\n{conflicts}\n")
+            return pd.merge(df, self.rows, on=self.keys, how='left')
+
+        positions = self.index.get_indexer(_key_codes(df, self.keys))
+        missing = positions < 0
+        if missing.any():
+            missing_keys = df.loc[missing, self.keys].drop_duplicates()
+            print(f"Join report: {missing.sum()} AP line(s) have no match in {self.name} "
+                  f"({len(missing_keys)} distinct {', '.join(self.keys)})\n")
+
+        # A shallow copy with a fresh index: the lookup columns are new arrays, the rest are shared
+        result = df.copy(deep=False)
+        result.index = pd.RangeIndex(len(result))
+        for col in self.columns:
+            result[col] = pd.api.extensions.take(self.rows[col].values, positions, allow_fill=True)
+        return result
+
+
+def merge_inputs(ap: pd.DataFrame, bb: pd.DataFrame, cm: pd.DataFrame) -> pd.DataFrame:
+    """Enrich the AP lines with company, bank account, status and available cash.
+
+    The lookup tables are indexed once and joined with one vectorized lookup each,
+    so the result has exactly one row per AP line unless a key is ambiguous.
+    """
+    lookups = [
+        LookupIndex(bb, ['Company'], ['Company Name'], 'bank_balance companies'),
+        LookupIndex(bb, ['Company', 'Building'], ['Bank', 'Bank Account', 'Status'], 'bank_balance buildings'),
+        LookupIndex(cm, ['Company', 'Bank'], ['Available'], 'cash_management banks'),
+    ]
+    df = ap
+    for lookup in lookups:
+        df = lookup.join(df)
+
+    #df.loc[df['Building'] == 'nan', ['Bank Account','Available']] = np.nan
+
+    # Calculate Balance of Account Payable
+    df['Payable Balance'] = df['Total'] - df['Paid amount']
+    return df
 
-# Perform the merge
-df = pd.merge(
-    ap,
-    bb[['Company', 'Company Name']],
-    on='Company',
-    how='left'
-)
 
-df = pd.merge(
-    df,
-    bb[['Company', 'Building', 'Bank', 'Bank Account', 'Status']],
-    on=['Company', 'Building'],
-    how='left'
-)
+def split_by_status(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Filter the merged frame and split it into the report's Active, Others, Zagora and AR frames."""
+    # Drop the PPA suppliers and all records whose 'Status' == 'REMOVE', in one selection
+    keep = ~df['Supplier code'].isin(PPA_supplier_codes) & (df['Status'] != 'REMOVE')
+    df_keep = df.loc[keep, cols_to_keep]
+    df_keep.columns = [col.title() for col in df_keep.columns]
+    df_keep.rename(columns={'Bank Account': 'Bank'}, inplace=True)
+    df_AR = df_keep[df_keep['Supplier Name'] == 'Gestion Hazout Inc']
+
+    df_keep = df_keep.set_index(['Company Name', 'Bank', 'Available', 'Supplier Name']).sort_index()
+    df_keep.sort_values(by=['Date', 'Invoice No'], ascending=True, inplace=True)
+    df_keep.drop_duplicates(inplace=True)
+    df_AR = df_AR.set_index(['Company Name', 'Bank', 'Available', 'Supplier Name']).sort_index()
+    df_AR.sort_values(by=['Date', 'Invoice No'], ascending=True, inplace=True)
+    df_AR.drop_duplicates(inplace=True)
+
+    # Filter rows based on Status
+    df_active = df_keep[df_keep['Status'] == 'ACTIVE'].drop(columns=['Status'])
+    df_zagora = df_keep[df_keep['Status'] == 'ZAGORA'].drop(columns=['Status'])
+    df_others = df_keep[(df_keep['Status'] != 'ACTIVE') & (df_keep['Status'] != 'ZAGORA')]
+
+    return {'active': df_active, 'others': df_others, 'zagora': df_zagora, 'AR': df_AR}
+
+
+# The totals below are the results of the formulas written on the total rows: Sum of
+# Balance (J), Available (C, None when the cell is blank) and Net of Balance (K)
+
+class SupplierBlock(NamedTuple):
+    supplier: Any
+    header_row: int
+    start: int  # Detail rows are SheetLayout.order[start:stop]
+    stop: int
+    total_row: int
+    total: float
+
+
+class BankBlock(NamedTuple):
+    bank: Any
+    available: Any
+    header_row: int
+    suppliers: List[SupplierBlock]
+    total_row: int
+    total: float
+    available_total: Optional[float]
+    net: float
+
+
+class CompanyBlock(NamedTuple):
+    company: Any
+    header_row: int  # Shared with the header row of the first bank
+    banks: List[BankBlock]
+    total_row: int
+    total: float
+    available_total: Optional[float]
+    net: float
+
+
+class SheetLayout(NamedTuple):
+    order: np.ndarray  # Positions of the detail records in the order they are written
+    companies: List[CompanyBlock]
+    grand_total_row: Optional[int]
+    end_row: int  # First row after the last company total
+    grand_total: Optional[float] = None
+    grand_available_total: Optional[float] = None
+    grand_net: Optional[float] = None
+
+
+def _group_codes(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Factorize a key column in groupby order (sorted, missing values last)."""
+    codes, uniques = pd.factorize(values, sort=True, use_na_sentinel=False)
+    return codes, np.asarray(uniques, dtype=object)
+
+
+def _to_number(value: Any) -> Optional[float]:
+    """Convert a cell value to a float like ExcelReportGenerator._safe_numeric, None when blank."""
+    if pd.isna(value) or value == '':
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _sum_available(values: List[Optional[float]]) -> Optional[float]:
+    """SUM of the Available cells of the blocks that write one, None when none does."""
+    present = [value for value in values if value is not None]
+    return sum(present) if present else None
+
+
+def plan_sheet_layout(df: pd.DataFrame, include_grand_total: bool = True, first_row: int = 1) -> SheetLayout:
+    """Plan the Company -> (Bank, Available) -> Supplier layout of a report sheet.
+
+    The frame is sorted once and the group boundaries are found with np.diff on the
+    key codes, so the writer only has to replay the returned row numbers. Groups come
+    out in the same order as nested groupby calls: rows without a company are left
+    out, missing banks and availables form their own group last, and rows without a
+    supplier still open their bank group but write no supplier block.
+
+    The supplier totals are summed with one np.add.reduceat over the ordered Payable
+    Balance values; bank, company and grand totals add those up the way the formulas do.
+    """
+    if 'Company Name' not in df.columns:
+        # Frames from split_by_status still carry the hierarchy in their index
+        df = df.reset_index()
+    company_codes, companies = _group_codes(df['Company Name'])
+    bank_codes, banks = _group_codes(df['Bank'])
+    available_codes, availables = _group_codes(df['Available'])
+    supplier_codes, suppliers = _group_codes(df['Supplier Name'])
+
+    # Sort once by the hierarchy; the position tie-break keeps each group in frame order
+    keep = np.flatnonzero(df['Company Name'].notna().to_numpy())
+    sort_keys = (keep, supplier_codes[keep], available_codes[keep], bank_codes[keep], company_codes[keep])
+    ordered = keep[np.lexsort(sort_keys)]
+
+    company_run = company_codes[ordered]
+    bank_run = bank_codes[ordered]
+    available_run = available_codes[ordered]
+    supplier_run = supplier_codes[ordered]
+    supplier_missing = df['Supplier Name'].isna().to_numpy()[ordered]
+
+    def starts_of(*runs: np.ndarray) -> np.ndarray:
+        changed = np.zeros(len(ordered), dtype=bool)
+        if len(ordered):
+            changed[0] = True
+        for run in runs:
+            changed[1:] |= np.diff(run) != 0
+        return np.flatnonzero(changed)
+
+    company_starts = starts_of(company_run)
+    bank_starts = starts_of(company_run, bank_run, available_run)
+    supplier_starts = starts_of(company_run, bank_run, available_run, supplier_run)
+    bank_stops = np.append(bank_starts[1:], len(ordered))
+    supplier_stops = np.append(supplier_starts[1:], len(ordered))
+
+    # Detail positions exclude the rows that have no supplier
+    detail_offsets = np.concatenate(([0], np.cumsum(~supplier_missing)))
+    order = ordered[~supplier_missing]
+
+    # Non-finite balances are written as blank cells, which SUM skips
+    balance = pd.to_numeric(df['Payable Balance'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    balance = np.where(np.isfinite(balance), balance, 0.0)
+    block_starts = detail_offsets[supplier_starts[~supplier_missing[supplier_starts]]]
+    supplier_totals = np.add.reduceat(balance[order], block_starts) if len(block_starts) else np.zeros(0)
+    supplier_total_index = 0
+
+    row = first_row
+    company_blocks = []
+    bank_index = 0
+    supplier_index = 0
+    for company_index, company_start in enumerate(company_starts):
+        company_stop = company_starts[company_index + 1] if company_index + 1 < len(company_starts) else len(ordered)
+        company_header_row = row
+        bank_blocks = []
+        while bank_index < len(bank_starts) and bank_starts[bank_index] < company_stop:
+            first = ordered[bank_starts[bank_index]]
+            bank_header_row = row
+            row += 1
+            supplier_blocks = []
+            while supplier_index < len(supplier_starts) and supplier_starts[supplier_index] < bank_stops[bank_index]:
+                start, stop = supplier_starts[supplier_index], supplier_stops[supplier_index]
+                supplier_index += 1
+                if supplier_missing[start]:
+                    continue
+                header_row = row
+                row += 1 + (stop - start)
+                supplier_blocks.append(SupplierBlock(
+                    suppliers[supplier_run[start]], header_row,
+                    int(detail_offsets[start]), int(detail_offsets[stop]), row,
+                    float(supplier_totals[supplier_total_index])
+                ))
+                supplier_total_index += 1
+                row += 1
+            available = availables[available_codes[first]]
+            available_total = _to_number(available)
+            bank_total = sum(supplier.total for supplier in supplier_blocks)
+            bank_blocks.append(BankBlock(
+                banks[bank_codes[first]], available,
+                bank_header_row, supplier_blocks, row,
+                bank_total, available_total, (available_total or 0.0) - bank_total
+            ))
+            row += 1
+            bank_index += 1
+        company_total = sum(bank.total for bank in bank_blocks)
+        company_available = _sum_available([bank.available_total for bank in bank_blocks])
+        company_blocks.append(CompanyBlock(
+            companies[company_run[company_start]], company_header_row, bank_blocks, row,
+            company_total, company_available, (company_available or 0.0) - company_total
+        ))
+        row += 1
+
+    grand_total_row = row if include_grand_total else None
+    grand_total = sum(company.total for company in company_blocks)
+    grand_available = _sum_available([company.available_total for company in company_blocks])
+    return SheetLayout(order, company_blocks, grand_total_row, row,
+                       grand_total, grand_available, (grand_available or 0.0) - grand_total)
+
+
+def allocate_cash(df: pd.DataFrame) -> np.ndarray:
+    """Spend each bank's Available on its payable lines, oldest first, and say which lines it covers.
+
+    Lines are grouped like the bank blocks of the sheet (Company Name, Bank and
+    Available) and ordered by date within each group with one stable lexsort, so
+    lines of the same day keep the sheet's invoice order and undated lines come last.
+    A cumulative sum of the balances, restarted at every group, then tells what the
+    group has paid before and through each line: the line is covered when Available
+    pays it in full, partial when the money runs out on it, and uncovered after that.
+    Credits (balances of zero or less) need no cash and are covered; their amount adds
+    back to what the following lines can use. A blank Available is no cash.
+
+    Lines without a company or supplier are not written in the sheet and take no cash.
+
+    Args:
+        df (pd.DataFrame): A frame from split_by_status, with its index reset
+
+    Returns:
+        np.ndarray: COVERED, PARTIAL or UNCOVERED for each row of df (int8)
+    """
+    company_codes, _ = _group_codes(df['Company Name'])
+    bank_codes, _ = _group_codes(df['Bank'])
+    available_codes, availables = _group_codes(df['Available'])
+    keep = np.flatnonzero(df['Company Name'].notna().to_numpy() & df['Supplier Name'].notna().to_numpy())
+
+    dates = df['Date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    dates = np.where(dates == np.iinfo(np.int64).min, np.iinfo(np.int64).max, dates)  # NaT last
+    ordered = keep[np.lexsort((dates[keep], available_codes[keep], bank_codes[keep], company_codes[keep]))]
+
+    group_start = np.zeros(len(ordered), dtype=bool)
+    group_start[:1] = True
+    for codes in (company_codes, bank_codes, available_codes):
+        run = codes[ordered]
+        group_start[1:] |= run[1:] != run[:-1]
+    starts = np.flatnonzero(group_start)
+
+    balance = pd.to_numeric(df['Payable Balance'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)[ordered]
+    balance = np.where(np.isfinite(balance), balance, 0.0)
+    available = np.array([_to_number(value) for value in availables], dtype=float)
+    available = np.where(np.isfinite(available), available, 0.0)[available_codes[ordered]]
+
+    # Cumulative sum within each group: the running total minus what came before the group
+    paid_through = np.cumsum(balance)
+    paid_through -= np.repeat((paid_through - balance)[starts], np.diff(np.append(starts, len(ordered))))
+    paid_before = paid_through - balance
+
+    status = np.full(len(ordered), UNCOVERED, dtype=np.int8)
+    status[paid_before < available - COVERAGE_TOLERANCE] = PARTIAL
+    status[(paid_through <= available + COVERAGE_TOLERANCE) | (balance <= 0)] = COVERED
+    coverage = np.full(len(df), UNCOVERED, dtype=np.int8)
+    coverage[ordered] = status
+    return coverage
+
+
+def company_sheet_layout(layout: SheetLayout, company: CompanyBlock, first_row: int = 1) -> SheetLayout:
+    """Move one company block of a planned sheet to the top of its own sheet, without a grand total.
+
+    The detail slices still point into layout.order, so the result replays the same
+    detail rows as the sheet the block was planned for.
+    """
+    company = _shift_company(company, first_row - company.header_row)
+    return SheetLayout(layout.order, [company], None, company.total_row + 1)
+
+
+def _shift_company(company: CompanyBlock, row_shift: int, order_shift: int = 0) -> CompanyBlock:
+    """Move a company block down by row_shift rows and its detail slices by order_shift positions."""
+    banks = [
+        bank._replace(
+            header_row=bank.header_row + row_shift,
+            suppliers=[
+                supplier._replace(
+                    header_row=supplier.header_row + row_shift,
+                    start=supplier.start + order_shift,
+                    stop=supplier.stop + order_shift,
+                    total_row=supplier.total_row + row_shift
+                )
+                for supplier in bank.suppliers
+            ],
+            total_row=bank.total_row + row_shift
+        )
+        for bank in company.banks
+    ]
+    return company._replace(header_row=company.header_row + row_shift, banks=banks,
+                            total_row=company.total_row + row_shift)
+
+
+# Rows formatted at a time when measuring numbers, which bounds numpy's fixed-width buffer
+_LENGTH_CHUNK_ROWS = 65536
+
+
+def _str_lengths(values: np.ndarray) -> np.ndarray:
+    """Return len(str(value)) of each element, formatting in numpy rather than one Python string per row."""
+    lengths = np.empty(len(values), dtype=np.int64)
+    for start in range(0, len(values), _LENGTH_CHUNK_ROWS):
+        chunk = values[start:start + _LENGTH_CHUNK_ROWS]
+        lengths[start:start + len(chunk)] = np.char.str_len(chunk.astype(str))
+    return lengths
+
+
+def _text_lengths(values: pd.Series) -> np.ndarray:
+    """Measure each value of a column as column_widths fits it: len(str(value)), dates as YYYY-MM-DD."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        # A date is 'YYYY-MM-DD', a missing one 'nan'
+        return np.where(values.isna().to_numpy(), 3, 10)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = [len(str(category)) for category in values.cat.categories]
+        return np.array(categories + [3], dtype=np.int64)[values.cat.codes.to_numpy()]
+    if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf':
+        return _str_lengths(values.to_numpy())
+
+    array = values.to_numpy(dtype=object)
+    if pd.api.types.infer_dtype(array, skipna=True) not in ('string', 'empty'):
+        # Mixed values: factorizing would merge 1, 1.0 and True, which print differently
+        return _str_lengths(array)
+    # Text: measure each distinct string once
+    codes, uniques = pd.factorize(array)
+    lengths = np.array([len(value) for value in uniques] + [0], dtype=np.int64)[codes]
+    missing = codes == -1
+    if missing.any():
+        lengths[missing] = _str_lengths(array[missing])
+    return lengths
+
+
+def text_lengths(df: pd.DataFrame) -> np.ndarray:
+    """Measure every cell of a frame once, as a (rows, columns) array column_widths and company_column_widths reuse."""
+    lengths = np.zeros((len(df), len(df.columns)), dtype=np.int64)
+    for col_idx in range(len(df.columns)):
+        lengths[:, col_idx] = _text_lengths(df.iloc[:, col_idx])
+    return lengths
+
+
+def _fit_widths(max_lengths: Iterable[int], headers: Iterable[Any]) -> List[int]:
+    return [max(int(length), len(str(header))) + 2 for length, header in zip(max_lengths, headers)]
+
+
+def column_widths(df: pd.DataFrame, lengths: Optional[np.ndarray] = None) -> List[int]:
+    """Measure the column widths needed to fit the content of the frame.
+
+    Args:
+        df (pd.DataFrame): The rows of the sheet
+        lengths (np.ndarray): text_lengths(df), when already measured
+
+    Returns:
+        List[int]: One width per column, none for an empty frame
+    """
+    if df.empty:
+        return []
+    if lengths is None:
+        lengths = text_lengths(df)
+    return _fit_widths(lengths.max(axis=0), df.columns)
+
+
+def company_column_widths(df: pd.DataFrame, lengths: np.ndarray) -> Dict[Any, List[int]]:
+    """Column widths of each company's rows, from one groupby-max over the sheet's measured lengths.
+
+    Args:
+        df (pd.DataFrame): The rows of the sheet, with a 'Company Name' column
+        lengths (np.ndarray): text_lengths(df)
+
+    Returns:
+        Dict[Any, List[int]]: The widths column_widths gives each company's rows, rows without a company left out
+    """
+    maxima = pd.DataFrame(lengths, index=df.index).groupby(df['Company Name'], sort=False, observed=True).max()
+    return {company: _fit_widths(row, df.columns) for company, row in zip(maxima.index, maxima.to_numpy())}
+
+
+def _clean_value(value: Any) -> Union[float, str, None]:
+    """Clean and prepare values for Excel writing."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, (float, np.floating)):
+        if np.isinf(value) or np.isnan(value):
+            return None
+        return float(value)
+    if isinstance(value, (int, np.integer)):
+        return float(value)
+    if isinstance(value, str) and value.strip() == '':
+        return None
+    return value
+
+
+def _safe_numeric(value: Any) -> float:
+    """Safely convert value to numeric, preserving NaN values."""
+    if pd.isna(value) or value == '':
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
 
-df = pd.merge(
-    df,
-    cm[['Company', 'Bank', 'Available']],
-    on=['Company', 'Bank'],
-    how='left'
-)
 
-#df.loc[df['Building'] == 'nan', ['Bank Account','Available']] = np.nan
+def _safe_date(value: Any) -> Union[datetime, str]:
+    """Safely convert value to datetime, returning empty string if not possible."""
+    if pd.isna(value) or value == '':
+        return ''
+    try:
+        if isinstance(value, datetime):
+            return value
+        elif isinstance(value, str):
+            return pd.to_datetime(value).to_pydatetime()
+        else:
+            return ''
+    except (ValueError, TypeError):
+        return ''
 
-# Calculate Balance of Account Payable
-df['Payable Balance'] = df['Total'] - df['Paid amount']
 
+def _finite_or_none(values: np.ndarray) -> np.ndarray:
+    """Convert a float array to Python floats, with NaN and inf replaced by None."""
+    cleaned = values.astype(object)
+    cleaned[~np.isfinite(values)] = None
+    return cleaned
 
-# Exclude PPA suppliers from the balance sheet
-PPA_supplier_codes = [
-    'ALT003', 'BEL001', 'BRA001', 'CONR001', 'ENE001', 'ENVIROCONN', 'GAZIFERE',
-    'HYDROSOL', 'HYDRO', 'HYDRO WEST', 'INTELECOM', 'MILLER WAS', 'NOVA SCOTI',
-    'PRIMACO', 'SUPERIEUR', 'VIDEOTRON']
-df_clean = df[~df['Supplier code'].isin(PPA_supplier_codes)]
 
-# Remove all records whose 'Status' == 'REMOVE'
-df_clean = df_clean[df_clean['Status'] != 'REMOVE']
+def _clean_column(values: pd.Series) -> np.ndarray:
+    """Column-wise equivalent of calling _clean_value on every cell."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Clean each category once and look the cells up by code; code -1 (missing) picks None
+        categories = _clean_column(pd.Series(values.cat.categories, dtype=object))
+        return np.append(categories, None)[values.cat.codes.to_numpy()]
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return _finite_or_none(values.to_numpy(dtype=float, na_value=np.nan))
+    if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+        return np.array([_clean_value(v) for v in values], dtype=object)
 
-cols_to_keep = ['Company Name', 'Bank Account', 'Available', 'Supplier name', 'Date',
-                'Invoice no', 'Comment', 'Total', 'Paid amount', 'Payable Balance', 'Status']
-df_keep = df_clean[cols_to_keep]
-df_keep.columns = [col.title() for col in df_keep.columns]
-df_keep.rename(columns={'Bank Account': 'Bank'}, inplace=True)
-df_AR = df_keep[df_keep['Supplier Name'] == 'Gestion Hazout Inc']
-
-df_keep = df_keep.set_index(['Company Name', 'Bank', 'Available', 'Supplier Name']).sort_index()
-df_keep.sort_values(by=['Date', 'Invoice No'], ascending=True, inplace=True)
-df_keep.drop_duplicates(inplace=True)
-df_AR = df_AR.set_index(['Company Name', 'Bank', 'Available', 'Supplier Name']).sort_index()
-df_AR.sort_values(by=['Date', 'Invoice No'], ascending=True, inplace=True)
-df_AR.drop_duplicates(inplace=True)
-
-# Filter rows based on Status
-df_active = df_keep[df_keep['Status'] == 'ACTIVE']
-df_active.drop(columns=['Status'], inplace=True)
-df_zagora = df_keep[df_keep['Status'] == 'ZAGORA']
-df_zagora.drop(columns=['Status'], inplace=True)
-df_others = df_keep[(df_keep['Status'] != 'ACTIVE') & (df_keep['Status'] != 'ZAGORA')]
+    values = values.astype(object)
+    try:
+        stripped = values.str.strip()  # NaN for anything that is not a string
+    except AttributeError:
+        return np.array([_clean_value(v) for v in values], dtype=object)
+
+    cleaned = values.to_numpy(copy=True)
+    missing = values.isna().to_numpy()
+    cleaned[missing] = None
+    cleaned[stripped.eq('').to_numpy()] = None
+    # Numbers or dates mixed into a text column go through the scalar path
+    mixed = stripped.isna().to_numpy() & ~missing
+    if mixed.any():
+        cleaned[mixed] = [_clean_value(v) for v in cleaned[mixed]]
+    return cleaned
+
+
+def _numeric_column(values: pd.Series) -> np.ndarray:
+    """Column-wise equivalent of calling _clean_value(_safe_numeric(...)) on every cell."""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return _finite_or_none(values.to_numpy(dtype=float, na_value=np.nan))
+    return np.array([_clean_value(_safe_numeric(v)) for v in values], dtype=object)
+
+
+def _date_column(values: pd.Series) -> np.ndarray:
+    """Column-wise equivalent of calling _safe_date on every cell."""
+    if pd.api.types.is_datetime64_dtype(values):
+        # datetime64[us] converts straight to datetime.datetime objects
+        dates = values.to_numpy(dtype='datetime64[us]').astype(object)
+        dates[values.isna().to_numpy()] = ''
+        return dates
+    return np.array([_safe_date(v) for v in values], dtype=object)
+
+
+def prepare_detail_rows(df: pd.DataFrame, has_status: bool) -> List[tuple]:
+    """Clean the detail columns once per sheet and return one row tuple per record.
+
+    The tuples start at the Date column (E); the four leading columns of a
+    detail row are always blank. Row i of the result matches df.iloc[i].
+    """
+    columns = [
+        _date_column(df['Date']),
+        _clean_column(df['Invoice No']),
+        _clean_column(df['Comment']),
+        _numeric_column(df['Total']),
+        _numeric_column(df['Paid Amount']),
+        _numeric_column(df['Payable Balance']),
+        [''] * len(df),  # Net of Balance placeholder
+    ]
+    if has_status:
+        columns.append(_clean_column(df['Status']))
+    return list(zip(*columns))
+
+
+# Named cell styles of the report, registered once per workbook by ExcelReportGenerator
+REPORT_STYLES = {
+    'header': {
+        'bold': True,
+        'align': 'left',
+        'valign': 'bottom',
+        'font_name': 'Calibri',
+        # Add top and bottom thick border lines
+        'top': 2,
+        'bottom': 2,
+    },
+    'date': {
+        'num_format': 'yyyy-mm-dd',
+        'align': 'center'
+    },
+    'number': {
+        'num_format': '#,##0.00_);(#,##0.00)',
+        'align': 'right'
+    },
+    'negative': {
+        'font_color': 'red',
+        'num_format': '#,##0.00_);(#,##0.00)'
+    },
+    'supplier_total': {
+        'bold': True,
+        'num_format': '#,##0.00_);(#,##0.00)'
+    },
+    'bank_total': {
+        'bold': True,
+        'bg_color': '#E8E8E8',
+        'num_format': '#,##0.00_);(#,##0.00)'
+    },
+    'company_total': {
+        'bold': True,
+        'bg_color': '#D3D3D3',
+        'num_format': '#,##0.00_);(#,##0.00)',
+        'bottom': 2
+    },
+    'grand_total': {
+        'bold': True,
+        'bg_color': '#B0B0B0',
+        'num_format': '#,##0.00_);(#,##0.00)',
+        'bottom': 2
+    },
+    # Sum of Balance of a detail line, by what its bank's Available covers (COVERAGE_STYLES)
+    'covered': {
+        'bg_color': '#C6EFCE',
+        'num_format': '#,##0.00_);(#,##0.00)'
+    },
+    'partial': {
+        'bg_color': '#FFEB9C',
+        'num_format': '#,##0.00_);(#,##0.00)'
+    },
+    'uncovered': {
+        'bg_color': '#FFC7CE',
+        'num_format': '#,##0.00_);(#,##0.00)'
+    },
+}
+
+COVERAGE_NOTE = ("Available of the bank spent on its lines, oldest first. Green: covered in full; "
+                 "yellow: the money runs out on this line; red: not covered.")
+
+
+# calcId of the Excel calculation engine that computed the cached formula results; Excel
+# recalculates files saved with an older engine (xlsxwriter's default is Excel 2007's)
+FORMULA_RESULTS_CALC_ID = 191029
 
 
 class ExcelReportGenerator:
-    def __init__(self, output_file: str):
+    def __init__(self, output_file: str, constant_memory: bool = False, workers: int = 0, vba_project: str = None,
+                 trace: RunTrace = None, incremental: IncrementalStore = None, cash_coverage: bool = False):
         """Initialize the Excel Report Generator.
 
         Args:
             output_file (str): The path where the Excel file will be saved
+            constant_memory (bool): Stream each row to disk as soon as it is written
+                (xlsxwriter's constant_memory mode) instead of keeping every cell of
+                every sheet in memory until the workbook is closed
+            workers (int): Number of worker processes that clean and plan the sheets
+                in parallel; 0 prepares them one after another in this process
+            vba_project (str): Path of a vbaProject.bin to embed, with a "Fix #REF!" button
+                on every sheet; output_file should then end in .xlsm
+            trace (RunTrace): Records a 'create_sheet' span for every sheet written
+            incremental (IncrementalStore): Previous run's per-company results; only the
+                companies whose rows changed are prepared again (workers are not used then)
+            cash_coverage (bool): Fill the Sum of Balance of each detail line by whether
+                its bank's Available covers it (allocate_cash)
         """
         self.output_file = output_file
-        self.writer = None
+        self.constant_memory = constant_memory
+        self.workers = workers
+        self.vba_project = vba_project
+        self.trace = trace or RunTrace(enabled=False)
+        self.incremental = incremental
+        self.cash_coverage = cash_coverage
         self.workbook = None
+        self.formats = {}
         self.header_format = None
         self.date_format = None
 
     def __enter__(self):
-        self.writer = pd.ExcelWriter(
+        # xlsxwriter is used directly because pandas' ExcelWriter refuses .xlsm paths
+        self.workbook = xlsxwriter.Workbook(
             self.output_file,
-            engine='xlsxwriter',
-            engine_kwargs={'options': {'nan_inf_to_errors': True}}
+            {'nan_inf_to_errors': True, 'constant_memory': self.constant_memory}
         )
-        self.workbook = self.writer.book
-        self.header_format = self.workbook.add_format({
-            'bold': True,
-            'align': 'left',
-            'valign': 'bottom',
-            'font_name': 'Calibri',
-            # Add top and bottom thick border lines
-            'top': 2,
-            'bottom': 2,
-        })
-        self.date_format = self.workbook.add_format({
-            'num_format': 'yyyy-mm-dd',
-            'align': 'center'
-        })
+        if self.vba_project:
+            self.workbook.add_vba_project(self.vba_project)
+        # Every formula is written with its result, so Excel need not recalculate on open
+        self.workbook.set_calc_mode('auto', calc_id=FORMULA_RESULTS_CALC_ID)
+        self.workbook.calc_on_load = False
+        # Build every named style once; sheets look them up instead of calling add_format per row
+        self.formats = {name: self.workbook.add_format(properties) for name, properties in REPORT_STYLES.items()}
+        self.header_format = self.formats['header']
+        self.date_format = self.formats['date']
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.writer is not None:
-            self.writer.close()
-
-    def _clean_value(self, value: Any) -> Union[float, str, None]:
-        """Clean and prepare values for Excel writing."""
-        if pd.isna(value):
-            return None
-        if isinstance(value, (float, np.floating)):
-            if np.isinf(value) or np.isnan(value):
-                return None
-            return float(value)
-        if isinstance(value, (int, np.integer)):
-            return float(value)
-        if isinstance(value, str) and value.strip() == '':
-            return None
-        return value
-
-    def _safe_numeric(self, value: Any) -> float:
-        """Safely convert value to numeric, preserving NaN values."""
-        if pd.isna(value) or value == '':
-            return None
-        try:
-            return float(value)
-        except (ValueError, TypeError):
-            return None
-
-    def _safe_date(self, value: Any) -> Union[datetime, str]:
-        """Safely convert value to datetime, returning empty string if not possible."""
-        if pd.isna(value) or value == '':
-            return ''
-        try:
-            if isinstance(value, datetime):
-                return value
-            elif isinstance(value, str):
-                return pd.to_datetime(value).to_pydatetime()
-            else:
-                return ''
-        except (ValueError, TypeError):
-            return ''
+        if self.workbook is not None:
+            self.workbook.close()
 
-    def _adjust_column_widths(self, worksheet, *dfs: pd.DataFrame):
+    def _adjust_column_widths(self, worksheet, widths: List[int]):
         """Adjust column widths based on content."""
-        max_cols = max((len(df.columns) for df in dfs if not df.empty), default=0)
-        for col_idx in range(max_cols):
-            max_width = 0
-            for df in dfs:
-                if not df.empty and col_idx < len(df.columns):
-                    col_values = df.iloc[:, col_idx]
-                    # Handle datetime columns
-                    if pd.api.types.is_datetime64_any_dtype(col_values):
-                        col_values = col_values.dt.strftime('%Y-%m-%d')
-
-                    col_values = col_values.astype(str)
-                    max_width = max(
-                        max_width,
-                        col_values.map(len).max(),
-                        len(str(df.columns[col_idx]))
-                    )
-            worksheet.set_column(col_idx, col_idx, max_width + 2)
+        for col_idx, width in enumerate(widths):
+            worksheet.set_column(col_idx, col_idx, width)
 
     def _apply_conditional_formatting(self, worksheet, net_col_idx: int, start_row: int, end_row: int):
         """Apply conditional formatting for negative values in 'Net of Balance'."""
@@ -292,121 +1185,163 @@ class ExcelReportGenerator:
                 'type': 'cell',
                 'criteria': '<',
                 'value': 0,
-                'format': self.workbook.add_format({
-                    'font_color': 'red',
-                    'num_format': '#,##0.00_);(#,##0.00)'
-                })
+                'format': self.formats['negative']
             }
         )
 
-    def create_sheet(self, sheet_name: str, df: pd.DataFrame, has_status: bool = False, include_grand_total: bool = True, hidden: bool = False):
+    def _format_columns(self, worksheet, widths: List[int], headers: List[str], has_status: bool, end_row: int):
+        """Set column widths, outline levels, number formats and conditional formatting.
+
+        Everything here depends only on the prepared sheet, so it is applied before
+        any row is written, as constant_memory mode requires.
+        """
+        # Hide/unhide columns as you had before
+        worksheet.set_column(3, 3, None, None, {'hidden': False, 'level': 0})
+        worksheet.set_column(4, 5, None, None, {'hidden': False, 'level': 1})
+
+        # Auto-adjust column widths
+        self._adjust_column_widths(worksheet, widths)
+        worksheet.set_column(4, 4, 16, self.date_format)
+
+        # Conditional formatting for Net of Balance
+        self._apply_conditional_formatting(worksheet, 10, 1, end_row)
+
+        # Numeric formatting
+        number_format = self.formats['number']
+        numeric_col_names = ['Available', 'Total', 'Paid Amount', 'Sum of Balance', 'Net of Balance']
+        for idx, col_name in enumerate(headers):
+            if col_name in numeric_col_names:
+                worksheet.set_column(idx, idx, 16, number_format)
+
+        # Optionally hide Comment, Total, Paid Amount, and/or Status columns
+        worksheet.set_column(6, 8, None, number_format, {'hidden': True})
+        if has_status:
+            worksheet.set_column(11, 11, None, number_format, {'hidden': True})
+
+    def _write_total_row(self, worksheet, row: int, data: List[Any], cell_format, results: Dict[int, Optional[float]]):
+        """Write a total row like write_row, storing the planned result of each formula cell.
+
+        With the results cached in the file, Excel does not have to recalculate the
+        workbook on open, and readers that never calculate (pandas, openpyxl, previews)
+        see the totals instead of zeros.
+        """
+        for col, value in enumerate(data):
+            if col in results and isinstance(value, str) and value.startswith('='):
+                result = results[col]
+                if result is None:
+                    result = 0  # SUM over blank cells
+                elif not np.isfinite(result):
+                    result = '#DIV/0!'  # What nan_inf_to_errors writes for the infinite input
+                worksheet.write_formula(row, col, value, cell_format, result)
+            else:
+                worksheet.write(row, col, value, cell_format)
+
+    def create_sheet(self, sheet_name: str, df: pd.DataFrame, has_status: bool = False, include_grand_total: bool = True, hidden: bool = False) -> 'PreparedSheet':
         """Creates an individual sheet for each stutas and every active company."""
+        with self.trace.span('create_sheet', rows_in=len(df), sheet=sheet_name) as span:
+            prepared = prepare_sheet(df, has_status, include_grand_total)
+            self.write_sheet(sheet_name, prepared.layout, prepared.detail_rows, prepared.column_widths, has_status, hidden,
+                              prepared.coverage)
+            span.rows_out = len(prepared.layout.order)
+        return prepared
+
+    def write_sheet(self, sheet_name: str, layout: SheetLayout, detail_rows: List[tuple], widths: List[int],
+                     has_status: bool = False, hidden: bool = False, coverage: np.ndarray = None):
+        """Write a sheet by replaying a planned layout; detail_rows (and coverage) are indexed by layout.order."""
         worksheet = self.workbook.add_worksheet(sheet_name)
-        self.writer.sheets[sheet_name] = worksheet
 
         if hidden:
             worksheet.hide()
 
+        self._insert_fix_button(worksheet, 11)
+
         # 1) Write headers
         headers = ['Company Name', 'Bank', 'Available', 'Supplier Name', 'Date',
                 'Invoice No', 'Comment', 'Total', 'Paid Amount', 'Sum of Balance', 'Net of Balance']
         if has_status:
             headers.append('Status')
         worksheet.write_row(0, 0, headers, self.header_format)
+        coverage_formats = None
+        if self.cash_coverage and coverage is not None:
+            coverage_formats = [self.formats[style] for style in COVERAGE_STYLES]
+            worksheet.write_comment(0, 9, COVERAGE_NOTE)
 
         # Freeze the first row
         worksheet.freeze_panes(1, 0)
 
-        df.reset_index(inplace=True)
-        current_row = 1
+        detail_row_options = {'level': 2, 'hidden': False}
+        self._format_columns(worksheet, widths, headers, has_status, layout.end_row)
         total_available = []
         total_sum = []
 
         # 2) Iterate over each Company
-        for comp_key, comp_group in df.groupby('Company Name'):
-            company_start_row = current_row
+        for company_block in layout.companies:
             company_availables = []
             company_totals = []
 
-            company = comp_key
+            company = company_block.company
             first_bank = True
 
             # 3) Iterate over each Bank
-            for bank_key, bank_group in comp_group.groupby(['Bank', 'Available'], dropna=False):
-                bank, available = bank_key
-                available = self._safe_numeric(available)
+            for bank_block in company_block.banks:
+                bank = bank_block.bank
+                available = _safe_numeric(bank_block.available)
                 available = '' if pd.isna(available) else available
 
                 if first_bank:
                     # Write row with Company + Bank
                     company_header_data = [
-                        self._clean_value(company),
-                        self._clean_value(bank),
+                        _clean_value(company),
+                        _clean_value(bank),
                         available,
                         '', '', '', '', '', '', '', ''
                     ]
-                    worksheet.write_row(current_row, 0, company_header_data)
+                    worksheet.write_row(bank_block.header_row, 0, company_header_data)
                     first_bank = False
                 else:
                     # Write row with Bank only
                     bank_header_data = [
                         '',
-                        self._clean_value(bank),
+                        _clean_value(bank),
                         available,
                         '', '', '', '', '', '', '', ''
                     ]
-                    worksheet.write_row(current_row, 0, bank_header_data)
+                    worksheet.write_row(bank_block.header_row, 0, bank_header_data)
 
-                current_row += 1
-                bank_start_row = current_row
                 bank_totals = []
 
                 # 4) Iterate over each Supplier
-                for supplier_key, supplier_group in bank_group.groupby('Supplier Name'):
-                    # ↓↓↓ Assign supplier_start_row here before the supplier header row
-                    supplier_start_row = current_row
+                for supplier_block in bank_block.suppliers:
+                    supplier_start_row = supplier_block.header_row
 
-                    supplier = supplier_key
+                    supplier = supplier_block.supplier
                     supplier_header_data = [
                         '',
                         '',
                         '',
-                        self._clean_value(supplier),
+                        _clean_value(supplier),
                         '', '', '', '', '', '', ''
                     ]
-                    worksheet.write_row(current_row, 0, supplier_header_data)
-                    worksheet.set_row(current_row, None, None, {'level': 1, 'hidden': False})
-                    current_row += 1
-
-                    # !!! IMPORTANT: Do not reassign supplier_start_row here !!!
-                    # so that the sum range for the supplier total remains correct.
+                    worksheet.write_row(supplier_start_row, 0, supplier_header_data)
+                    worksheet.set_row(supplier_start_row, None, None, {'level': 1, 'hidden': False})
 
                     # 5) Detail rows
-                    for _, detail_row in supplier_group.iterrows():
-                        detail_data = [
-                            '',
-                            '',
-                            '',
-                            '',
-                            self._safe_date(detail_row['Date']),
-                            self._clean_value(detail_row['Invoice No']),
-                            self._clean_value(detail_row['Comment']),
-                            self._clean_value(self._safe_numeric(detail_row['Total'])),
-                            self._clean_value(self._safe_numeric(detail_row['Paid Amount'])),
-                            self._clean_value(self._safe_numeric(detail_row['Payable Balance'])),
-                            ''  # Net of Balance placeholder
-                        ]
-                        if has_status:
-                            detail_data.append(self._clean_value(detail_row['Status']))
-
-                        worksheet.write_row(current_row, 0, detail_data)
-                        worksheet.set_row(current_row, None, None, {'level': 2, 'hidden': False})
-                        current_row += 1
+                    detail_positions = layout.order[supplier_block.start:supplier_block.stop]
+                    for current_row, position in enumerate(detail_positions, start=supplier_start_row + 1):
+                        detail_row = detail_rows[position]
+                        if coverage_formats is None:
+                            worksheet.write_row(current_row, 4, detail_row)
+                        else:
+                            # The balance (J) is written with the fill of its coverage
+                            worksheet.write_row(current_row, 4, detail_row[:5])
+                            worksheet.write(current_row, 9, detail_row[5], coverage_formats[coverage[position]])
+                            worksheet.write_row(current_row, 10, detail_row[6:])
+                        worksheet.set_row(current_row, None, None, detail_row_options)
 
                     # 6) Supplier total
-                    supplier_total_row = current_row
-                    # Sum from J( supplier_start_row+2 ) to J( current_row )
-                    supplier_total_formula = f"=SUM(J{supplier_start_row + 2}:J{current_row})"
+                    supplier_total_row = supplier_block.total_row
+                    # Sum from J( supplier_start_row+2 ) to J( supplier_total_row )
+                    supplier_total_formula = f"=SUM(J{supplier_start_row + 2}:J{supplier_total_row})"
                     supplier_total_data = [
                         '',
                         '',
@@ -416,18 +1351,17 @@ class ExcelReportGenerator:
                         supplier_total_formula,
                         ''
                     ]
-                    worksheet.write_row(
-                        current_row, 0, supplier_total_data,
-                        self.workbook.add_format({'bold': True, 'num_format': '#,##0.00_);(#,##0.00)'})
+                    self._write_total_row(
+                        worksheet, supplier_total_row, supplier_total_data,
+                        self.formats['supplier_total'], {9: supplier_block.total}
                     )
-                    worksheet.set_row(current_row, None, None, {'level': 1, 'hidden': False})
-                    current_row += 1
+                    worksheet.set_row(supplier_total_row, None, None, {'level': 1, 'hidden': False})
 
                     bank_totals.append(f"J{supplier_total_row + 1}")
 
                 # 7) Bank total
-                bank_total_row = current_row
-                bank_available_formula = f"=C{bank_start_row}" if available else ''
+                bank_total_row = bank_block.total_row
+                bank_available_formula = f"=C{bank_block.header_row + 1}" if available else ''
                 bank_total_formula = f"=SUM({','.join(map(str, bank_totals))})"
                 bank_net_formula = f"=C{bank_total_row + 1} - J{bank_total_row + 1}"
                 bank_total_data = [
@@ -439,22 +1373,17 @@ class ExcelReportGenerator:
                     bank_total_formula,
                     bank_net_formula
                 ]
-                worksheet.write_row(
-                    current_row, 0, bank_total_data,
-                    self.workbook.add_format({
-                        'bold': True,
-                        'bg_color': '#E8E8E8',
-                        'num_format': '#,##0.00_);(#,##0.00)'
-                    })
+                self._write_total_row(
+                    worksheet, bank_total_row, bank_total_data, self.formats['bank_total'],
+                    {2: bank_block.available_total, 9: bank_block.total, 10: bank_block.net}
                 )
-                current_row += 1
 
                 if available != '':
                     company_availables.append(f"C{bank_total_row + 1}")
                 company_totals.append(f"J{bank_total_row + 1}")
 
             # 8) Company total
-            company_total_row = current_row
+            company_total_row = company_block.total_row
             company_total_formula = f"=SUM({','.join(map(str, company_totals))})"
             company_available_formula = f"=SUM({','.join(map(str, company_availables))})" if company_availables else ""
             company_net_formula = f"=C{company_total_row + 1} - J{company_total_row + 1}"
@@ -467,24 +1396,18 @@ class ExcelReportGenerator:
                 company_total_formula,
                 company_net_formula
             ]
-            worksheet.write_row(
-                current_row, 0, company_total_data,
-                self.workbook.add_format({
-                    'bold': True,
-                    'bg_color': '#D3D3D3',
-                    'num_format': '#,##0.00_);(#,##0.00)',
-                    'bottom': 2
-                })
+            self._write_total_row(
+                worksheet, company_total_row, company_total_data, self.formats['company_total'],
+                {2: company_block.available_total, 9: company_block.total, 10: company_block.net}
             )
-            current_row += 1
 
             if company_available_formula != '':
                 total_available.append(f"C{company_total_row + 1}")
             total_sum.append(f"J{company_total_row + 1}")
 
         # 9) Grand total
-        if include_grand_total:
-            grand_total_row = current_row
+        if layout.grand_total_row is not None:
+            grand_total_row = layout.grand_total_row
             grand_available_formula = f"=SUM({','.join(map(str, total_available))})" if total_available else ""
             grand_total_formula = f"=SUM({','.join(map(str, total_sum))})"
             grand_net_formula = f"=C{grand_total_row + 1} - J{grand_total_row + 1}"
@@ -497,85 +1420,285 @@ class ExcelReportGenerator:
                 grand_total_formula,
                 grand_net_formula
             ]
-            worksheet.write_row(
-                current_row, 0, grand_total_data,
-                self.workbook.add_format({
-                    'bold': True,
-                    'bg_color': '#B0B0B0',
-                    'num_format': '#,##0.00_);(#,##0.00)',
-                    'bottom': 2
-                })
+            self._write_total_row(
+                worksheet, grand_total_row, grand_total_data, self.formats['grand_total'],
+                {2: layout.grand_available_total, 9: layout.grand_total, 10: layout.grand_net}
             )
 
-        # Hide/unhide columns as you had before
-        worksheet.set_column(3, 3, None, None, {'hidden': False, 'level': 0})
-        worksheet.set_column(4, 5, None, None, {'hidden': False, 'level': 1})
-
-        # Auto-adjust column widths
-        self._adjust_column_widths(worksheet, df)
-        worksheet.set_column(4, 4, 16, self.date_format)
-
-        # Conditional formatting for Net of Balance
-        self._apply_conditional_formatting(worksheet, 10, 1, current_row)
-
-        # Numeric formatting
-        number_format = self.workbook.add_format({
-            'num_format': '#,##0.00_);(#,##0.00)',
-            'align': 'right'
-        })
-        numeric_col_names = ['Available', 'Total', 'Paid Amount', 'Sum of Balance', 'Net of Balance']
-        for idx, col_name in enumerate(headers):
-            if col_name in numeric_col_names:
-                worksheet.set_column(idx, idx, 16, number_format)
-
-        # Optionally hide Comment, Total, Paid Amount, and/or Status columns
-        worksheet.set_column(6, 8, None, number_format, {'hidden': True})
-        if has_status:
-            status_col_idx = headers.index('Status')
-            worksheet.set_column(11, 11, None, number_format, {'hidden': True})
-
+    def _insert_fix_button(self, worksheet, col: int):
+        """Add the button running the embedded FixRefErrors macro on the header row, if there is one."""
+        if self.vba_project:
+            # Button on the first row that runs the embedded macro (100 x 14.4 points)
+            worksheet.insert_button(0, col, {
+                'macro': 'FixRefErrors',
+                'caption': 'Fix #REF!',
+                'width': 133,
+                'height': 19,
+            })
+
+    def write_aging_sheet(self, aging: pd.DataFrame, sheet_name: str = AGING_SHEET_NAME):
+        """Write an aging_report: one row per sheet, company, bank and supplier, then a total row.
+
+        The totals use SUBTOTAL, so they follow the autofilter: filtering a sheet or a
+        company totals its visible rows only.
+        """
+        worksheet = self.workbook.add_worksheet(sheet_name)
+        headers = list(aging.columns)
+        key_count = headers.index('Supplier Name') + 1
+        self._insert_fix_button(worksheet, len(headers) + 1)
+        worksheet.write_row(0, 0, headers, self.header_format)
+        worksheet.freeze_panes(1, 0)
+        worksheet.autofilter(0, 0, len(aging), len(headers) - 1)
+
+        # Bucket and Total columns are amounts; Lines is a count
+        self._adjust_column_widths(worksheet, column_widths(aging))
+        worksheet.set_column(key_count, len(headers) - 2, 16, self.formats['number'])
+
+        keys = [_clean_column(aging[col]) for col in headers[:key_count]]
+        amounts = aging[headers[key_count:]].to_numpy(dtype=float).tolist()
+        for row, (key_values, amount_values) in enumerate(zip(zip(*keys), amounts), start=1):
+            worksheet.write_row(row, 0, key_values)
+            worksheet.write_row(row, key_count, amount_values)
+
+        if amounts:
+            total_row = len(aging) + 1
+            columns = range(key_count, len(headers))
+            data = ['Total'] + [''] * (key_count - 1) + [
+                f"=SUBTOTAL(9,{xlsxwriter.utility.xl_col_to_name(col)}2:"
+                f"{xlsxwriter.utility.xl_col_to_name(col)}{total_row})"
+                for col in columns
+            ]
+            # Summed in row order, as Excel does
+            results = {col: sum(row[col - key_count] for row in amounts) for col in columns}
+            self._write_total_row(worksheet, total_row, data, self.formats['grand_total'], results)
 
     def generate_report(self, df_active: pd.DataFrame, df_others: pd.DataFrame,
-                        df_zagora: pd.DataFrame, df_AR: pd.DataFrame):
-        """Generate Excel report from four dfs."""
-        self.create_sheet('Active', df_active)
-        self.create_sheet('Others', df_others, has_status=True)
-        self.create_sheet('Zagora_AP', df_zagora)
-        self.create_sheet('Zagora_AR', df_AR, has_status=True)
-
-        # Add a sheet for each company in df_active after the tab 'Zagora_AR'
-        companies = df_active['Company Name'].unique()
-        for company in companies:
-            df_company = df_active[df_active['Company Name'] == company].copy()
-            if df_company.empty:
-                continue # Skip if no data
-            sheet_name = str(company)[:31]  # Max sheet name length is 31 characters
-            self.create_sheet(
-                sheet_name, 
-                df_company, 
-                include_grand_total=False,
-                hidden=True
+                        df_zagora: pd.DataFrame, df_AR: pd.DataFrame, aging: pd.DataFrame = None):
+        """Generate Excel report from four dfs, with an AP_Aging sheet when given an aging_report."""
+        # (sheet name, frame, has_status, plan the hidden company sheets)
+        sheets = [
+            ('Active', df_active, False, True),
+            ('Others', df_others, True, False),
+            ('Zagora_AP', df_zagora, False, False),
+            ('Zagora_AR', df_AR, True, False),
+        ]
+        if self.incremental is not None:
+            self._write_report_sheets(sheets, self._prepare_incremental(sheets), aging)
+        elif self.workers:
+            # Clean and plan the sheets in worker processes; this thread writes them in
+            # a fixed order as they become ready, so the output stays deterministic
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(sheets))) as executor:
+                futures = [
+                    executor.submit(prepare_sheet, df, has_status, True, company_sheets)
+                    for _, df, has_status, company_sheets in sheets
+                ]
+                self._write_report_sheets(sheets, (future.result() for future in futures), aging)
+        else:
+            self._write_report_sheets(sheets, (
+                prepare_sheet(df, has_status, True, company_sheets)
+                for _, df, has_status, company_sheets in sheets
+            ), aging)
+
+    def _prepare_incremental(self, sheets: List[tuple]) -> List['PreparedSheet']:
+        """Prepare the sheets reusing the unchanged companies of the previous run, and store this run's."""
+        previous = self.incremental.load()
+        state = {}
+        prepared_sheets = []
+        for sheet_name, df, has_status, company_sheets in sheets:
+            prepared, state[sheet_name], recomputed = prepare_sheet_incremental(
+                df, previous.get(sheet_name, {}), has_status, True, company_sheets
             )
+            print(f"Incremental {sheet_name}: {recomputed} of {len(state[sheet_name]['companies'])} "
+                  f"companies prepared again")
+            prepared_sheets.append(prepared)
+        self.incremental.save(state)
+        return prepared_sheets
+
+    def _write_report_sheets(self, sheets: List[tuple], prepared_sheets: Iterable['PreparedSheet'],
+                             aging: pd.DataFrame = None):
+        """Write the status sheets in order, the aging sheet, then a hidden sheet for each active company."""
+        company_sheets = []
+        prepared_sheets = iter(prepared_sheets)
+        for sheet_name, df, has_status, _ in sheets:
+            with self.trace.span('create_sheet', rows_in=len(df), sheet=sheet_name) as span:
+                # Preparing (or waiting for a worker to prepare) the sheet counts as creating it
+                prepared = next(prepared_sheets)
+                self.write_sheet(sheet_name, prepared.layout, prepared.detail_rows, prepared.column_widths, has_status,
+                                  coverage=prepared.coverage)
+                span.rows_out = len(prepared.layout.order)
+            if prepared.company_widths:
+                company_sheets.append(prepared)
+
+        if aging is not None:
+            with self.trace.span('create_sheet', rows_in=len(aging), sheet=AGING_SHEET_NAME) as span:
+                self.write_aging_sheet(aging)
+                span.rows_out = len(aging)
+
+        # Add a sheet for each company in df_active after the tab 'Zagora_AR'.
+        # Each one replays its block of the Active layout, so the rows are only
+        # partitioned once and nothing is cleaned or planned again.
+        for prepared in company_sheets:
+            company_blocks = {block.company: block for block in prepared.layout.companies}
+            for company, widths in prepared.company_widths:
+                sheet_name = str(company)[:31]  # Max sheet name length is 31 characters
+                layout = company_sheet_layout(prepared.layout, company_blocks[company])
+                block = layout.companies[0]
+                rows = sum(supplier.stop - supplier.start for bank in block.banks for supplier in bank.suppliers)
+                with self.trace.span('create_sheet', rows_in=rows, sheet=sheet_name, hidden=True) as span:
+                    self.write_sheet(sheet_name, layout, prepared.detail_rows, widths, hidden=True,
+                                      coverage=prepared.coverage)
+                    span.rows_out = rows
+
+
+class PreparedSheet(NamedTuple):
+    layout: SheetLayout
+    detail_rows: List[tuple]  # Cleaned detail cells, indexed by layout.order
+    column_widths: List[int]
+    company_widths: List[Tuple[Any, List[int]]]  # (company, column widths) of each hidden company sheet
+    coverage: np.ndarray  # allocate_cash of each detail row, indexed like detail_rows
+
+
+def prepare_sheet(df: pd.DataFrame, has_status: bool = False, include_grand_total: bool = True,
+                  company_sheets: bool = False) -> PreparedSheet:
+    """Clean, plan and measure one sheet without touching a workbook.
+
+    This is the per-sheet work that can run in a worker process. With company_sheets,
+    the widths of one hidden sheet per company are measured too, in the order the
+    companies first appear.
+    """
+    df = df.reset_index()
+    detail_rows = prepare_detail_rows(df, has_status)
+    layout = plan_sheet_layout(df, include_grand_total)
+
+    # Measured once; the hidden company sheets are subsets of the sheet's rows
+    lengths = text_lengths(df)
+    company_widths = []
+    if company_sheets:
+        planned = {block.company for block in layout.companies}
+        widths = company_column_widths(df, lengths)
+        for company in df['Company Name'].unique():
+            if company not in planned:
+                continue # Skip if no data
+            company_widths.append((company, widths[company]))
+
+    return PreparedSheet(layout, detail_rows, column_widths(df, lengths), company_widths, allocate_cash(df))
+
+
+class PreparedCompany(NamedTuple):
+    block: Optional[CompanyBlock]  # Planned at the top of its own sheet; None for rows without a company
+    order: np.ndarray  # Positions in detail_rows of the records the block writes
+    detail_rows: List[tuple]
+    widths: List[int]  # Column widths of the company's rows
+    coverage: np.ndarray  # allocate_cash of each detail row; banks never span companies
+
+
+def prepare_company(df: pd.DataFrame, has_status: bool = False) -> PreparedCompany:
+    """Clean, plan and measure the rows of one company of a sheet (index already reset)."""
+    layout = plan_sheet_layout(df, include_grand_total=False)
+    if not layout.companies:
+        # Rows without a company are never written, but still count in the column widths
+        return PreparedCompany(None, layout.order, [], column_widths(df), np.zeros(0, dtype=np.int8))
+    detail_rows = prepare_detail_rows(df, has_status)
+    return PreparedCompany(layout.companies[0], layout.order, detail_rows, column_widths(df), allocate_cash(df))
+
+
+def combine_companies(companies: List[PreparedCompany], include_grand_total: bool = True,
+                      first_row: int = 1) -> Tuple[SheetLayout, List[tuple], np.ndarray]:
+    """Stack prepared companies, in sheet order, into the layout plan_sheet_layout gives the whole sheet.
+
+    Returns:
+        Tuple[SheetLayout, List[tuple], np.ndarray]: The layout, the detail rows its order
+            points into, and their coverage
+    """
+    row = first_row
+    blocks = []
+    orders = []
+    detail_rows = []
+    coverages = []
+    order_size = 0
+    for company in companies:
+        if company.block is None:
+            continue
+        blocks.append(_shift_company(company.block, row - company.block.header_row, order_size))
+        orders.append(company.order + len(detail_rows))
+        order_size += len(company.order)
+        detail_rows.extend(company.detail_rows)
+        coverages.append(company.coverage)
+        row = blocks[-1].total_row + 1
+
+    order = np.concatenate(orders) if orders else np.zeros(0, dtype=np.intp)
+    grand_total = sum(block.total for block in blocks)
+    grand_available = _sum_available([block.available_total for block in blocks])
+    layout = SheetLayout(order, blocks, row if include_grand_total else None, row,
+                         grand_total, grand_available, (grand_available or 0.0) - grand_total)
+    coverage = np.concatenate(coverages) if coverages else np.zeros(0, dtype=np.int8)
+    return layout, detail_rows, coverage
+
+
+def prepare_sheet_incremental(df: pd.DataFrame, previous: Dict[str, Any], has_status: bool = False,
+                              include_grand_total: bool = True,
+                              company_sheets: bool = False) -> Tuple[PreparedSheet, Dict[str, Any], int]:
+    """Like prepare_sheet, but reuse the companies whose rows are the same as in a previous run.
+
+    Only the companies whose rows hash differently are cleaned, planned and measured
+    again; the sheet is then stacked from the per-company results, which gives the
+    same layout, totals and widths as preparing the whole sheet.
+
+    Args:
+        df (pd.DataFrame): A frame from split_by_status
+        previous (Dict[str, Any]): The sheet's entry in the IncrementalStore state, {} if none
+        has_status (bool): The sheet has a Status column
+        include_grand_total (bool): Plan a grand total row
+        company_sheets (bool): Measure the hidden company sheets too
+
+    Returns:
+        Tuple[PreparedSheet, Dict[str, Any], int]: The prepared sheet, the sheet's new
+            state entry, and how many companies were prepared again
+    """
+    df = df.reset_index()
+    signature = frame_signature(df, has_status)
+    stored = previous.get('companies', {}) if previous.get('signature') == signature else {}
+
+    positions = {
+        None if pd.isna(company) else company: rows
+        for company, rows in df.groupby('Company Name', sort=False, dropna=False, observed=True).indices.items()
+    }
+    digests = group_digests(row_hashes(df), positions)
+    changed = set(changed_keys(stored, digests))
+    companies = {
+        company: (digests[company], prepare_company(df.take(rows), has_status)) if company in changed
+        else stored[company]
+        for company, rows in positions.items()
+    }
+
+    # Stack the companies in the order plan_sheet_layout writes them
+    _, sheet_companies = _group_codes(df['Company Name'])
+    layout, detail_rows, coverage = combine_companies(
+        [companies[None if pd.isna(company) else company][1] for company in sheet_companies], include_grand_total
+    )
+    widths = [max(column) for column in zip(*(prepared.widths for _, prepared in companies.values()))]
+
+    company_widths = []
+    if company_sheets:
+        for company in df['Company Name'].unique():
+            if pd.isna(company) or companies[company][1].block is None:
+                continue  # Skip if no data
+            company_widths.append((company, companies[company][1].widths))
+
+    entry = {'signature': signature, 'companies': companies}
+    return PreparedSheet(layout, detail_rows, widths, company_widths, coverage), entry, len(changed)
+
 
 def add_vba_buttons(output_xlsx):
-    """Adds a VBA button to each sheet in the workbook to fix #REF! errors."""
+    """Adds a VBA button to each sheet in the workbook to fix #REF! errors.
+
+    Drives a local Excel through xlwings, so it needs Windows and Excel; run_pipeline
+    embeds the macro directly instead when it is given a vba_project.
+    """
+    import xlwings as xw
+
     output_xlsm = output_xlsx.replace('.xlsx', '.xlsm')
-    vba_code = """
-Sub FixRefErrors()
-    Dim ws As Worksheet
-    Dim cell As Range    
-    For Each ws In ThisWorkbook.Sheets
-        On Error Resume Next
-        For Each cell In ws.UsedRange
-            If cell.HasFormula Then
-                If InStr(cell.Formula, "#REF!") > 0 Then
-                    cell.Formula = Replace(cell.Formula, "#REF!", "0")
-                End If
-            End If
-        Next cell
-    Next ws
-End Sub
-"""
+    vba_code = FIX_REF_ERRORS_VBA
 
     try:
         with xw.App(visible=False) as app:
@@ -613,20 +1736,404 @@ End Sub
         raise
     return output_xlsm
 
-# Get the user's Downloads folder path
-downloads_dir = os.path.join(os.path.expanduser('~'), 'Downloads')
-
-today_date = datetime.today().strftime('%Y-%m-%d')
-output_xlsx = os.path.join(downloads_dir, f"Payables Summary_{today_date}.xlsx")
+def default_output_path(output_dir: str = None) -> str:
+    """Return today's report path, in the user's Downloads folder by default."""
+    if output_dir is None:
+        # Get the user's Downloads folder path
+        output_dir = os.path.join(os.path.expanduser('~'), 'Downloads')
+    today_date = datetime.today().strftime('%Y-%m-%d')
+    return os.path.join(output_dir, f"Payables Summary_{today_date}.xlsx")
+
+
+def build_report_frames(inputs: Dict[str, str], options: Dict[str, Any] = None, trace: RunTrace = None,
+                        progress: Callable[[str], None] = None) -> Dict[str, pd.DataFrame]:
+    """Read, clean and merge the inputs, and split them into the frames of the report sheets.
+
+    Args:
+        inputs (Dict[str, str]): Paths of the input workbooks, keyed by file type
+        options (Dict[str, Any]): Overrides for DEFAULT_OPTIONS
+        trace (RunTrace): Records the ingest, clean and merge stages
+        progress (Callable[[str], None]): Called with each stage as it starts
+
+    Returns:
+        Dict[str, pd.DataFrame]: The frames split_by_status returns
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    progress = progress or (lambda stage: None)
+    trace = trace or RunTrace(enabled=False)
+
+    def enter(stage: str, rows_in: Optional[int] = None):
+        progress(stage)
+        trace.enter(stage, rows_in)
+
+    enter('ingest')
+    cache = InputCache(options['input_cache']) if options['input_cache'] else None
+    bb_raw, ap_raw, cm_raw = load_inputs(inputs, cache=cache, excel_engine=options['excel_engine'])
+    trace.set_rows_out(len(ap_raw))
+
+    # Each stage drops its inputs as soon as it is done, so they are freed before the next peaks
+    enter('clean', len(ap_raw))
+    ap = clean_account_payables(ap_raw)
+    cm = clean_cash_management(cm_raw)
+    del ap_raw, cm_raw
+    ap, bb, cm = normalize_keys(ap, bb_raw, cm)
+    del bb_raw
+    trace.set_rows_out(len(ap))
+
+    enter('merge', len(ap))
+    df = merge_inputs(ap, bb, cm)
+    del ap, bb, cm
+    frames = split_by_status(df)
+    del df
+    trace.set_rows_out(sum(len(frame) for frame in frames.values()))
+    return frames
+
+
+def run_pipeline(inputs: Dict[str, str], output_path: str, options: Dict[str, Any] = None,
+                 progress: Callable[[str], None] = None) -> str:
+    """Run the whole payables pipeline and write the summary report.
+
+    Args:
+        inputs (Dict[str, str]): Paths of the input workbooks, keyed by 'bank_balance',
+            'account_payables' and 'cash_management'
+        output_path (str): The path where the .xlsx report will be saved
+        options (Dict[str, Any]): Overrides for DEFAULT_OPTIONS
+        progress (Callable[[str], None]): Called with each of PIPELINE_STAGES as it starts
+
+    Returns:
+        str: The path of the generated report (.xlsm when the VBA buttons are added)
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    progress = progress or (lambda stage: None)
+    trace = RunTrace(enabled=options['trace'])
+
+    def enter(stage: str, rows_in: Optional[int] = None):
+        progress(stage)
+        trace.enter(stage, rows_in)
+
+    output_file = output_path
+    vba_project = None
+    if options['add_vba_buttons'] and options['vba_project']:
+        # Write the macro-enabled workbook in one pass, no Excel needed
+        output_file = os.path.splitext(output_path)[0] + '.xlsm'
+        vba_project = options['vba_project']
+
+    incremental = IncrementalStore(options['incremental_state']) if options['incremental_state'] else None
 
-try:
-    with ExcelReportGenerator(output_xlsx) as report_generator:
-        report_generator.generate_report(df_active, df_others, df_zagora, df_AR)
-    
-    # Convert to xlsm and add VBA buttons
-    output_xlsm = os.path.join(downloads_dir, add_vba_buttons(output_xlsx))
-    print(f"Report generated successfully: {output_xlsm}")
-except Exception as e:
-    print(f"An error occurred during report generation: {e}")
-    raise
+    try:
+        frames = build_report_frames(inputs, options, trace, progress)
 
+        try:
+            enter('render', sum(len(frame) for frame in frames.values()))
+            aging = None
+            if options['aging_buckets']:
+                with trace.span('aging', rows_in=sum(len(frames[key]) for _, key in AGING_SHEETS)) as span:
+                    aging = aging_report(frames, options['aging_as_of'], options['aging_buckets'])
+                    span.rows_out = len(aging)
+            with ExcelReportGenerator(
+                output_file, constant_memory=options['constant_memory'], workers=options['workers'],
+                vba_project=vba_project, trace=trace, incremental=incremental,
+                cash_coverage=options['cash_coverage']
+            ) as report_generator:
+                report_generator.generate_report(frames['active'], frames['others'], frames['zagora'], frames['AR'],
+                                                 aging)
+                # Closing the workbook assembles and writes the file
+                enter('finalize')
+            if options['add_vba_buttons'] and vba_project is None:
+                if sys.platform == 'win32':
+                    with trace.span('vba_buttons'):
+                        output_file = add_vba_buttons(output_file)
+                else:
+                    print("The Fix #REF! buttons need Excel on Windows, or a vba_project: "
+                          "the report is left as .xlsx")
+            print(f"Report generated successfully: {output_file}")
+        except Exception as e:
+            print(f"An error occurred during report generation: {e}")
+            raise
+    except Exception as e:
+        trace.close(error=e)
+        raise
+    finally:
+        if trace.enabled:
+            trace.close()
+            METRICS.observe(trace)
+            try:
+                trace.write(trace_path(output_file))
+            except OSError as e:
+                print(f"Could not write the run trace: {e}")
+    return output_file
+
+
+def _summary_key(value: Any) -> Any:
+    """Return a company, bank or supplier label as a JSON-friendly value."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _summary_number(value: Optional[float]) -> Optional[float]:
+    """Return a total as a float, None when blank or not finite."""
+    if value is None or not np.isfinite(value):
+        return None
+    return float(value)
+
+
+def summarize_sheet(df: pd.DataFrame) -> Dict[str, Any]:
+    """Return the Company -> Bank -> Supplier totals of one report sheet, without writing it.
+
+    The hierarchy and numbers are those of the sheet's total rows: available cash,
+    sum of balance and net of balance per company and bank, sum of balance per
+    supplier, and the grand total. Available is None where the sheet leaves it blank.
+
+    Args:
+        df (pd.DataFrame): A frame from split_by_status
+
+    Returns:
+        Dict[str, Any]: {'companies': [...], 'total': {...}}, JSON-serializable
+    """
+    layout = plan_sheet_layout(df)
+    companies = []
+    for company in layout.companies:
+        banks = []
+        for bank in company.banks:
+            banks.append({
+                'bank': _summary_key(bank.bank),
+                'available': _summary_number(bank.available_total),
+                'sum_of_balance': _summary_number(bank.total),
+                'net_of_balance': _summary_number(bank.net),
+                'suppliers': [
+                    {
+                        'supplier': _summary_key(supplier.supplier),
+                        'sum_of_balance': _summary_number(supplier.total),
+                        'lines': supplier.stop - supplier.start,
+                    }
+                    for supplier in bank.suppliers
+                ],
+            })
+        companies.append({
+            'company': _summary_key(company.company),
+            'available': _summary_number(company.available_total),
+            'sum_of_balance': _summary_number(company.total),
+            'net_of_balance': _summary_number(company.net),
+            'banks': banks,
+        })
+    return {
+        'companies': companies,
+        'total': {
+            'available': _summary_number(layout.grand_available_total),
+            'sum_of_balance': _summary_number(layout.grand_total),
+            'net_of_balance': _summary_number(layout.grand_net),
+            'lines': len(layout.order),
+        },
+    }
+
+
+def report_summary(frames: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+    """Return the totals of every report sheet, keyed by sheet name.
+
+    Args:
+        frames (Dict[str, pd.DataFrame]): The frames split_by_status returns
+
+    Returns:
+        Dict[str, Any]: summarize_sheet of each sheet in REPORT_SHEETS
+    """
+    return {sheet_name: summarize_sheet(frames[key]) for sheet_name, key in REPORT_SHEETS}
+
+
+def summary_table(summary: Dict[str, Any]) -> pd.DataFrame:
+    """Flatten a report_summary into one row per total, e.g. to write it as Parquet.
+
+    Returns:
+        pd.DataFrame: Columns sheet, level ('company', 'bank', 'supplier' or 'grand'),
+            company, bank, supplier, available, sum_of_balance, net_of_balance, lines
+    """
+    rows = []
+    for sheet_name, sheet in summary.items():
+        for company in sheet['companies']:
+            for bank in company['banks']:
+                for supplier in bank['suppliers']:
+                    rows.append((sheet_name, 'supplier', company['company'], bank['bank'], supplier['supplier'],
+                                 None, supplier['sum_of_balance'], None, supplier['lines']))
+                rows.append((sheet_name, 'bank', company['company'], bank['bank'], None, bank['available'],
+                             bank['sum_of_balance'], bank['net_of_balance'],
+                             sum(supplier['lines'] for supplier in bank['suppliers'])))
+            rows.append((sheet_name, 'company', company['company'], None, None, company['available'],
+                         company['sum_of_balance'], company['net_of_balance'],
+                         sum(supplier['lines'] for bank in company['banks'] for supplier in bank['suppliers'])))
+        total = sheet['total']
+        rows.append((sheet_name, 'grand', None, None, None, total['available'], total['sum_of_balance'],
+                     total['net_of_balance'], total['lines']))
+    table = pd.DataFrame(rows, columns=['sheet', 'level', 'company', 'bank', 'supplier', 'available',
+                                        'sum_of_balance', 'net_of_balance', 'lines'])
+    # Keys mix numbers and text in some exports; Parquet needs one type per column
+    for col in ['company', 'bank', 'supplier']:
+        table[col] = table[col].map(lambda value: None if value is None else str(value))
+    return table
+
+
+def build_summary(inputs: Dict[str, str], options: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Run the pipeline up to the report frames and return their totals, without any Excel rendering.
+
+    Args:
+        inputs (Dict[str, str]): Paths of the input workbooks, keyed by file type
+        options (Dict[str, Any]): Overrides for DEFAULT_OPTIONS
+
+    Returns:
+        Dict[str, Any]: The report_summary of the inputs
+    """
+    return report_summary(build_report_frames(inputs, options))
+
+
+def aging_bucket_labels(bucket_days: List[int]) -> List[str]:
+    """Name the aging buckets of increasing day bounds, e.g. Current, 31-60, 61-90, 91-120, >120."""
+    if not bucket_days or bucket_days[0] < 0 or any(low >= high for low, high in zip(bucket_days, bucket_days[1:])):
+        raise ValueError(f"Aging buckets must be increasing numbers of days: {bucket_days!r}")
+    labels = ['Current'] + [f"{low + 1}-{high}" for low, high in zip(bucket_days, bucket_days[1:])]
+    return labels + [f">{bucket_days[-1]}"]
+
+
+def aging_date(as_of: Any = None) -> pd.Timestamp:
+    """Return the day lines are aged at: as_of (a date or 'YYYY-MM-DD'), today when None."""
+    return pd.Timestamp(datetime.today() if as_of is None else as_of).normalize()
+
+
+def age_payables(df: pd.DataFrame, as_of: Any = None, bucket_days: List[int] = AGING_BUCKET_DAYS) -> pd.DataFrame:
+    """Sum the open balance of a sheet's lines per company, bank, supplier and aging bucket.
+
+    A line's age is the number of days from its invoice date to as_of, and
+    np.searchsorted finds the bucket of every line at once: a bucket holds the ages
+    after the previous bound up to its own, so with AGING_BUCKET_DAYS 30 is Current,
+    31 is 31-60 and 121 is >120; lines dated after as_of are current. Each line's
+    balance is placed in its bucket's column of a (lines, buckets) matrix, which one
+    groupby adds up. Groups follow the order of the report sheets (sorted, missing
+    banks last) and, as in the sheets, lines without a company or a supplier are left
+    out. Undated lines have no age and are left out as well.
+
+    Args:
+        df (pd.DataFrame): A frame from split_by_status
+        as_of (Any): Date the lines are aged at, today when None
+        bucket_days (List[int]): Upper bounds in days of the buckets, as AGING_BUCKET_DAYS
+
+    Returns:
+        pd.DataFrame: Columns Company Name, Bank, Supplier Name, one per aging_bucket_labels
+            bucket, Total and Lines
+    """
+    labels = aging_bucket_labels(bucket_days)
+    keys = ['Company Name', 'Bank', 'Supplier Name']
+    flat = df.reset_index()
+    flat = flat[flat['Company Name'].notna() & flat['Supplier Name'].notna() & flat['Date'].notna()]
+    if flat.empty:
+        return pd.DataFrame(columns=keys + labels + ['Total', 'Lines'])
+
+    dates = flat['Date'].to_numpy(dtype='datetime64[D]')
+    ages = (aging_date(as_of).to_datetime64().astype('datetime64[D]') - dates).astype(np.int64)
+    buckets = np.searchsorted(np.asarray(bucket_days), ages, side='left')
+
+    balances = np.zeros((len(flat), len(labels)))
+    balances[np.arange(len(flat)), buckets] = flat['Payable Balance'].to_numpy(dtype=float, na_value=np.nan)
+    table = pd.DataFrame(balances, columns=labels)
+    table['Lines'] = 1
+
+    codes = [_group_codes(flat[key]) for key in keys]
+    grouped = table.groupby([key_codes for key_codes, _ in codes], sort=True).sum()
+
+    aging = pd.DataFrame({
+        key: uniques[grouped.index.get_level_values(level).to_numpy()]
+        for level, (key, (_, uniques)) in enumerate(zip(keys, codes))
+    })
+    for label in labels:
+        aging[label] = grouped[label].to_numpy()
+    aging['Total'] = grouped[labels].to_numpy().sum(axis=1)
+    aging['Lines'] = grouped['Lines'].to_numpy()
+    return aging
+
+
+def aging_report(frames: Dict[str, pd.DataFrame], as_of: Any = None,
+                 bucket_days: List[int] = AGING_BUCKET_DAYS) -> pd.DataFrame:
+    """Age the open lines of every sheet in AGING_SHEETS into one table, led by a Sheet column.
+
+    Args:
+        frames (Dict[str, pd.DataFrame]): The frames split_by_status returns
+        as_of (Any): Date the lines are aged at, today when None
+        bucket_days (List[int]): Upper bounds in days of the buckets
+
+    Returns:
+        pd.DataFrame: Sheet, then the columns of age_payables
+    """
+    tables = []
+    for sheet_name, key in AGING_SHEETS:
+        table = age_payables(frames[key], as_of, bucket_days)
+        table.insert(0, 'Sheet', sheet_name)
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def aging_summary(aging: pd.DataFrame, as_of: Any = None, bucket_days: List[int] = AGING_BUCKET_DAYS) -> Dict[str, Any]:
+    """Return an aging_report as JSON-serializable data.
+
+    Returns:
+        Dict[str, Any]: {'as_of', 'bucket_days', 'buckets', 'sheets': {sheet: {'rows': [...], 'total': {...}}}},
+            each row holding company, bank, supplier, the balance of each bucket, total and lines
+    """
+    labels = aging_bucket_labels(bucket_days)
+    sheets = {}
+    for sheet_name, _ in AGING_SHEETS:
+        table = aging[aging['Sheet'] == sheet_name]
+        amounts = table[labels + ['Total']].to_numpy(dtype=float)
+        rows = [
+            {
+                'company': _summary_key(company),
+                'bank': _summary_key(bank),
+                'supplier': _summary_key(supplier),
+                'buckets': dict(zip(labels, map(_summary_number, row_amounts[:-1]))),
+                'total': _summary_number(row_amounts[-1]),
+                'lines': int(lines),
+            }
+            for company, bank, supplier, row_amounts, lines in zip(
+                table['Company Name'], table['Bank'], table['Supplier Name'], amounts, table['Lines']
+            )
+        ]
+        totals = amounts.sum(axis=0)
+        sheets[sheet_name] = {
+            'rows': rows,
+            'total': {
+                'buckets': dict(zip(labels, map(_summary_number, totals[:-1]))),
+                'total': _summary_number(totals[-1]),
+                'lines': int(table['Lines'].sum()),
+            },
+        }
+    return {
+        'as_of': aging_date(as_of).date().isoformat(),
+        'bucket_days': list(bucket_days),
+        'buckets': labels,
+        'sheets': sheets,
+    }
+
+
+def aging_export_table(aging: pd.DataFrame) -> pd.DataFrame:
+    """Return an aging_report ready for Parquet, with the key columns as text."""
+    table = aging.copy()
+    # Keys mix numbers and text in some exports; Parquet needs one type per column
+    for col in ['Company Name', 'Bank', 'Supplier Name']:
+        table[col] = table[col].map(lambda value: None if pd.isna(value) else str(value)).astype(object)
+    return table
+
+
+def build_aging(inputs: Dict[str, str], options: Dict[str, Any] = None, as_of: Any = None,
+                bucket_days: List[int] = AGING_BUCKET_DAYS) -> pd.DataFrame:
+    """Run the pipeline up to the report frames and age their open lines, without any Excel rendering.
+
+    Returns:
+        pd.DataFrame: The aging_report of the inputs
+    """
+    return aging_report(build_report_frames(inputs, options), as_of, bucket_days)
+
+if __name__ == '__main__':
+    print("Python interpreter being used:", sys.executable)
+
+    # Ensure directories exist
+    os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+
+    run_pipeline(default_input_paths(), default_output_path())
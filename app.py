@@ -1,37 +1,164 @@
-from flask import Flask, render_template, request, send_from_directory
+from flask import Flask, Response, jsonify, render_template, request, send_file, session
+import io
 import os
 import logging
-import subprocess
 import sys
-import glob
 import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from Payable_Account_Automation import (
+    AGING_BUCKET_DAYS, CACHE_FOLDER, INPUT_FILE_TYPES, PIPELINE_STAGES, aging_bucket_labels, aging_date,
+    aging_export_table, aging_summary, build_aging, build_summary, default_output_path, input_schema,
+    run_pipeline, summary_table
+)
+from input_cache import InputCache
+from instrumentation import METRICS, format_metric
+from jobs import JobQueue
+from report_catalog import ReportCatalog
+from workspaces import WorkspaceManager
 
 # Create the Flask app instance once
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
 # Configuration constants
-UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed'
+WORKSPACE_FOLDER = 'workspaces'
 LOG_FOLDER = 'logs'
-SCRIPT_PATH = 'Payable_Account_Automation.py'
+JOB_WORKERS = 2
+SUMMARY_CACHE_SIZE = 16  # Summaries and agings kept in memory, keyed by the content of their inputs
+# Uploads, job submissions, completions and report evictions are logged at INFO;
+# LOG_LEVEL=ERROR keeps only the failures
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
 
 # Configure app
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
+app.config['WORKSPACE_FOLDER'] = WORKSPACE_FOLDER
 app.config['LOG_FOLDER'] = LOG_FOLDER
+# Signs the session cookie holding the workspace id
+app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(32)
 
 # Ensure directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 os.makedirs(LOG_FOLDER, exist_ok=True)
 
 # Configure logging
 logging.basicConfig(
     filename=os.path.join(LOG_FOLDER, 'app.log'),
-    level=logging.ERROR,
+    level=LOG_LEVEL,
     format='%(asctime)s - %(message)s'
 )
 
+# Finished reports are kept in processed/<job id>/ and recorded in a SQLite catalog,
+# which deletes the oldest ones to keep the folder bounded
+catalog = ReportCatalog(PROCESSED_FOLDER)
+
+def job_workspace(workdir):
+    # Job directories are workspaces/<workspace id>/jobs/<job id>
+    return os.path.dirname(os.path.dirname(workdir))
+
+def run_report_job(inputs, workdir, progress):
+    # Traced runs leave a JSON trace next to the report and feed /metrics.
+    # Jobs of a workspace share its incremental state, so a refresh only prepares
+    # the companies whose lines changed since the last run.
+    options = {
+        'trace': True,
+        'incremental_state': os.path.join(job_workspace(workdir), 'state'),
+    }
+    output_dir = catalog.report_dir(os.path.basename(workdir))
+    return run_pipeline(inputs, default_output_path(output_dir), options=options, progress=progress)
+
+def catalog_report(job):
+    catalog.add(job.id, os.path.basename(job_workspace(job.workdir)), job.key, job.output_file, job.timings,
+                time.time() - job.started)
+
+# Reports are generated in the background; /jobs/<id> reports their progress
+job_queue = JobQueue(run_report_job, PIPELINE_STAGES, workers=JOB_WORKERS, on_done=catalog_report)
+
+# Each browser session uploads into and runs its jobs from its own workspace
+workspaces = WorkspaceManager(WORKSPACE_FOLDER)
+
+# Uploads are checked against the input cache the jobs read through, so processing
+# finds each file's sheet and header mapping instead of detecting them again
+input_cache = InputCache(CACHE_FOLDER)
+
+# Dashboards poll /api/summary and /api/aging; unchanged inputs are answered from memory
+summary_cache = OrderedDict()
+summary_lock = threading.Lock()
+
+def cached_result(key, build):
+    with summary_lock:
+        if key in summary_cache:
+            summary_cache.move_to_end(key)
+            return summary_cache[key]
+    result = build()
+    with summary_lock:
+        summary_cache[key] = result
+        while len(summary_cache) > SUMMARY_CACHE_SIZE:
+            summary_cache.popitem(last=False)
+    return result
+
+def cached_summary(inputs):
+    return cached_result(('summary', JobQueue.inputs_key(inputs)), lambda: build_summary(inputs))
+
+def cached_aging(inputs, as_of, bucket_days):
+    key = ('aging', JobQueue.inputs_key(inputs), as_of.isoformat(), tuple(bucket_days))
+    return cached_result(key, lambda: build_aging(inputs, as_of=as_of, bucket_days=bucket_days))
+
+def api_inputs():
+    # ?job=<id> uses the inputs of that job, otherwise this session's uploads.
+    # Returns the inputs, or None and the error response.
+    job_id = request.args.get('job')
+    if job_id:
+        job = job_queue.get(job_id)
+        if job is None:
+            return None, ('Job not found.', 404)
+        inputs = job.inputs
+    else:
+        inputs = workspaces.upload_paths(current_workspace(), INPUT_FILE_TYPES)
+    if not all(os.path.exists(file) for file in inputs.values()):
+        return None, ('Missing one or more required files.', 400)
+    return inputs, None
+
+def send_parquet(table, download_name):
+    buffer = io.BytesIO()
+    try:
+        table.to_parquet(buffer, index=False)
+    except ImportError as e:
+        return f'Parquet output needs pyarrow: {str(e)}', 501
+    buffer.seek(0)
+    return send_file(buffer, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                     download_name=download_name)
+
+def job_scope(workspace_id):
+    # The report is named after the day it runs and ages its lines at that day, and each
+    # workspace has its own jobs: identical inputs share a job within both only
+    return f"{workspace_id}|{date.today().isoformat()}"
+
+def current_workspace():
+    workspace_id = session.get('workspace')
+    if not workspaces.exists(workspace_id):
+        workspace_id = workspaces.create()
+        session['workspace'] = workspace_id
+    workspaces.touch(workspace_id)
+    return workspace_id
+
+def session_report():
+    # This session's latest job, or else the latest report of its workspace, which
+    # outlives the job once the queue has forgotten it
+    entry = catalog.get(session.get('job') or '')
+    if entry is None and session.get('workspace'):
+        entry = catalog.latest(session['workspace'])
+    return entry
+
+def send_report(entry):
+    # Catalogued reports never change: clients revalidate with If-None-Match and get a
+    # 304, and Range requests resume or split the download of a large workbook
+    return send_file(entry.path, as_attachment=True, conditional=True, etag=entry.etag,
+                     last_modified=entry.created, max_age=0)
+
 def is_port_available(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         try:
@@ -49,8 +176,17 @@ def find_available_port(start_port=5000, max_port=5020):
 # Routes
 @app.route('/')
 def index():
+    # Give a new session its workspace before the page uploads anything
+    current_workspace()
     return render_template('index.html')
 
+@app.route('/session', methods=['POST'])
+def start_session():
+    # The page calls this before uploading: the three uploads are sent in parallel, and
+    # without a workspace cookie each of them would create a workspace of its own
+    current_workspace()
+    return '', 204
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
@@ -62,9 +198,25 @@ def upload_file():
 
         if file.filename == '':
             return 'No selected file', 400
+        if file_type not in INPUT_FILE_TYPES:
+            return f'Unknown file type: {file_type}', 400
 
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{file_type}.xlsx")
-        file.save(filepath)
+        workspace_id = current_workspace()
+        filepath = workspaces.upload_paths(workspace_id, [file_type])[file_type]
+        # Check the sheet list and header row before the file replaces the previous upload,
+        # so a workbook the pipeline cannot read is rejected now rather than by the job
+        partial_path = filepath + '.part'
+        file.save(partial_path)
+        try:
+            try:
+                input_schema(file_type, partial_path, input_cache)
+            except ValueError as e:
+                logging.info(f"Rejected upload {file.filename} as {file_type}: {str(e)}")
+                return f"Invalid file: {str(e)}", 400
+            os.replace(partial_path, filepath)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
         logging.info(f"Uploaded file: {file.filename} as {file_type}.xlsx")
 
         return f"File uploaded successfully: {filepath}", 200
@@ -75,49 +227,47 @@ def upload_file():
 @app.route('/process', methods=['POST'])
 def process_files():
     try:
-        required_files = [
-            os.path.join(app.config['UPLOAD_FOLDER'], "account_payables.xlsx"),
-            os.path.join(app.config['UPLOAD_FOLDER'], "bank_balance.xlsx"),
-            os.path.join(app.config['UPLOAD_FOLDER'], "cash_management.xlsx")
-        ]
+        workspace_id = current_workspace()
+        inputs = workspaces.upload_paths(workspace_id, INPUT_FILE_TYPES)
 
-        if not all(os.path.exists(file) for file in required_files):
+        if not all(os.path.exists(file) for file in inputs.values()):
             return 'Missing one or more required files.', 400
 
-        result = subprocess.run(
-            [sys.executable, SCRIPT_PATH],
-            capture_output=True,
-            text=True
-        )
-
-        if result.returncode != 0:
-            logging.error(f"Script error: {result.stderr}")
-            return f'Processing error: {result.stderr}', 500
-
-        logging.info("Processing completed successfully.")
-        return 'Processing completed, final report ready.', 200
+        # Queue the report and answer right away; identical inputs share one job per workspace and day
+        job, created = job_queue.submit(inputs, workspaces.jobs_dir(workspace_id), job_scope(workspace_id))
+        session['job'] = job.id
+        logging.info(f"Processing {'queued' if created else 'already submitted'}: job {job.id}")
+        return jsonify(job_queue.status(job.id)), 202
     except Exception as e:
         logging.error(f"Processing failed: {str(e)}")
         return f'Processing failed: {str(e)}', 500
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return 'Job not found.', 404
+    return jsonify(status), 200
+
+@app.route('/jobs/<job_id>/download')
+def download_job_report(job_id):
+    entry = catalog.get(job_id)
+    if entry is None:
+        return 'Final report not found.', 404
+    return send_report(entry)
+
 @app.route('/download/final_report')
 def download_final_report():
-    report_files = glob.glob(os.path.join(app.config['PROCESSED_FOLDER'], "Payables_Summary_*.xlsx"))
-    
-    if not report_files:
+    entry = session_report()
+    if entry is None:
         return 'Final report not found.', 404
-
-    latest_report = max(report_files, key=os.path.getctime)
-    return send_from_directory(
-        app.config['PROCESSED_FOLDER'], 
-        os.path.basename(latest_report), 
-        as_attachment=True
-    )
+    return send_report(entry)
 
 @app.route('/open-folder')
 def open_folder():
     try:
-        folder_path = os.path.abspath(app.config['PROCESSED_FOLDER'])
+        entry = session_report()
+        folder_path = os.path.dirname(entry.path) if entry else os.path.abspath(app.config['PROCESSED_FOLDER'])
         if sys.platform == 'win32':
             os.startfile(folder_path)
         return 'Folder opened successfully', 200
@@ -125,6 +275,64 @@ def open_folder():
         logging.error(f"Folder error: {str(e)}")
         return f'Folder error: {str(e)}', 500
 
+@app.route('/api/summary')
+def api_summary():
+    # Totals per company, bank and supplier of each report sheet, without building the report.
+    # ?job=<id> summarizes the inputs of that job, otherwise this session's uploads;
+    # ?format=parquet returns one row per total instead of the JSON hierarchy.
+    try:
+        inputs, error = api_inputs()
+        if error:
+            return error
+
+        output_format = request.args.get('format', 'json')
+        if output_format not in ('json', 'parquet'):
+            return f'Unknown format: {output_format}', 400
+
+        summary = cached_summary(inputs)
+        if output_format == 'json':
+            return jsonify(summary), 200
+        return send_parquet(summary_table(summary), 'payables_summary.parquet')
+    except Exception as e:
+        logging.error(f"Summary failed: {str(e)}")
+        return f'Summary failed: {str(e)}', 500
+
+@app.route('/api/aging')
+def api_aging():
+    # Open balances of the Active and Others sheets by age, per company, bank and supplier.
+    # ?as_of=YYYY-MM-DD ages the lines at that date instead of today, ?buckets=30,60,90,120
+    # sets the bucket bounds in days; ?job and ?format work as for /api/summary.
+    try:
+        inputs, error = api_inputs()
+        if error:
+            return error
+
+        output_format = request.args.get('format', 'json')
+        if output_format not in ('json', 'parquet'):
+            return f'Unknown format: {output_format}', 400
+        try:
+            as_of = aging_date(request.args.get('as_of')).date()
+            buckets = request.args.get('buckets')
+            bucket_days = [int(days) for days in buckets.split(',')] if buckets else AGING_BUCKET_DAYS
+            aging_bucket_labels(bucket_days)
+        except ValueError as e:
+            return f'Invalid aging parameters: {str(e)}', 400
+
+        aging = cached_aging(inputs, as_of, bucket_days)
+        if output_format == 'json':
+            return jsonify(aging_summary(aging, as_of, bucket_days)), 200
+        return send_parquet(aging_export_table(aging), 'payables_aging.parquet')
+    except Exception as e:
+        logging.error(f"Aging failed: {str(e)}")
+        return f'Aging failed: {str(e)}', 500
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text format: stage totals of every traced run, plus the job queue
+    jobs = format_metric('jobs', 'gauge', 'Known report jobs, by status.',
+                         {(status,): count for status, count in job_queue.status_counts().items()}, ('status',))
+    return Response(METRICS.render() + '\n'.join(jobs) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/health')
 def health_check():
     return "Application is running", 200
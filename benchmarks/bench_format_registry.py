@@ -0,0 +1,89 @@
+"""Benchmark the named format registry against one add_format call per subtotal row.
+
+Usage:
+    python benchmarks/bench_format_registry.py [rows] [companies]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Payable_Account_Automation import REPORT_STYLES, ExcelReportGenerator
+
+
+class _PerCallFormats(dict):
+    """Format lookup that creates a new Format on every access, like the old inline add_format calls."""
+
+    def __init__(self, workbook):
+        super().__init__()
+        self.workbook = workbook
+
+    def __getitem__(self, name):
+        return self.workbook.add_format(REPORT_STYLES[name])
+
+
+class PerCallFormatReportGenerator(ExcelReportGenerator):
+    def __enter__(self):
+        super().__enter__()
+        self.formats = _PerCallFormats(self.workbook)
+        return self
+
+
+def synthetic_report_frame(n_rows: int, n_companies: int, seed: int = 0) -> pd.DataFrame:
+    """Build a frame shaped like the split_by_status output, with Status kept."""
+    rng = np.random.default_rng(seed)
+    company = rng.integers(0, n_companies, n_rows)
+    bank = rng.integers(0, 3, n_rows)
+    df = pd.DataFrame({
+        'Company Name': [f'Company {c:04d}' for c in company],
+        'Bank': [f'BNC-{c:04d}-{b}' for c, b in zip(company, bank)],
+        'Available': np.round((company * 3 + bank) * 1000.0, 2),
+        'Supplier Name': [f'Supplier {s:05d}' for s in rng.integers(0, max(n_rows // 8, 1), n_rows)],
+        'Date': pd.Timestamp('2023-10-01') + pd.to_timedelta(rng.integers(0, 400, n_rows), unit='D'),
+        'Invoice No': [f'INV{i:07d}' for i in range(n_rows)],
+        'Comment': np.where(rng.random(n_rows) < 0.3, 'note', None),
+        'Total': np.round(rng.uniform(10, 20000, n_rows), 2),
+        'Paid Amount': 0.0,
+        'Payable Balance': 0.0,
+        'Status': 'ACTIVE',
+    })
+    df['Payable Balance'] = df['Total'] - df['Paid Amount']
+    return df.set_index(['Company Name', 'Bank', 'Available', 'Supplier Name'])
+
+
+def time_report(generator_cls, frame: pd.DataFrame, output_file: str):
+    """Write a full report and return (seconds, file size, Format objects created)."""
+    empty = frame.iloc[:0]
+    start = time.perf_counter()
+    with generator_cls(output_file) as report_generator:
+        report_generator.generate_report(
+            frame.drop(columns=['Status']), frame.copy(), empty.drop(columns=['Status']), empty.copy()
+        )
+        n_formats = len(report_generator.workbook.formats)
+    return time.perf_counter() - start, os.path.getsize(output_file), n_formats
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_companies = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    frame = synthetic_report_frame(n_rows, n_companies)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {
+            'per-row add_format': time_report(PerCallFormatReportGenerator, frame, os.path.join(tmp_dir, 'per_call.xlsx')),
+            'format registry': time_report(ExcelReportGenerator, frame, os.path.join(tmp_dir, 'registry.xlsx')),
+        }
+
+    print(f"{n_rows} AP lines, {n_companies} companies")
+    print(f"{'variant':<20} {'seconds':>10} {'bytes':>12} {'formats':>10}")
+    for name, (seconds, size, n_formats) in results.items():
+        print(f"{name:<20} {seconds:>10.2f} {size:>12} {n_formats:>10}")
+
+
+if __name__ == '__main__':
+    main()
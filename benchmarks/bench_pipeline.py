@@ -0,0 +1,219 @@
+"""Time and memory-profile every stage of the payables pipeline on synthetic inputs.
+
+The benchmark runs the real run_pipeline with trace=True, as the web app does, and
+reports the stages of its RunTrace: ingest, clean, merge, render (with one row per
+status sheet, AP_Aging, the aging itself and the hidden company sheets) and finalize.
+A cold run fills the input cache and the incremental state; a warm run over the
+same inputs then times the cached path. Each run is appended to a JSON lines file
+together with the git commit it ran on, and compared with the latest earlier run of
+the same configuration, so regressions show up between commits.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--scale 10k|100k|1m] [--ap-lines N] [--memory] [--no-warm]
+                                        [--workers N] [--constant-memory] [--inputs DIR] [--results FILE]
+
+AP scales are bounded by the 1,048,575 rows an .xlsx sheet can hold, for the inputs
+and the report alike. --memory traces Python allocations (numpy and pandas included)
+to report each stage's peak; it slows the run down, so compare timings without it.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from Payable_Account_Automation import INPUT_FILE_TYPES, run_pipeline
+from instrumentation import trace_path
+from synthetic_inputs import EXCEL_MAX_DATA_ROWS, SyntheticConfig, synthetic_frames, write_workbooks
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+DEFAULT_RESULTS = os.path.join(BENCH_DIR, 'results', 'pipeline.jsonl')
+
+
+class StagePeaks:
+    """A run_pipeline progress callback recording the peak traced memory of each stage."""
+
+    def __init__(self):
+        self.peaks: Dict[str, float] = {}
+        self.stage = None
+        self.base = 0
+
+    def __call__(self, stage: str):
+        self.close()
+        self.stage = stage
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+
+    def close(self):
+        if self.stage is not None:
+            self.peaks[self.stage] = round((tracemalloc.get_traced_memory()[1] - self.base) / 1e6, 1)
+            self.stage = None
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def span_stage(span: Dict[str, Any]) -> str:
+    """Name a trace span as a benchmark stage: pipeline stages as is, sheets by their name."""
+    if span['name'] != 'create_sheet':
+        return span['name'] if span['parent'] is None else f"{span['parent']} {span['name']}"
+    if span.get('hidden'):
+        return f"{span['parent']} company sheets"
+    return f"{span['parent']} {span['sheet']}"
+
+
+def trace_stages(trace: Dict[str, Any], peaks: Dict[str, float] = None, prefix: str = '') -> List[Dict[str, Any]]:
+    """Flatten a JSON trace into benchmark stages, adding up the hidden company sheets.
+
+    Args:
+        trace (Dict[str, Any]): A RunTrace as written by run_pipeline
+        peaks (Dict[str, float]): StagePeaks.peaks of the run, if memory was traced
+        prefix (str): Put before every stage name, e.g. 'warm '
+
+    Returns:
+        List[Dict[str, Any]]: stage, rows, seconds, cpu_seconds, peak_rss_mb (and peak_mb) in trace order
+    """
+    stages: Dict[str, Dict[str, Any]] = {}
+    for span in trace['spans']:
+        name = span_stage(span)
+        stage = stages.setdefault(name, {'stage': prefix + name, 'rows': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+        stage['rows'] += span['rows_in'] or 0
+        stage['seconds'] += span['wall_seconds']
+        stage['cpu_seconds'] += span['cpu_seconds']
+        if span['peak_rss_bytes'] is not None:
+            stage['peak_rss_mb'] = round(span['peak_rss_bytes'] / 1e6, 1)
+        if peaks and name in peaks:
+            stage['peak_mb'] = peaks[name]
+    for stage in stages.values():
+        stage['seconds'] = round(stage['seconds'], 4)
+        stage['cpu_seconds'] = round(stage['cpu_seconds'], 4)
+    return list(stages.values())
+
+
+def run_benchmark(inputs: Dict[str, str], work_dir: str, options: Dict[str, Any], trace_memory: bool = False,
+                  prefix: str = '') -> List[Dict[str, Any]]:
+    """Run the pipeline once and return the stages of its trace."""
+    peaks = StagePeaks() if trace_memory else None
+    output_file = run_pipeline(inputs, os.path.join(work_dir, f'{prefix.strip() or "cold"}_report.xlsx'),
+                               {**options, 'trace': True}, progress=peaks)
+    if peaks is not None:
+        peaks.close()
+    with open(trace_path(output_file), encoding='utf-8') as f:
+        trace = json.load(f)
+    return trace_stages(trace, peaks.peaks if peaks is not None else None, prefix)
+
+
+def previous_result(results_file: str, config: Dict[str, Any], commit: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Return the latest stored run of the same configuration, preferably from another commit."""
+    if not os.path.exists(results_file):
+        return None
+    matches = []
+    with open(results_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('config') == config:
+                matches.append(record)
+    others = [record for record in matches if record.get('commit') != commit]
+    return (others or matches or [None])[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='100k')
+    parser.add_argument('--ap-lines', type=int, help='Overrides --scale')
+    parser.add_argument('--companies', type=int, default=SyntheticConfig().companies)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true', help='Trace the peak memory of each stage')
+    parser.add_argument('--no-warm', action='store_true', help='Skip the run with a warm input cache and state')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes preparing the sheets')
+    parser.add_argument('--constant-memory', action='store_true', help="Stream the report's rows to disk")
+    parser.add_argument('--inputs', help='Directory with workbooks to reuse (from synthetic_inputs.py)')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='JSON lines file the run is appended to')
+    args = parser.parse_args()
+
+    ap_lines = args.ap_lines or SCALES[args.scale]
+    if ap_lines > EXCEL_MAX_DATA_ROWS and not args.inputs:
+        parser.error(f"--ap-lines must be at most {EXCEL_MAX_DATA_ROWS}, the data rows of an .xlsx sheet")
+    config = SyntheticConfig(ap_lines=ap_lines, companies=args.companies, seed=args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.inputs:
+            inputs = {file_type: os.path.join(args.inputs, f"{file_type}.xlsx") for file_type in INPUT_FILE_TYPES}
+        else:
+            print(f"Generating {ap_lines} AP lines...")
+            inputs = write_workbooks(synthetic_frames(config), tmp_dir)
+
+        # The options of the web app's jobs, with the cache and state kept in the temporary directory
+        options = {
+            'add_vba_buttons': False,
+            'input_cache': os.path.join(tmp_dir, 'cache'),
+            'incremental_state': os.path.join(tmp_dir, 'state'),
+            'workers': args.workers,
+            'constant_memory': args.constant_memory,
+        }
+        if args.memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        stages = run_benchmark(inputs, tmp_dir, options, args.memory)
+        total = time.perf_counter() - start
+        if not args.no_warm:
+            stages += run_benchmark(inputs, tmp_dir, options, args.memory, prefix='warm ')
+        if args.memory:
+            tracemalloc.stop()
+
+    commit = git_commit()
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'config': {**config._asdict(), 'inputs': args.inputs, 'memory': args.memory, 'warm': not args.no_warm,
+                   'workers': args.workers, 'constant_memory': args.constant_memory},
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'machine': platform.platform(),
+        'total_seconds': round(total, 3),
+        'stages': stages,
+    }
+    previous = previous_result(args.results, record['config'], commit)
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+    before = {stage['stage']: stage['seconds'] for stage in previous['stages']} if previous else {}
+    header = f"{'stage':<30} {'rows':>10} {'seconds':>10} {'cpu':>10} {'RSS MB':>10}"
+    if args.memory:
+        header += f" {'peak MB':>10}"
+    if previous:
+        header += f" {'was':>10} {'change':>8}   (vs {previous.get('commit')} {previous['timestamp']})"
+    print(header)
+    for stage in stages:
+        line = (f"{stage['stage']:<30} {stage['rows'] or '':>10} {stage['seconds']:>10.3f} "
+                f"{stage['cpu_seconds']:>10.3f} {stage.get('peak_rss_mb', ''):>10}")
+        if args.memory:
+            line += f" {stage.get('peak_mb', ''):>10}"
+        if stage['stage'] in before:
+            was = before[stage['stage']]
+            change = f"{(stage['seconds'] - was) / was:+.0%}" if was else ''
+            line += f" {was:>10.3f} {change:>8}"
+        print(line)
+    print(f"{'total (cold)':<30} {'':>10} {total:>10.3f}")
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Generate realistic bank_balance, account_payables and cash_management workbooks.
+
+The frames mimic the exports the pipeline reads: French AP column names, Company /
+Building / Bank keys stored as a mix of numbers and zero-padded text, several sheets in
+the bank balance ("Balance" is not the first) and cash management (the last sheet is the
+current one) workbooks, PPA suppliers, the Gestion Hazout AR supplier, CT reversals,
+lines dated before the cutoff, fully paid lines, duplicated lines, lines whose building
+is missing from the bank balance, and ACTIVE / ZAGORA / REMOVE / other statuses.
+
+Usage:
+    python benchmarks/synthetic_inputs.py OUTPUT_DIR [--ap-lines N] [--companies N] ...
+
+An .xlsx sheet holds at most 1,048,575 data rows; for larger AP scales use
+synthetic_frames() directly and feed the frames to the pipeline in memory.
+"""
+import argparse
+import os
+import sys
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Payable_Account_Automation import INPUT_FILE_TYPES, PPA_supplier_codes
+
+EXCEL_MAX_DATA_ROWS = 1_048_575
+
+AR_SUPPLIER = ('GES001', 'Gestion Hazout Inc')
+BUILDING_STATUSES = ['ACTIVE', 'ZAGORA', 'REMOVE', 'INACTIVE']
+BUILDING_STATUS_WEIGHTS = [0.7, 0.15, 0.05, 0.1]
+
+
+class SyntheticConfig(NamedTuple):
+    ap_lines: int = 100_000
+    companies: int = 60
+    buildings_per_company: int = 4  # Each company gets 1 to this many buildings
+    banks_per_company: int = 2  # Each company gets 1 to this many bank accounts
+    suppliers: int = 2_000
+    ppa_share: float = 0.05  # Lines from PPA suppliers, excluded from the report
+    ar_share: float = 0.03  # Lines from the Gestion Hazout AR supplier
+    before_cutoff_share: float = 0.35  # Lines dated before the AP cutoff
+    fully_paid_share: float = 0.45
+    partially_paid_share: float = 0.2
+    reversal_share: float = 0.03  # CT reversal lines
+    duplicate_share: float = 0.005  # Lines exported twice
+    unknown_building_share: float = 0.01  # Lines whose building is not in the bank balance
+    seed: int = 0
+
+
+def _mixed_codes(rng: np.random.Generator, codes: np.ndarray, width: int) -> np.ndarray:
+    """Store about a third of the codes as zero-padded text, like the exports do."""
+    as_text = rng.random(len(codes)) < 1 / 3
+    return np.where(as_text, pd.Series(codes).astype(str).str.zfill(width).to_numpy(), codes.astype(object))
+
+
+def synthetic_frames(config: SyntheticConfig) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Build the raw bank balance, account payables and cash management frames.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: Frames shaped like what load_inputs returns
+    """
+    rng = np.random.default_rng(config.seed)
+
+    # Bank balance: one row per building
+    companies = np.arange(100, 100 + config.companies)
+    n_buildings = rng.integers(1, config.buildings_per_company + 1, config.companies)
+    n_banks = rng.integers(1, config.banks_per_company + 1, config.companies)
+    company_banks = [rng.choice(np.arange(1, 10_000), n, replace=False) for n in n_banks]
+    bb_company = np.repeat(companies, n_buildings)
+    bb_building = np.concatenate([np.arange(1, n + 1) for n in n_buildings])
+    bb_bank = np.concatenate([rng.choice(banks, n) for banks, n in zip(company_banks, n_buildings)])
+    bb = pd.DataFrame({
+        'Company': _mixed_codes(rng, bb_company, 3),
+        'Company Name': [f'Company {c} Inc' for c in bb_company],
+        'Building': bb_building,
+        'Bank': _mixed_codes(rng, bb_bank, 4),
+        'Bank Account': [f'BNC-{c}-{b:04d}' for c, b in zip(bb_company, bb_bank)],
+        'Status': rng.choice(BUILDING_STATUSES, len(bb_company), p=BUILDING_STATUS_WEIGHTS),
+    })
+
+    # Cash management: one row per company bank account, 'Available' is negative cash
+    cm_company = np.repeat(companies, n_banks)
+    cm_bank = np.concatenate(company_banks)
+    available = np.round(rng.normal(-50_000, 40_000, len(cm_company)), 2)
+    available[rng.random(len(available)) < 0.1] = 0
+    cm = pd.DataFrame({'Co. no.': cm_company, 'Bank': _mixed_codes(rng, cm_bank, 4), 'Available': available})
+
+    # Account payables
+    n = config.ap_lines
+    supplier_idx = rng.integers(0, config.suppliers, n)
+    supplier_code = np.array([f'SUP{i:05d}' for i in range(config.suppliers)], dtype=object)[supplier_idx]
+    supplier_name = np.array([f'Supplier {i:05d} Ltd' for i in range(config.suppliers)], dtype=object)[supplier_idx]
+    kind = rng.random(n)
+    ppa = kind < config.ppa_share
+    supplier_code[ppa] = rng.choice(PPA_supplier_codes, ppa.sum())
+    supplier_name[ppa] = [f'{code} Utilities' for code in supplier_code[ppa]]
+    ar = (kind >= config.ppa_share) & (kind < config.ppa_share + config.ar_share)
+    supplier_code[ar], supplier_name[ar] = AR_SUPPLIER
+
+    building_row = rng.integers(0, len(bb), n)
+    ap_company = bb_company[building_row]
+    ap_building = bb_building[building_row].copy()
+    unknown = rng.random(n) < config.unknown_building_share
+    ap_building[unknown] = n_buildings.max() + 1
+
+    cutoff_days = (pd.Timestamp('2023-10-01') - pd.Timestamp('2022-01-01')).days
+    before = rng.random(n) < config.before_cutoff_share
+    days = np.where(before, rng.integers(0, cutoff_days, n), rng.integers(cutoff_days, cutoff_days + 640, n))
+    dates = pd.Timestamp('2022-01-01') + pd.to_timedelta(days, unit='D')
+
+    total = np.round(rng.lognormal(7, 1.3, n), 2)
+    paid_kind = rng.random(n)
+    paid = np.where(
+        paid_kind < config.fully_paid_share, total,
+        np.where(paid_kind < config.fully_paid_share + config.partially_paid_share,
+                 np.round(total * rng.random(n), 2), 0.0))
+
+    comments = np.where(rng.random(n) < 0.4, 'Facture mensuelle', None).astype(object)
+    reversal = rng.random(n) < config.reversal_share
+    comments[reversal] = 'CT annulation'
+
+    invoice_no = np.arange(1, n + 1)
+    invoice = np.where(rng.random(n) < 0.5, invoice_no, pd.Series(invoice_no).map('F-{:07d}'.format).to_numpy())
+
+    ap = pd.DataFrame({
+        'Code de fournisseur': supplier_code,
+        'Nom du fournisseur': supplier_name,
+        'Compagnie': ap_company,
+        'Immeuble': ap_building,
+        'Date': dates,
+        'No facture': invoice,
+        'Commentaire': comments,
+        'Total': total,
+        'Montant payé': paid,
+    })
+    duplicates = ap[rng.random(n) < config.duplicate_share]
+    ap = pd.concat([ap, duplicates]).sort_values('Date', kind='stable').reset_index(drop=True)
+    return bb, ap, cm
+
+
+def _write_sheet(workbook: xlsxwriter.Workbook, name: str, df: pd.DataFrame):
+    worksheet = workbook.add_worksheet(name)
+    worksheet.write_row(0, 0, list(df.columns))
+    # Empty cells for missing values; dates get the workbook's default date format
+    columns = [df[col].astype(object).where(df[col].notna(), None).to_numpy() for col in df.columns]
+    for row_idx, row in enumerate(zip(*columns), start=1):
+        worksheet.write_row(row_idx, 0, row)
+
+
+def write_workbooks(frames: Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], output_dir: str) -> dict:
+    """Write the frames as the three uploaded workbooks and return their paths, keyed by file type."""
+    bb, ap, cm = frames
+    if len(ap) > EXCEL_MAX_DATA_ROWS:
+        raise ValueError(f"{len(ap)} AP lines do not fit in one sheet ({EXCEL_MAX_DATA_ROWS} rows at most)")
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {file_type: os.path.join(output_dir, f"{file_type}.xlsx") for file_type in INPUT_FILE_TYPES}
+    sheets = {
+        'bank_balance': [('Notes', bb.head(3)), ('Balance', bb)],
+        'account_payables': [('Export', ap)],
+        'cash_management': [('Previous', cm.head(5)), ('Latest', cm)],
+    }
+    for file_type, file_sheets in sheets.items():
+        options = {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd'}
+        with xlsxwriter.Workbook(paths[file_type], options) as workbook:
+            for name, df in file_sheets:
+                _write_sheet(workbook, name, df)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output_dir')
+    defaults = SyntheticConfig()
+    for field in SyntheticConfig._fields:
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(getattr(defaults, field)),
+                            default=getattr(defaults, field))
+    args = parser.parse_args()
+
+    config = SyntheticConfig(**{field: getattr(args, field) for field in SyntheticConfig._fields})
+    bb, ap, cm = synthetic_frames(config)
+    paths = write_workbooks((bb, ap, cm), args.output_dir)
+    print(f"{len(ap)} AP lines, {len(bb)} buildings, {len(cm)} bank accounts")
+    for path in paths.values():
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
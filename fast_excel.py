@@ -0,0 +1,374 @@
+"""Stream the rows of a worksheet and filter them before they become a DataFrame.
+
+pd.read_excel materialises every row of a sheet before the caller can drop any of
+them. For the account payables export most rows are historical, fully paid lines
+that the pipeline throws away straight after reading. read_filtered_sheet streams the
+sheet row by row, asks a filter whether each row is needed, and only hands the kept
+rows to pandas' own TextParser, so the resulting frame has exactly the columns and
+dtypes pd.read_excel would have produced for those rows.
+
+Row engines convert cell values the same way as the matching pandas reader:
+
+- 'openpyxl': openpyxl in read_only mode (always available)
+- 'calamine': python-calamine, a Rust parser that is several times faster
+  (optional, ``pip install python-calamine``)
+
+'auto' uses calamine when it is installed and openpyxl otherwise.
+
+read_xlsx_header lists the sheets of a workbook and reads one header row straight from
+the .xlsx archive, streaming the XML until that row ends, so checking an upload does
+not depend on the size of the sheet.
+"""
+import posixpath
+import re
+import zipfile
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from xml.etree.ElementTree import iterparse
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# A row filter receives a converted row and returns the name of the stage
+# discarding it, or None to keep it
+RowFilter = Callable[[list], Optional[str]]
+
+# Text cells read as missing: pandas' default na_values, passed to TextParser explicitly
+# so that _value_kind and the parser agree without importing pandas internals
+NA_STRINGS = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+
+def iter_openpyxl_rows(path: str, sheet: Union[int, str] = 0) -> Iterator[list]:
+    """Yield the rows of a sheet (position or name), converted like pandas' openpyxl reader."""
+    from openpyxl import load_workbook
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    book = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        worksheet = book[sheet] if isinstance(sheet, str) else book.worksheets[sheet]
+        worksheet.reset_dimensions()
+        for row in worksheet.rows:
+            converted = []
+            for cell in row:
+                value = cell.value
+                if value is None:
+                    value = ""
+                elif cell.data_type == TYPE_ERROR:
+                    value = np.nan
+                elif cell.data_type == TYPE_NUMERIC:
+                    as_int = int(value)
+                    value = as_int if as_int == value else float(value)
+                converted.append(value)
+            while converted and converted[-1] == "":
+                converted.pop()
+            yield converted
+    finally:
+        book.close()
+
+
+def iter_calamine_rows(path: str, sheet: Union[int, str] = 0) -> Iterator[list]:
+    """Yield the rows of a sheet (position or name), converted like pandas' calamine reader."""
+    from python_calamine import CalamineWorkbook
+
+    def convert(value):
+        if isinstance(value, float):
+            as_int = int(value)
+            return as_int if as_int == value else value
+        if isinstance(value, date):
+            return pd.Timestamp(value)
+        if isinstance(value, timedelta):
+            return pd.Timedelta(value)
+        return value
+
+    workbook = CalamineWorkbook.from_path(path)
+    try:
+        if isinstance(sheet, str):
+            worksheet = workbook.get_sheet_by_name(sheet)
+        else:
+            worksheet = workbook.get_sheet_by_index(sheet % len(workbook.sheet_names))
+        # iter_rows streams the used columns only; restore the empty leading columns
+        leading = [""] * (worksheet.start[1] if worksheet.start else 0)
+        for row in worksheet.iter_rows():
+            yield leading + [convert(value) for value in row]
+    finally:
+        workbook.close()
+
+
+ROW_ENGINES = {
+    'openpyxl': iter_openpyxl_rows,
+    'calamine': iter_calamine_rows,
+}
+
+
+def resolve_engine(engine: str = 'auto') -> str:
+    """Return the row engine to use: 'auto' picks calamine when it is installed."""
+    if engine == 'auto':
+        try:
+            import python_calamine  # noqa: F401
+            return 'calamine'
+        except ImportError:
+            return 'openpyxl'
+    if engine not in ROW_ENGINES:
+        raise ValueError(f"Unknown Excel engine '{engine}', expected 'auto' or one of {sorted(ROW_ENGINES)}")
+    return engine
+
+_CELL_REFERENCE = re.compile(r'([A-Z]+)')
+
+
+def _local_name(tag: str) -> str:
+    # Transitional and strict .xlsx files name the same elements in different namespaces
+    return tag.rsplit('}', 1)[-1]
+
+
+def _part_targets(archive: zipfile.ZipFile, part: str) -> Dict[str, Tuple[str, str]]:
+    """Return the (type, path) of each relationship of a part, keyed by relationship id."""
+    directory, name = posixpath.split(part)
+    rels = posixpath.join(directory, '_rels', name + '.rels')
+    targets = {}
+    with archive.open(rels) as f:
+        for _, element in iterparse(f):
+            if _local_name(element.tag) == 'Relationship':
+                target = element.get('Target', '')
+                path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(
+                    posixpath.join(directory, target))
+                targets[element.get('Id')] = (element.get('Type', ''), path)
+    return targets
+
+
+def _column_index(reference: str) -> Optional[int]:
+    match = _CELL_REFERENCE.match(reference or '')
+    if match is None:
+        return None
+    index = 0
+    for letter in match.group(1):
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _shared_strings(archive: zipfile.ZipFile, path: Optional[str], count: int) -> List[str]:
+    """Return the first count shared strings, streaming no further than the last of them."""
+    strings = []
+    if path is None or count <= 0:
+        return strings
+    with archive.open(path) as f:
+        for _, element in iterparse(f):
+            if _local_name(element.tag) != 'si':
+                continue
+            # Rich text is split into runs; phonetic hints (rPh) are not part of the value
+            texts = []
+            for child in element:
+                if _local_name(child.tag) == 't':
+                    texts.append(child.text or '')
+                elif _local_name(child.tag) == 'r':
+                    texts += [t.text or '' for t in child if _local_name(t.tag) == 't']
+            strings.append(''.join(texts))
+            element.clear()
+            if len(strings) >= count:
+                break
+    return strings
+
+
+def _first_row_cells(archive: zipfile.ZipFile, path: str) -> List[Tuple[int, Optional[str], Any]]:
+    """Return the (column, type, raw value) of the cells of a sheet's first non-empty row."""
+    cells = []
+    with archive.open(path) as f:
+        column = 0
+        for _, element in iterparse(f):
+            name = _local_name(element.tag)
+            if name == 'c':
+                index = _column_index(element.get('r'))
+                column = column if index is None else index
+                kind = element.get('t')
+                value = None
+                for child in element:
+                    if _local_name(child.tag) == 'v':
+                        value = child.text
+                    elif _local_name(child.tag) == 'is':
+                        value = ''.join(t.text or '' for t in child.iter() if _local_name(t.tag) == 't')
+                if value is not None:
+                    cells.append((column, kind, value))
+                column += 1
+            elif name == 'row':
+                if cells:
+                    break
+                column = 0
+                element.clear()
+    return cells
+
+
+def read_xlsx_header(path: str, choose_sheet: Callable[[List[str]], str]) -> Tuple[List[str], str, list]:
+    """List the sheets of an .xlsx workbook and read the header row of one of them.
+
+    Only the workbook's sheet list, the start of the chosen sheet and as many shared
+    strings as its header uses are read, whatever the size of the sheet. The header is
+    the sheet's first row holding values, converted like the row engines convert cells.
+    A file that is not an .xlsx archive raises zipfile.BadZipFile.
+
+    Args:
+        path (str): The workbook to read
+        choose_sheet (Callable[[List[str]], str]): Picks the sheet from the sheet names
+
+    Returns:
+        Tuple[List[str], str, list]: The sheet names, the chosen sheet (None if there are
+        no sheets) and its header row
+    """
+    with zipfile.ZipFile(path) as archive:
+        workbook = next(target for kind, target in _part_targets(archive, '').values()
+                           if kind.endswith('/officeDocument'))
+        targets = _part_targets(archive, workbook)
+        sheets = {}
+        with archive.open(workbook) as f:
+            for _, element in iterparse(f):
+                if _local_name(element.tag) == 'sheet':
+                    relationship = next(value for key, value in element.attrib.items()
+                                        if _local_name(key) == 'id' and key.startswith('{'))
+                    sheets[element.get('name')] = targets[relationship][1]
+        sheet_names = list(sheets)
+        if not sheet_names:
+            return sheet_names, None, []
+        sheet_name = choose_sheet(sheet_names)
+
+        cells = _first_row_cells(archive, sheets[sheet_name])
+        shared = max((int(value) + 1 for _, kind, value in cells if kind == 's'), default=0)
+        shared_path = next((target for kind, target in targets.values() if kind.endswith('/sharedStrings')), None)
+        strings = _shared_strings(archive, shared_path, shared)
+
+    header = [""] * (max(column for column, _, _ in cells) + 1 if cells else 0)
+    for column, kind, value in cells:
+        if kind == 's':
+            value = strings[int(value)] if int(value) < len(strings) else ""
+        elif kind == 'b':
+            value = value == '1'
+        elif kind == 'e':
+            value = np.nan
+        elif kind not in ('str', 'inlineStr', 'd'):
+            number = float(value)
+            value = int(number) if number.is_integer() else number
+        header[column] = value
+    return sheet_names, sheet_name, header
+
+
+_INT_STRING = re.compile(r'\s*[-+]?\d+\s*$')
+_FLOAT_STRING = re.compile(r'\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$')
+_INF_STRINGS = {'inf', '+inf', '-inf', 'infinity', '+infinity', '-infinity'}
+
+
+def _value_kind(value: Any) -> Any:
+    """Classify a cell value by the way it can affect a column's inferred dtype."""
+    if isinstance(value, str):
+        if value in NA_STRINGS:
+            return 'blank'
+        if _INT_STRING.match(value):
+            return 'int string'
+        if _FLOAT_STRING.match(value):
+            return 'float string'
+        if value.strip().lower() in _INF_STRINGS:
+            return 'inf string'
+        return 'text'
+    if isinstance(value, float) and value != value:
+        return 'blank'
+    if isinstance(value, int) and not isinstance(value, bool) and not -2 ** 63 <= value < 2 ** 63:
+        return 'big int'
+    return type(value)
+
+
+class _TypeWitnesses:
+    """One discarded value of each kind per column.
+
+    pandas infers a column's dtype from all of its values, so dropping rows before
+    parsing could change the type of the rows that are kept (a column that is text
+    only in historical rows would turn numeric). Parsing one witness of each kind
+    along with the kept rows, then dropping the witnesses, gives the kept rows the
+    dtype they would have had in a full read.
+    """
+
+    def __init__(self):
+        self.columns: List[Dict[Any, Any]] = []
+        self.shortest_row: Optional[int] = None
+
+    def add(self, row: list):
+        while len(self.columns) < len(row):
+            self.columns.append({})
+        if self.shortest_row is None or len(row) < self.shortest_row:
+            self.shortest_row = len(row)
+        for column, value in zip(self.columns, row):
+            if 'text' in column:
+                continue  # Text keeps the column as object whatever else it holds
+            kind = _value_kind(value)
+            if kind not in column:
+                column[kind] = value
+
+    def rows(self, width: int) -> List[list]:
+        """Return rows holding every witness, padded with each column's own witnesses."""
+        if self.shortest_row is None:
+            return []
+        columns = [list(kinds.values()) for kinds in self.columns] + [[] for _ in range(width - len(self.columns))]
+        for column_idx in range(self.shortest_row, width):
+            # Short discarded rows were padded with empty cells
+            if "" not in columns[column_idx]:
+                columns[column_idx].append("")
+        count = max(len(values) for values in columns)
+        return [[values[i] if i < len(values) else values[0] for values in columns] for i in range(count)]
+
+
+def read_filtered_sheet(path: str, make_filter: Callable[[List[str]], RowFilter], engine: str = 'auto',
+                        label: str = None, sheet: Union[int, str] = 0) -> pd.DataFrame:
+    """Read a sheet of a workbook, keeping only the rows a filter accepts.
+
+    The first row is the header. Rows the filter discards are counted per stage and
+    never reach pandas; a summary of the counts is printed.
+
+    Args:
+        path (str): The workbook to read
+        make_filter (Callable[[List[str]], RowFilter]): Builds the row filter from the header row
+        engine (str): Name of the row engine in ROW_ENGINES, or 'auto'
+        label (str): Name used in the printed summary, defaults to the path
+        sheet (Union[int, str]): Position or name of the sheet, the first by default
+
+    Returns:
+        pd.DataFrame: The kept rows, typed as pd.read_excel would type them
+    """
+    rows = ROW_ENGINES[resolve_engine(engine)](path, sheet)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+
+    row_filter = make_filter(header)
+    data = [header]
+    witnesses = _TypeWitnesses()
+    width = len(header)
+    rows_read = 0
+    empty_rows = 0
+    discarded: Dict[str, int] = {}
+    for row in rows:
+        if not row:
+            # Empty rows only count once a row with data follows: pandas trims trailing ones
+            empty_rows += 1
+            continue
+        for row in [[]] * empty_rows + [row]:
+            rows_read += 1
+            # Discarded rows still widen the sheet, as they would for pd.read_excel
+            width = max(width, len(row))
+            stage = row_filter(row)
+            if stage is None:
+                data.append(row)
+            else:
+                discarded[stage] = discarded.get(stage, 0) + 1
+                witnesses.add(row)
+        empty_rows = 0
+
+    kept = len(data) - 1
+    data += witnesses.rows(width)
+
+    # Pad every row to the sheet width, like pandas' Excel readers
+    data = [row + [""] * (width - len(row)) if len(row) < width else row for row in data]
+    df = TextParser(data, header=0, skip_blank_lines=False, na_values=NA_STRINGS, keep_default_na=False).read()
+    df = df.iloc[:kept]
+
+    stages = ", ".join(f"{count} {stage}" for stage, count in discarded.items())
+    print(f"{label or path}: {rows_read} rows read, {len(df)} kept" + (f" (dropped: {stages})" if stages else ""))
+    return df
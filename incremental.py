@@ -0,0 +1,101 @@
+"""State kept between runs for incremental report generation.
+
+Intraday refreshes usually change the AP lines of a few companies only. The report
+generator stores, for every sheet, a content hash of each company's rows together
+with the company's prepared block (cleaned detail rows, planned layout, totals and
+column widths). On the next run, companies whose rows hash the same reuse their
+block and only the others are cleaned and planned again.
+
+Rows are hashed after the merge, so a change in the bank balance or cash management
+workbook (a new Available, a building changing status) invalidates the companies it
+touches too, not only changed AP lines.
+
+The state is one pickle per directory, replaced atomically after each run.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Any, Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+# Bump when what is stored per company changes, so stale state is never reused
+STATE_VERSION = '2'
+
+_STATE_FILE = 'incremental_state.pkl'
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Return one 64-bit content hash per row, independent of the index."""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def group_digests(hashes: np.ndarray, positions: Dict[Any, np.ndarray]) -> Dict[Any, str]:
+    """Digest the row hashes of each group, in row order.
+
+    Args:
+        hashes (np.ndarray): Row hashes from row_hashes
+        positions (Dict[Any, np.ndarray]): Row positions of each group, as groupby().indices returns
+
+    Returns:
+        Dict[Any, str]: SHA-256 hex digest of each group's rows
+    """
+    return {key: hashlib.sha256(hashes[rows].tobytes()).hexdigest() for key, rows in positions.items()}
+
+
+def frame_signature(df: pd.DataFrame, *settings: Any) -> str:
+    """Identify the columns, dtypes and settings a sheet was prepared with."""
+    parts = [STATE_VERSION] + [f"{col}:{dtype}" for col, dtype in df.dtypes.items()] + [repr(s) for s in settings]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+class IncrementalStore:
+    """The previous run's per-company results of every sheet, in a directory.
+
+    The state maps a sheet name to {'signature': str, 'companies': {company: (digest, block)}}.
+
+    Args:
+        state_dir (str): Directory holding the state
+    """
+
+    def __init__(self, state_dir: str):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, _STATE_FILE)
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Return the stored state, or an empty one if there is none or it cannot be read."""
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Ignoring unreadable incremental state {self.path}: {e}")
+            return {}
+        if state.get('version') != STATE_VERSION:
+            return {}
+        return state['sheets']
+
+    def save(self, sheets: Dict[str, Dict[str, Any]]):
+        """Replace the stored state atomically."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({'version': STATE_VERSION, 'sheets': sheets}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def clear(self):
+        """Forget the stored state, so the next run prepares every company."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def changed_keys(previous: Dict[Any, tuple], digests: Dict[Any, str]) -> Iterable[Any]:
+    """Return the keys whose digest is new or differs from the previous run's."""
+    return [key for key, digest in digests.items() if key not in previous or previous[key][0] != digest]
@@ -0,0 +1,172 @@
+"""Content-addressed cache of parsed input workbooks.
+
+Parsing an .xlsx with pd.read_excel is by far the slowest part of reading the inputs,
+and the bank balance and cash management files rarely change between runs. Entries are
+keyed by the SHA-256 of the file's bytes plus a variant string describing how the file
+was read (sheet choice, filters), so a re-uploaded identical file is a hit whatever its
+name or modification time.
+
+Frames are stored with DataFrame.to_pickle: it round-trips object columns exactly
+(NaN stays NaN, mixed int/str invoice numbers stay as they are), which the key
+normalization relies on, and it loads in milliseconds.
+
+The cache also keeps, as small JSON entries, the sheet and header checks made on a
+file when it was uploaded, so processing it later does not redo them.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# Bump when the readers change what they return, so stale entries are never served
+CACHE_VERSION = '3'
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 32
+
+_ENTRY_SUFFIX = '.pkl'
+_SCHEMA_SUFFIX = '.schema.json'
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InputCache:
+    """A directory of pickled DataFrames, evicted least recently used first.
+
+    Args:
+        cache_dir (str): Directory holding the cache entries
+        max_bytes (int): Total size above which the oldest entries are removed
+        max_entries (int): Number of entries above which the oldest entries are removed
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, digest: str, variant: str) -> str:
+        """Return the entry name for a file digest read a given way."""
+        variant_hash = hashlib.sha256(f"{CACHE_VERSION}|{pd.__version__}|{variant}".encode()).hexdigest()
+        return f"{digest[:32]}-{variant_hash[:16]}"
+
+    def _entry_path(self, key: str, suffix: str = _ENTRY_SUFFIX) -> str:
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def load(self, path: str, variant: str, reader: Callable[[str], pd.DataFrame],
+             digest: Optional[str] = None) -> pd.DataFrame:
+        """Return the frame read from path, from the cache when the same content was read before.
+
+        Args:
+            path (str): The input workbook
+            variant (str): How reader interprets the file, e.g. its sheet choice
+            reader (Callable[[str], pd.DataFrame]): Parses the file on a cache miss
+            digest (Optional[str]): The file's file_digest, when the caller already has it
+
+        Returns:
+            pd.DataFrame: The parsed frame
+        """
+        entry = self._entry_path(self.key(digest or file_digest(path), variant))
+        if os.path.exists(entry):
+            try:
+                df = pd.read_pickle(entry)
+                os.utime(entry)  # Mark as recently used
+                print(f"Input cache hit: {os.path.basename(path)} ({variant})")
+                return df
+            except Exception as e:
+                # A truncated or incompatible entry is simply rebuilt
+                print(f"Discarding unreadable cache entry {entry}: {e}")
+                self._remove(entry)
+
+        df = reader(path)
+        self._store(entry, df)
+        self.evict()
+        return df
+
+    def load_schema(self, digest: str, variant: str) -> Optional[Dict[str, Any]]:
+        """Return the checks stored for a file digest, or None if it was not checked the same way."""
+        entry = self._entry_path(self.key(digest, variant), _SCHEMA_SUFFIX)
+        try:
+            with open(entry, encoding='utf-8') as f:
+                schema = json.load(f)
+            os.utime(entry)
+            return schema
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Discarding unreadable cache entry {entry}: {e}")
+            self._remove(entry)
+            return None
+
+    def store_schema(self, digest: str, variant: str, schema: Dict[str, Any]):
+        """Store the JSON-serializable checks made on a file digest."""
+        entry = self._entry_path(self.key(digest, variant), _SCHEMA_SUFFIX)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(schema, f)
+            os.replace(tmp_path, entry)
+        except Exception as e:
+            print(f"Could not store cache entry {entry}: {e}")
+            self._remove(tmp_path)
+        self.evict()
+
+    def _store(self, entry: str, df: pd.DataFrame):
+        # Write to a temporary file first so a concurrent reader never sees a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, entry)
+        except Exception as e:
+            print(f"Could not store cache entry {entry}: {e}")
+            self._remove(tmp_path)
+
+    def _entries(self, suffix: str = _ENTRY_SUFFIX) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(suffix):
+                entry = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(entry)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove the least recently used entries until the size and count limits hold.
+
+        Frames and schemas are counted separately, so the small schema entries never
+        push a frame out.
+        """
+        for suffix in (_ENTRY_SUFFIX, _SCHEMA_SUFFIX):
+            entries = self._entries(suffix)
+            total = sum(size for _, size, _ in entries)
+            while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+                _, size, entry = entries.pop(0)
+                self._remove(entry)
+                total -= size
+
+    def clear(self):
+        """Remove every entry."""
+        for suffix in (_ENTRY_SUFFIX, _SCHEMA_SUFFIX):
+            for _, _, entry in self._entries(suffix):
+                self._remove(entry)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,322 @@
+"""Stage-level instrumentation of report runs.
+
+A RunTrace records, for every pipeline stage and every sheet written, the wall time,
+the CPU time of the thread running it, the process' peak resident set size once it
+ended, and the number of rows that went in and came out. run_pipeline writes the
+trace as JSON next to the report, and adds it to METRICS, which the web app exposes
+in the Prometheus text format on /metrics.
+
+A disabled trace records nothing: entering a stage only checks a flag, so the
+pipeline keeps its instrumentation calls whether or not tracing is on.
+
+Peak RSS is the high-water mark of the whole process since it started, so a stage
+that raises it is the one that set the peak. It is read with the resource module
+on Unix and GetProcessMemoryInfo on Windows. CPU time does not include the worker
+processes that prepare sheets when the report is generated with workers > 0.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Version of the JSON trace layout
+TRACE_VERSION = 1
+
+METRICS_PREFIX = 'payables'
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Return the peak resident set size of this process so far, or None where unknown."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return int(peak) if sys.platform == 'darwin' else int(peak) * 1024
+    if sys.platform == 'win32':
+        try:
+            return _windows_peak_working_set()
+        except (OSError, AttributeError):
+            return None
+    return None
+
+
+def _windows_peak_working_set() -> int:
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD),
+            ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    kernel32 = ctypes.windll.kernel32
+    psapi = ctypes.windll.psapi
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        raise OSError('GetProcessMemoryInfo failed')
+    return int(counters.PeakWorkingSetSize)
+
+
+class Span:
+    """One measured stage or sheet; set rows_out before it ends."""
+
+    __slots__ = ('name', 'parent', 'attributes', 'rows_in', 'rows_out', 'start', 'wall_seconds',
+                 '_wall_start', '_cpu_start', 'cpu_seconds', 'peak_rss_bytes')
+
+    def __init__(self, name: str, parent: Optional[str] = None, rows_in: Optional[int] = None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.start = time.time()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_bytes = None
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        self.cpu_seconds = time.thread_time() - self._cpu_start
+        self.peak_rss_bytes = peak_rss_bytes()
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            'name': self.name,
+            'parent': self.parent,
+            'start': datetime.fromtimestamp(self.start).isoformat(timespec='milliseconds'),
+            'wall_seconds': round(self.wall_seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+        }
+        record.update(self.attributes)
+        return record
+
+
+class _DisabledSpan:
+    """Stands in for a Span when tracing is off; setting rows_out is harmless."""
+
+    __slots__ = ('rows_out',)
+
+    def __init__(self):
+        self.rows_out = None
+
+
+class RunTrace:
+    """Records the stages of one run.
+
+    Top-level stages follow each other: enter() ends the current stage and starts the
+    next one, the way run_pipeline reports its progress. span() measures a nested
+    step, such as writing one sheet, as a child of the current stage.
+
+    Args:
+        enabled (bool): Record anything at all
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started = time.time()
+        self.spans: List[Span] = []
+        self.current: Optional[Span] = None
+        self.error = None
+
+    def enter(self, stage: str, rows_in: Optional[int] = None):
+        """End the current stage and start the next one."""
+        if not self.enabled:
+            return
+        self.close()
+        self.current = Span(stage, rows_in=rows_in)
+        self.spans.append(self.current)
+
+    def set_rows_out(self, rows: int):
+        """Record how many rows the current stage produced."""
+        if self.enabled and self.current is not None:
+            self.current.rows_out = rows
+
+    def close(self, error: Optional[BaseException] = None):
+        """End the current stage, if any; error marks the run as failed."""
+        if not self.enabled:
+            return
+        if self.current is not None:
+            self.current.finish()
+            self.current = None
+        if error is not None:
+            self.error = str(error)
+
+    @contextmanager
+    def span(self, name: str, rows_in: Optional[int] = None, **attributes) -> Iterator[Any]:
+        """Measure a nested step of the current stage; attributes are stored with it."""
+        if not self.enabled:
+            yield _DisabledSpan()
+            return
+        parent = self.current.name if self.current is not None else None
+        span = Span(name, parent, rows_in, **attributes)
+        self.spans.append(span)
+        try:
+            yield span
+        finally:
+            span.finish()
+
+    def stages(self) -> List[Span]:
+        """Return the top-level stages, in order."""
+        return [span for span in self.spans if span.parent is None]
+
+    def to_dict(self) -> Dict[str, Any]:
+        stages = self.stages()
+        return {
+            'version': TRACE_VERSION,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'wall_seconds': round(sum(span.wall_seconds for span in stages), 6),
+            'cpu_seconds': round(sum(span.cpu_seconds for span in stages), 6),
+            'peak_rss_bytes': max((span.peak_rss_bytes or 0 for span in self.spans), default=None),
+            'error': self.error,
+            'spans': [span.to_dict() for span in self.spans],
+        }
+
+    def write(self, path: str):
+        """Write the trace as JSON, atomically so readers never see half a file."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        os.replace(tmp_path, path)
+
+
+def trace_path(report_path: str) -> str:
+    """Return where the JSON trace of a report is written."""
+    return os.path.splitext(report_path)[0] + '.trace.json'
+
+
+class StageMetrics:
+    """Totals of every traced run, rendered in the Prometheus text format.
+
+    Spans are aggregated by name, so the sheets of a report (one span per company
+    sheet) add up into one 'create_sheet' series instead of one series per company.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {'success': 0, 'error': 0}
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self.last_run: Dict[str, float] = {}
+
+    def observe(self, trace: RunTrace):
+        """Add a finished run to the totals."""
+        if not trace.enabled:
+            return
+        with self.lock:
+            self.runs['error' if trace.error else 'success'] += 1
+            for span in trace.spans:
+                totals = self.spans.setdefault(span.name, {
+                    'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+                    'last_wall_seconds': 0.0,
+                })
+                totals['count'] += 1
+                totals['wall_seconds'] += span.wall_seconds
+                totals['cpu_seconds'] += span.cpu_seconds
+                totals['rows_in'] += span.rows_in or 0
+                totals['rows_out'] += span.rows_out or 0
+                totals['last_wall_seconds'] = span.wall_seconds
+            summary = trace.to_dict()
+            self.last_run = {
+                'wall_seconds': summary['wall_seconds'],
+                'cpu_seconds': summary['cpu_seconds'],
+                'timestamp_seconds': trace.started,
+            }
+
+    def render(self) -> str:
+        """Return the totals in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            spans = sorted(self.spans.items())
+            lines += format_metric('runs_total', 'counter', 'Report runs traced, by outcome.',
+                                   {(outcome,): count for outcome, count in sorted(self.runs.items())}, ('outcome',))
+            for name, kind, help_text, field in _STAGE_METRICS:
+                lines += format_metric(name, kind, help_text, {(stage,): totals[field] for stage, totals in spans},
+                                       ('stage',))
+            for field, help_text in _LAST_RUN_METRICS:
+                if field in self.last_run:
+                    lines += format_metric(f'last_run_{field}', 'gauge', help_text, {(): self.last_run[field]})
+
+        peak = peak_rss_bytes()
+        if peak is not None:
+            lines += format_metric('process_peak_rss_bytes', 'gauge', 'Peak resident set size of the process.',
+                                   {(): peak})
+        return '\n'.join(lines) + '\n'
+
+
+# (metric name, type, help, StageMetrics total) of the per-stage series
+_STAGE_METRICS = [
+    ('stage_runs_total', 'counter', 'Times a stage ran.', 'count'),
+    ('stage_wall_seconds_total', 'counter', 'Wall time spent in a stage.', 'wall_seconds'),
+    ('stage_cpu_seconds_total', 'counter', 'CPU time of the thread running a stage.', 'cpu_seconds'),
+    ('stage_rows_in_total', 'counter', 'Rows that went into a stage.', 'rows_in'),
+    ('stage_rows_out_total', 'counter', 'Rows that came out of a stage.', 'rows_out'),
+    ('stage_last_wall_seconds', 'gauge', 'Wall time of the latest run of a stage.', 'last_wall_seconds'),
+]
+
+_LAST_RUN_METRICS = [
+    ('wall_seconds', 'Wall time of the latest run.'),
+    ('cpu_seconds', 'CPU time of the latest run.'),
+    ('timestamp_seconds', 'Unix time the latest run started.'),
+]
+
+
+def format_metric(name: str, kind: str, help_text: str, samples: Dict[tuple, float],
+                  labels: tuple = ()) -> List[str]:
+    """Format one metric family in the Prometheus text exposition format.
+
+    Args:
+        name (str): Metric name, without the METRICS_PREFIX
+        kind (str): 'counter' or 'gauge'
+        help_text (str): One-line description
+        samples (Dict[tuple, float]): Values keyed by their label values, () when unlabelled
+        labels (tuple): Label names, in the order of the keys' values
+
+    Returns:
+        List[str]: The HELP, TYPE and sample lines
+    """
+    full_name = f'{METRICS_PREFIX}_{name}'
+    lines = [f'# HELP {full_name} {help_text}', f'# TYPE {full_name} {kind}']
+    for label_values, value in samples.items():
+        label_text = ','.join(f'{label}="{_escape_label(label_value)}"'
+                              for label, label_value in zip(labels, label_values))
+        lines.append(f'{full_name}{{{label_text}}} {_format_value(value)}' if label_text
+                     else f'{full_name} {_format_value(value)}')
+    return lines
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+# Totals of every run traced by this process
+METRICS = StageMetrics()
@@ -0,0 +1,201 @@
+"""Background execution of report jobs.
+
+/process used to run the whole pipeline inside the request. JobQueue runs it on a
+small pool of worker threads instead and keeps, for each job, the stage it is in and
+how long each finished stage took, so the page can poll /jobs/<id> for progress.
+
+Each job runs in its own directory holding a snapshot of its inputs, so uploads made
+while it is queued or running do not change it. Submitting inputs whose content
+matches a job of the same scope that is still queued or running (or finished with its
+report still on disk) returns that job instead of starting another. The scope holds
+what the report depends on besides its inputs, such as the day it is run for and the
+workspace it belongs to.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from input_cache import file_digest
+
+# Runs a job: takes the input paths, the job directory and a progress callback,
+# returns the report path
+JobRunner = Callable[[Dict[str, str], str, Callable[[str], None]], str]
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+    """State of one report run."""
+
+    def __init__(self, job_id: str, key: str, inputs: Dict[str, str], workdir: str, scope: str = ''):
+        self.id = job_id
+        self.key = key
+        self.scope = scope
+        self.inputs = inputs
+        self.workdir = workdir
+        self.status = QUEUED
+        self.stage = None
+        self.stage_started = None
+        self.timings: Dict[str, float] = {}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.output_file = None
+        self.error = None
+
+    def to_dict(self, stages: List[str]) -> Dict[str, Any]:
+        """Return the job's state as JSON-serializable data."""
+        done_stages = len(self.timings)
+        if self.status == DONE:
+            fraction = 1.0
+        else:
+            fraction = done_stages / len(stages) if stages else 0.0
+        elapsed = None
+        if self.started is not None:
+            elapsed = round((self.finished or time.time()) - self.started, 3)
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'stages': stages,
+            'progress': round(fraction, 3),
+            'timings': {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+            'elapsed': elapsed,
+            'output_file': os.path.basename(self.output_file) if self.output_file else None,
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    """Runs report jobs on worker threads and tracks their progress.
+
+    Args:
+        runner (JobRunner): Runs the pipeline for one job
+        stages (List[str]): The stages the runner reports, in order
+        workers (int): Number of jobs run at the same time
+        max_jobs (int): Finished jobs kept for status queries
+        on_done (Callable[[Job], None]): Called with each job whose report was generated, before it is marked done
+    """
+
+    def __init__(self, runner: JobRunner, stages: List[str], workers: int = 1, max_jobs: int = 100,
+                 on_done: Callable[[Job], None] = None):
+        self.runner = runner
+        self.on_done = on_done
+        self.stages = stages
+        self.max_jobs = max_jobs
+        self.jobs: Dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report-job')
+
+    @staticmethod
+    def inputs_key(inputs: Dict[str, str]) -> str:
+        """Identify a submission by the content of its input files."""
+        return '|'.join(f"{name}={file_digest(path)}" for name, path in sorted(inputs.items()))
+
+    def submit(self, inputs: Dict[str, str], jobs_dir: str, scope: str = '') -> Tuple[Job, bool]:
+        """Queue a job for the inputs, unless an identical one is pending or its report exists.
+
+        Args:
+            inputs (Dict[str, str]): Paths of the input workbooks, keyed by file type
+            jobs_dir (str): Directory in which the job's own directory is created
+            scope (str): What else the report depends on; only jobs of the same scope are shared
+
+        Returns:
+            Tuple[Job, bool]: The job, and whether it was newly created
+        """
+        key = self.inputs_key(inputs)
+        with self.lock:
+            for job in self.jobs.values():
+                if job.key != key or job.scope != scope:
+                    continue
+                if job.status in (QUEUED, RUNNING):
+                    return job, False
+                if job.status == DONE and job.output_file and os.path.exists(job.output_file):
+                    return job, False
+
+            job_id = uuid.uuid4().hex
+            workdir = os.path.join(jobs_dir, job_id)
+            job = Job(job_id, key, self._snapshot(inputs, workdir), workdir, scope)
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        self.executor.submit(self._run, job)
+        return job, True
+
+    @staticmethod
+    def _snapshot(inputs: Dict[str, str], workdir: str) -> Dict[str, str]:
+        """Copy the inputs into the job directory and return the copies' paths."""
+        inputs_dir = os.path.join(workdir, 'inputs')
+        os.makedirs(inputs_dir)
+        snapshot = {}
+        for name, path in inputs.items():
+            snapshot[name] = os.path.join(inputs_dir, os.path.basename(path))
+            shutil.copyfile(path, snapshot[name])
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the state of a job, or None if it is unknown."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.to_dict(self.stages) if job else None
+
+    def status_counts(self) -> Dict[str, int]:
+        """Return how many of the known jobs are in each status."""
+        with self.lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+            for job in self.jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def _run(self, job: Job):
+        with self.lock:
+            job.status = RUNNING
+            job.started = time.time()
+        try:
+            output_file = self.runner(job.inputs, job.workdir, lambda stage: self._enter_stage(job, stage))
+            with self.lock:
+                self._close_stage(job)
+                job.output_file = output_file
+            if self.on_done is not None:
+                self.on_done(job)
+            with self.lock:
+                job.status = DONE
+            logging.info(f"Job {job.id} done in {time.time() - job.started:.1f} s: {output_file}")
+        except Exception as e:
+            logging.error(f"Job {job.id} failed: {str(e)}")
+            with self.lock:
+                self._close_stage(job)
+                job.error = str(e)
+                job.status = FAILED
+        finally:
+            with self.lock:
+                job.finished = time.time()
+
+    def _enter_stage(self, job: Job, stage: str):
+        with self.lock:
+            self._close_stage(job)
+            job.stage = stage
+            job.stage_started = time.perf_counter()
+
+    @staticmethod
+    def _close_stage(job: Job):
+        if job.stage is not None and job.stage_started is not None:
+            job.timings[job.stage] = time.perf_counter() - job.stage_started
+            job.stage_started = None
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self.jobs.values() if job.status in (DONE, FAILED)]
+        finished.sort(key=lambda job: job.created)
+        while len(self.jobs) > self.max_jobs and finished:
+            del self.jobs[finished.pop(0).id]
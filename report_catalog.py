@@ -0,0 +1,210 @@
+"""Persistent catalog of the generated reports.
+
+Finished jobs are recorded in a small SQLite database next to the reports, with the
+job id, the workspace that ran it, the key of its inputs (JobQueue.inputs_key), the
+report's path and size, and the stage timings. Finding a job's report or a
+workspace's latest one is an indexed lookup instead of a directory scan, and it
+keeps working after the app restarts and the in-memory job queue is gone.
+
+Each report is written in its own directory, processed/<job id>/, together with its
+trace. The catalog keeps that folder bounded: once a report is added, the oldest
+ones are deleted until the count, size and age limits hold, and directories left by
+jobs that never finished are removed once they are older than ORPHAN_MAX_AGE.
+
+Catalogued reports never change, so the job id and size make a strong ETag for
+conditional downloads.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, List, NamedTuple, Optional
+
+DEFAULT_MAX_REPORTS = 100
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+ORPHAN_MAX_AGE = 24 * 3600
+
+DATABASE_NAME = 'reports.sqlite3'
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    job_id TEXT PRIMARY KEY,
+    workspace TEXT,
+    inputs_key TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    elapsed REAL,
+    timings TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reports_by_workspace ON reports (workspace, created);
+CREATE INDEX IF NOT EXISTS reports_by_created ON reports (created);
+CREATE INDEX IF NOT EXISTS reports_by_inputs ON reports (inputs_key);
+"""
+
+_COLUMNS = 'job_id, workspace, inputs_key, path, size, created, elapsed, timings'
+
+
+class CatalogEntry(NamedTuple):
+    job_id: str
+    workspace: Optional[str]
+    inputs_key: str
+    path: str
+    size: int
+    created: float  # Unix time the report was catalogued
+    elapsed: Optional[float]  # Seconds the job ran
+    timings: Dict[str, float]  # Seconds spent in each stage
+
+    @property
+    def etag(self) -> str:
+        return f"{self.job_id}-{self.size}"
+
+
+class ReportCatalog:
+    """The generated reports under a directory, indexed in SQLite.
+
+    Args:
+        reports_dir (str): Directory holding the reports and the database
+        max_reports (int): Number of reports above which the oldest are deleted
+        max_bytes (int): Total size above which the oldest reports are deleted
+        max_age (float): Seconds after which a report is deleted
+    """
+
+    def __init__(self, reports_dir: str, max_reports: int = DEFAULT_MAX_REPORTS,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_age: float = DEFAULT_MAX_AGE):
+        self.reports_dir = os.path.abspath(reports_dir)
+        self.db_path = os.path.join(self.reports_dir, DATABASE_NAME)
+        self.max_reports = max_reports
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # SQLite serializes writers itself; the lock only keeps eviction from racing another add
+        self.lock = threading.Lock()
+        os.makedirs(self.reports_dir, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per call: jobs finish on worker threads while requests read
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def report_dir(self, job_id: str) -> str:
+        """Create and return the directory a job writes its report into."""
+        if not _JOB_ID.match(job_id or ''):
+            raise ValueError(f"Invalid job id: {job_id!r}")
+        path = os.path.join(self.reports_dir, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def add(self, job_id: str, workspace: Optional[str], inputs_key: str, path: str,
+            timings: Dict[str, float], elapsed: Optional[float] = None) -> CatalogEntry:
+        """Record a finished report, then delete the reports beyond the limits.
+
+        Args:
+            job_id (str): The job that generated the report
+            workspace (Optional[str]): The workspace the job ran in
+            inputs_key (str): JobQueue.inputs_key of the job's inputs
+            path (str): The report
+            timings (Dict[str, float]): Seconds spent in each stage
+            elapsed (Optional[float]): Seconds the job ran
+
+        Returns:
+            CatalogEntry: The recorded report
+        """
+        entry = CatalogEntry(job_id, workspace, inputs_key, os.path.abspath(path), os.path.getsize(path),
+                             time.time(), elapsed, dict(timings))
+        with self.lock:
+            with closing(self._connect()) as db, db:
+                db.execute(f"INSERT OR REPLACE INTO reports ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           entry[:-1] + (json.dumps(entry.timings),))
+            self._evict()
+        return entry
+
+    def get(self, job_id: str) -> Optional[CatalogEntry]:
+        """Return a job's report, or None if it is unknown or was deleted."""
+        return self._first("SELECT {} FROM reports WHERE job_id = ?", (job_id,))
+
+    def latest(self, workspace: str) -> Optional[CatalogEntry]:
+        """Return the most recent report of a workspace, or None if it has none."""
+        return self._first("SELECT {} FROM reports WHERE workspace = ? ORDER BY created DESC LIMIT 1", (workspace,))
+
+    def entries(self) -> List[CatalogEntry]:
+        """Return every catalogued report, newest first."""
+        with closing(self._connect()) as db:
+            rows = db.execute(f"SELECT {_COLUMNS} FROM reports ORDER BY created DESC").fetchall()
+        return [self._entry(row) for row in rows]
+
+    def _first(self, query: str, params: tuple) -> Optional[CatalogEntry]:
+        with closing(self._connect()) as db:
+            row = db.execute(query.format(_COLUMNS), params).fetchone()
+        if row is None:
+            return None
+        entry = self._entry(row)
+        return entry if os.path.exists(entry.path) else None
+
+    @staticmethod
+    def _entry(row: tuple) -> CatalogEntry:
+        return CatalogEntry(*row[:-1], json.loads(row[-1]))
+
+    def evict(self):
+        """Delete the oldest reports until the count, size and age limits hold."""
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        # The newest report is kept whatever its size, since it was just asked for
+        entries = self.entries()
+        cutoff = time.time() - self.max_age
+        kept = 0
+        total = 0
+        evicted = []
+        for entry in entries:
+            if not os.path.exists(entry.path):
+                evicted.append(entry)  # Deleted by hand
+            elif entry.created < cutoff or (kept and (kept >= self.max_reports or total + entry.size > self.max_bytes)):
+                if self._remove(entry.path):
+                    evicted.append(entry)
+            else:
+                kept += 1
+                total += entry.size
+
+        if evicted:
+            with closing(self._connect()) as db, db:
+                db.executemany("DELETE FROM reports WHERE job_id = ?", [(entry.job_id,) for entry in evicted])
+            logging.info(f"Evicted {len(evicted)} report(s) from the catalog: "
+                         f"{', '.join(entry.job_id for entry in evicted)}")
+        self._remove_orphans({entry.job_id for entry in entries} - {entry.job_id for entry in evicted})
+
+    def _remove(self, path: str) -> bool:
+        """Delete a report's directory; False if it is in use and must be retried later."""
+        directory = os.path.dirname(path)
+        try:
+            if os.path.dirname(directory) == self.reports_dir:
+                shutil.rmtree(directory)
+            else:
+                os.remove(path)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+
+    def _remove_orphans(self, catalogued: set):
+        # Directories of jobs that failed or never finished
+        cutoff = time.time() - ORPHAN_MAX_AGE
+        for name in os.listdir(self.reports_dir):
+            directory = os.path.join(self.reports_dir, name)
+            if name in catalogued or not _JOB_ID.match(name) or not os.path.isdir(directory):
+                continue
+            try:
+                if os.path.getmtime(directory) < cutoff:
+                    shutil.rmtree(directory, ignore_errors=True)
+            except OSError:
+                continue
@@ -26,21 +26,25 @@ function uploadFiles() {
         }
     }
 
-    // Upload each file sequentially
-    Promise.all([
+    // Join the session's workspace first, then upload the files in parallel: uploads
+    // sent without the workspace cookie would each create a workspace of their own
+    startSession()
+    .then(() => Promise.all([
         uploadSingleFile("accountPayables", "account_payables"),
         uploadSingleFile("bankBalance", "bank_balance"),
         uploadSingleFile("cashManagement", "cash_management")
-    ])
+    ]))
     .then(() => {
         progressBar.style.width = "50%";
         statusElement.innerText = "Files uploaded, processing...";
         // After successful upload, process the files
         return processFiles();
     })
-    .then(() => {
+    .then(job => {
         progressBar.style.width = "100%";
         statusElement.innerText = "All files uploaded and processed successfully!";
+        // The report stays in this session's workspace on the server: download it
+        window.location.href = `/jobs/${job.id}/download`;
         setTimeout(() => {
             progressBar.style.width = "0%";
             progressContainer.style.display = "none";
@@ -55,6 +59,16 @@ function uploadFiles() {
     });
 }
 
+function startSession() {
+    return fetch("/session", {
+        method: "POST"
+    }).then(response => {
+        if (!response.ok) {
+            throw new Error("Failed to start the session");
+        }
+    });
+}
+
 function uploadSingleFile(inputId, fileType) {
     const fileInput = document.getElementById(inputId);
     const formData = new FormData();
@@ -66,7 +80,9 @@ function uploadSingleFile(inputId, fileType) {
         body: formData
     }).then(response => {
         if (!response.ok) {
-            throw new Error(`Failed to upload ${fileType}`);
+            return response.text().then(text => {
+                throw new Error(text || `Failed to upload ${fileType}`);
+            });
         }
         return response.text();
     });
@@ -81,7 +97,40 @@ function processFiles() {
                 throw new Error(text || 'Failed to process files');
             });
         }
-        return response.text();
+        return response.json();
+    }).then(job => waitForJob(job.id));
+}
+
+// Poll the job until it finishes, moving the progress bar from 50% to 100% stage by stage
+function waitForJob(jobId) {
+    const statusElement = document.getElementById("status");
+    const progressBar = document.getElementById("progress-bar");
+
+    return new Promise((resolve, reject) => {
+        function poll() {
+            fetch(`/jobs/${jobId}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error('Lost track of the processing job');
+                    }
+                    return response.json();
+                })
+                .then(job => {
+                    progressBar.style.width = `${50 + job.progress * 50}%`;
+                    if (job.status === "done") {
+                        resolve(job);
+                    } else if (job.status === "failed") {
+                        reject(new Error(job.error || 'Processing failed'));
+                    } else {
+                        statusElement.innerText = job.stage
+                            ? `Processing: ${job.stage} (${job.stages.indexOf(job.stage) + 1}/${job.stages.length})...`
+                            : "Waiting for a free worker...";
+                        setTimeout(poll, 500);
+                    }
+                })
+                .catch(reject);
+        }
+        poll();
     });
 }
 
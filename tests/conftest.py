@@ -0,0 +1,41 @@
+"""Fixtures shared by the tests: small synthetic input workbooks and the web app."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import Payable_Account_Automation as P  # noqa: E402
+from input_cache import InputCache  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def input_files(tmp_path_factory):
+    """Paths of the three input workbooks, keyed by file type."""
+    from synthetic_inputs import SyntheticConfig, synthetic_frames, write_workbooks
+
+    config = SyntheticConfig(ap_lines=500, companies=5, suppliers=50)
+    return write_workbooks(synthetic_frames(config), str(tmp_path_factory.mktemp('inputs')))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    # app.py creates its processed, workspaces and logs folders in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
+
+
+@pytest.fixture
+def web_app(app_module, tmp_path, monkeypatch):
+    """The Flask app, with the input cache in a temporary directory."""
+    monkeypatch.setattr(app_module, 'input_cache', InputCache(str(tmp_path / 'cache')))
+    monkeypatch.setitem(P.DEFAULT_OPTIONS, 'input_cache', str(tmp_path / 'cache'))
+    return app_module.app
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import P
+
+AS_OF = '2024-06-30'
+
+
+def aged(days_old, **columns):
+    """Open lines dated days_old days before AS_OF, one per age."""
+    n = len(days_old)
+    df = pd.DataFrame({
+        'Company Name': 'Alpha',
+        'Bank': 'BNP',
+        'Supplier Name': 'Supplier',
+        'Date': pd.Timestamp(AS_OF) - pd.to_timedelta(days_old, unit='D'),
+        'Payable Balance': np.arange(1, n + 1, dtype=float),
+    })
+    for name, values in columns.items():
+        df[name] = values
+    return df
+
+
+def test_bucket_labels():
+    assert P.aging_bucket_labels([30, 60, 90, 120]) == ['Current', '31-60', '61-90', '91-120', '>120']
+    assert P.aging_bucket_labels([0]) == ['Current', '>0']
+    for bad in ([], [60, 30], [30, 30], [-1, 30]):
+        with pytest.raises(ValueError):
+            P.aging_bucket_labels(bad)
+
+
+@pytest.mark.parametrize('age, label', [
+    (-5, 'Current'),  # Dated after as_of
+    (0, 'Current'),
+    (30, 'Current'),
+    (31, '31-60'),
+    (60, '31-60'),
+    (61, '61-90'),
+    (90, '61-90'),
+    (91, '91-120'),
+    (120, '91-120'),
+    (121, '>120'),
+    (4000, '>120'),
+])
+def test_bucket_boundaries(age, label):
+    aging = P.age_payables(aged([age]), AS_OF)
+    labels = P.aging_bucket_labels(P.AGING_BUCKET_DAYS)
+    assert aging.loc[0, labels].to_dict() == {bucket: float(bucket == label) for bucket in labels}
+
+
+def test_balances_add_up_per_supplier():
+    df = aged([10, 45, 45, 200], **{'Supplier Name': ['B', 'A', 'B', 'B']})
+    aging = P.age_payables(df, AS_OF)
+    assert list(aging['Supplier Name']) == ['A', 'B']
+    assert aging.loc[1, ['Current', '31-60', '>120', 'Total', 'Lines']].tolist() == [1.0, 3.0, 4.0, 8.0, 3]
+    assert aging.loc[0, ['31-60', 'Total', 'Lines']].tolist() == [2.0, 2.0, 1]
+
+
+def test_lines_left_out_of_the_sheets_are_not_aged():
+    df = aged([10, 10, 10, 10], **{
+        'Company Name': ['Alpha', None, 'Alpha', 'Alpha'],
+        'Supplier Name': ['A', 'A', None, 'A'],
+    })
+    df.loc[3, 'Date'] = pd.NaT
+    aging = P.age_payables(df, AS_OF)
+    assert len(aging) == 1
+    assert aging.loc[0, ['Total', 'Lines']].tolist() == [1.0, 1]
+
+
+def test_missing_banks_come_last():
+    aging = P.age_payables(aged([10, 10, 10], Bank=[None, 'SG', 'BNP']), AS_OF)
+    assert aging['Bank'].tolist()[:2] == ['BNP', 'SG']
+    assert pd.isna(aging['Bank'].iloc[2])
+
+
+def test_custom_buckets():
+    aging = P.age_payables(aged([7, 8, 15]), AS_OF, [7, 14])
+    assert aging.loc[0, ['Current', '8-14', '>14']].tolist() == [1.0, 2.0, 3.0]
@@ -0,0 +1,73 @@
+import io
+import time
+
+import pandas as pd
+
+
+def upload(client, file_type, path):
+    with open(path, 'rb') as f:
+        return client.post('/upload', data={'file': (f, f'{file_type}.xlsx'), 'file_type': file_type})
+
+
+def wait_for_job(client, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(f'/jobs/{job_id}').get_json()
+        if status['status'] not in ('queued', 'running'):
+            return status
+        time.sleep(0.1)
+    raise AssertionError(f"Job {job_id} did not finish in {timeout} s")
+
+
+def test_parallel_uploads_land_in_the_session_workspace(web_app, input_files):
+    page = web_app.test_client()
+    assert page.post('/session').status_code == 204
+    cookie = page.get_cookie('session').value
+
+    # The page sends the three uploads at once: each carries only the cookie /session set
+    for file_type, path in input_files.items():
+        client = web_app.test_client()
+        client.set_cookie('session', cookie)
+        assert upload(client, file_type, path).status_code == 200
+
+    response = page.post('/process')
+    assert response.status_code == 202
+    assert wait_for_job(page, response.get_json()['id'])['status'] == 'done'
+
+
+def test_uploads_without_cookie_then_process(web_app, input_files):
+    client = web_app.test_client()
+    for file_type, path in input_files.items():
+        assert upload(client, file_type, path).status_code == 200
+
+    response = client.post('/process')
+    assert response.status_code == 202
+    assert wait_for_job(client, response.get_json()['id'])['status'] == 'done'
+    assert client.get(f"/jobs/{response.get_json()['id']}/download").status_code == 200
+
+
+def test_process_without_uploads(web_app):
+    assert web_app.test_client().post('/process').status_code == 400
+
+
+def test_summary_and_aging_as_parquet(web_app, input_files):
+    client = web_app.test_client()
+    for file_type, path in input_files.items():
+        upload(client, file_type, path)
+    for route in ('/api/summary', '/api/aging'):
+        response = client.get(f'{route}?format=parquet')
+        assert response.status_code == 200
+        assert len(pd.read_parquet(io.BytesIO(response.data))) > 0
+
+
+def test_sessions_do_not_share_jobs(web_app, input_files):
+    jobs = []
+    for _ in range(2):
+        client = web_app.test_client()
+        for file_type, path in input_files.items():
+            upload(client, file_type, path)
+        jobs.append(client.post('/process').get_json()['id'])
+        # The same session resubmitting gets its job back
+        assert client.post('/process').get_json()['id'] == jobs[-1]
+        wait_for_job(client, jobs[-1])
+    assert jobs[0] != jobs[1]
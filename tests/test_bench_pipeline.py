@@ -0,0 +1,21 @@
+from bench_pipeline import run_benchmark
+
+
+def test_benchmark_reports_the_stages_of_run_pipeline(input_files, tmp_path):
+    options = {
+        'add_vba_buttons': False,
+        'input_cache': str(tmp_path / 'cache'),
+        'incremental_state': str(tmp_path / 'state'),
+    }
+    cold = run_benchmark(input_files, str(tmp_path), options)
+    warm = run_benchmark(input_files, str(tmp_path), options, prefix='warm ')
+
+    names = [stage['stage'] for stage in cold]
+    assert names == [
+        'ingest', 'clean', 'merge', 'render', 'render aging', 'render Active', 'render Others',
+        'render Zagora_AP', 'render Zagora_AR', 'render AP_Aging', 'render company sheets', 'finalize',
+    ]
+    assert [stage['stage'] for stage in warm] == ['warm ' + name for name in names]
+    company_sheets = cold[names.index('render company sheets')]
+    assert company_sheets['rows'] == cold[names.index('render Active')]['rows']
+    assert all(stage['seconds'] >= 0 for stage in cold + warm)
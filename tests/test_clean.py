@@ -0,0 +1,22 @@
+import warnings
+
+import pandas as pd
+from synthetic_inputs import SyntheticConfig, synthetic_frames
+
+from conftest import P
+
+
+def test_clean_account_payables_leaves_its_input_alone_without_warnings():
+    _, ap_raw, _ = synthetic_frames(SyntheticConfig(ap_lines=2000, companies=4, suppliers=30))
+    before = ap_raw.copy()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        ap = P.clean_account_payables(ap_raw)
+    pd.testing.assert_frame_equal(ap_raw, before)
+
+    assert (ap['Date'] >= P.AP_CUTOFF_DATE).all()
+    assert (ap['Total'] != ap['Paid amount']).all()
+    reversed_lines = ap['Comment'].str[:2] == 'CT'
+    assert reversed_lines.any()
+    assert (ap.loc[reversed_lines, 'Total'] < 0).all()
+    assert not ap.duplicated().any()
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from conftest import P
+
+COVERED, PARTIAL, UNCOVERED = P.COVERED, P.PARTIAL, P.UNCOVERED
+
+
+def lines(rows, available=100.0, company='Alpha', bank='BNP'):
+    """A bank block of (supplier, date, balance) lines."""
+    return pd.DataFrame({
+        'Company Name': company,
+        'Bank': bank,
+        'Available': available,
+        'Supplier Name': [supplier for supplier, _, _ in rows],
+        'Date': pd.to_datetime([date for _, date, _ in rows]),
+        'Payable Balance': [balance for _, _, balance in rows],
+    })
+
+
+def test_cash_goes_to_the_oldest_lines_first():
+    df = lines([
+        ('Zeta', '2024-03-01', 40.0),
+        ('Alpha', '2024-01-01', 50.0),
+        ('Alpha', '2024-02-01', 50.0),
+    ])
+    assert list(P.allocate_cash(df)) == [UNCOVERED, COVERED, COVERED]
+
+
+def test_the_line_where_the_cash_runs_out_is_partial():
+    df = lines([
+        ('Alpha', '2024-01-01', 60.0),
+        ('Alpha', '2024-01-02', 60.0),
+        ('Alpha', '2024-01-03', 60.0),
+    ])
+    assert list(P.allocate_cash(df)) == [COVERED, PARTIAL, UNCOVERED]
+
+
+def test_exact_cover_within_half_a_cent():
+    df = lines([('Alpha', '2024-01-01', 60.0), ('Alpha', '2024-01-02', 40.004)])
+    assert list(P.allocate_cash(df)) == [COVERED, COVERED]
+
+
+def test_credits_are_covered_and_add_back_to_the_cash():
+    df = lines([
+        ('Alpha', '2024-01-01', 80.0),
+        ('Alpha', '2024-01-02', -30.0),
+        ('Alpha', '2024-01-03', 0.0),
+        ('Alpha', '2024-01-04', 50.0),
+    ])
+    assert list(P.allocate_cash(df)) == [COVERED, COVERED, COVERED, COVERED]
+
+
+def test_a_negative_available_covers_only_credits():
+    df = lines([('Alpha', '2024-01-01', 10.0), ('Alpha', '2024-01-02', -5.0)], available=-50.0)
+    assert list(P.allocate_cash(df)) == [UNCOVERED, COVERED]
+
+
+def test_a_blank_available_is_no_cash():
+    for available in (np.nan, '', 'n/a'):
+        df = lines([('Alpha', '2024-01-01', 10.0), ('Alpha', '2024-01-02', -1.0)], available=available)
+        assert list(P.allocate_cash(df)) == [UNCOVERED, COVERED]
+
+
+def test_undated_lines_come_last_and_same_day_lines_keep_their_order():
+    df = lines([
+        ('Alpha', None, 10.0),
+        ('Alpha', '2024-01-01', 50.0),
+        ('Beta', '2024-01-01', 60.0),
+    ])
+    assert list(P.allocate_cash(df)) == [UNCOVERED, COVERED, PARTIAL]
+
+
+def test_each_bank_block_spends_its_own_cash():
+    df = pd.concat([
+        lines([('Alpha', '2024-01-01', 80.0)], available=100.0),
+        lines([('Alpha', '2024-01-01', 80.0)], available=50.0),
+        lines([('Alpha', '2024-01-01', 80.0)], available=100.0, bank='SG'),
+        lines([('Alpha', '2024-01-01', 80.0)], available=100.0, company='Beta'),
+    ], ignore_index=True)
+    assert list(P.allocate_cash(df)) == [COVERED, PARTIAL, COVERED, COVERED]
+
+
+def test_lines_missing_from_the_sheet_take_no_cash():
+    df = lines([
+        (None, '2024-01-01', 90.0),
+        ('Alpha', '2024-01-02', 90.0),
+    ])
+    df.loc[2] = [None, 'BNP', 100.0, 'Alpha', pd.Timestamp('2024-01-01'), 90.0]
+    coverage = P.allocate_cash(df)
+    assert coverage[1] == COVERED
+    assert list(coverage[[0, 2]]) == [UNCOVERED, UNCOVERED]
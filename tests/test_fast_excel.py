@@ -0,0 +1,11 @@
+import io
+
+import pandas as pd
+
+from fast_excel import NA_STRINGS
+
+
+def test_na_strings_are_pandas_default_na_values():
+    for value in NA_STRINGS | {'NAN', 'na', 'none', ' NA'}:
+        parsed = pd.read_csv(io.StringIO(f'key,value\nk,"{value}"\n'))['value'][0]
+        assert pd.isna(parsed) == (value in NA_STRINGS), value
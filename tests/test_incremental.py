@@ -0,0 +1,50 @@
+import re
+
+import openpyxl
+from synthetic_inputs import SyntheticConfig, synthetic_frames, write_workbooks
+
+from conftest import P
+
+OPTIONS = {'input_cache': None, 'add_vba_buttons': False, 'aging_as_of': '2024-06-30'}
+
+
+def cells(path):
+    """Every written cell of a report: value, number format and fill, keyed by sheet and coordinate."""
+    workbook = openpyxl.load_workbook(path)
+    result = {}
+    for worksheet in workbook.worksheets:
+        for row in worksheet.iter_rows():
+            for cell in row:
+                if cell.value is not None or cell.has_style:
+                    result[worksheet.title, cell.coordinate] = (
+                        cell.value, cell.number_format, cell.fill.fgColor.rgb, cell.font.b
+                    )
+        result[worksheet.title, 'hidden'] = worksheet.sheet_state
+    return result
+
+
+def test_incremental_run_matches_a_full_run(tmp_path, capsys):
+    config = SyntheticConfig(ap_lines=600, companies=6, suppliers=40)
+    bb, ap, cm = synthetic_frames(config)
+    state = str(tmp_path / 'state')
+    first = write_workbooks((bb, ap, cm), str(tmp_path / 'first'))
+    P.run_pipeline(first, str(tmp_path / 'first.xlsx'), {**OPTIONS, 'incremental_state': state})
+
+    # Change the amounts of one company's lines and drop another company altogether
+    edited = ap['Compagnie'] == 101
+    ap = ap.copy()
+    ap.loc[edited, 'Total'] = ap.loc[edited, 'Total'] * 2
+    ap.loc[edited & (ap.index % 3 == 0), 'Montant payé'] = 0.0
+    ap = ap[ap['Compagnie'] != 103].reset_index(drop=True)
+    second = write_workbooks((bb, ap, cm), str(tmp_path / 'second'))
+
+    capsys.readouterr()
+    P.run_pipeline(second, str(tmp_path / 'incremental.xlsx'), {**OPTIONS, 'incremental_state': state})
+    # Only the edited company is prepared again; the dropped one is gone from the state
+    assert re.findall(r'Incremental Active: (\d+) of (\d+) companies', capsys.readouterr().out) == [('1', '5')]
+
+    P.run_pipeline(second, str(tmp_path / 'full.xlsx'), OPTIONS)
+    incremental, full = cells(tmp_path / 'incremental.xlsx'), cells(tmp_path / 'full.xlsx')
+    assert incremental.keys() == full.keys()
+    assert [key for key in full if incremental[key] != full[key]] == []
+    assert cells(tmp_path / 'first.xlsx') != full
@@ -0,0 +1,55 @@
+import os
+import time
+
+from jobs import DONE, JobQueue
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    return str(path)
+
+
+def wait(queue, job):
+    deadline = time.time() + 10
+    while queue.status(job.id)['status'] not in ('done', 'failed') and time.time() < deadline:
+        time.sleep(0.01)
+    return queue.status(job.id)
+
+
+def run(inputs, workdir, progress):
+    progress('render')
+    return write(os.path.join(workdir, 'report.xlsx'), 'report')
+
+
+def test_identical_inputs_share_a_job_within_a_scope(tmp_path):
+    queue = JobQueue(run, ['render'])
+    inputs = {'account_payables': write(tmp_path / 'ap.xlsx', 'ap')}
+    job, created = queue.submit(inputs, str(tmp_path / 'jobs'), 'workspace-a|2024-06-30')
+    assert created
+    assert wait(queue, job)['status'] == DONE
+
+    again, created = queue.submit(inputs, str(tmp_path / 'jobs'), 'workspace-a|2024-06-30')
+    assert not created and again.id == job.id
+
+
+def test_other_day_or_workspace_gets_its_own_job(tmp_path):
+    queue = JobQueue(run, ['render'])
+    inputs = {'account_payables': write(tmp_path / 'ap.xlsx', 'ap')}
+    job, _ = queue.submit(inputs, str(tmp_path / 'jobs'), 'workspace-a|2024-06-30')
+    wait(queue, job)
+
+    next_day, created = queue.submit(inputs, str(tmp_path / 'jobs'), 'workspace-a|2024-07-01')
+    assert created and next_day.id != job.id
+    other_workspace, created = queue.submit(inputs, str(tmp_path / 'jobs'), 'workspace-b|2024-06-30')
+    assert created and other_workspace.id not in (job.id, next_day.id)
+
+
+def test_changed_inputs_get_a_new_job(tmp_path):
+    queue = JobQueue(run, ['render'])
+    path = write(tmp_path / 'ap.xlsx', 'ap')
+    job, _ = queue.submit({'account_payables': path}, str(tmp_path / 'jobs'))
+    wait(queue, job)
+    write(path, 'ap, edited')
+    edited, created = queue.submit({'account_payables': path}, str(tmp_path / 'jobs'))
+    assert created and edited.id != job.id
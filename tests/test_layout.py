@@ -0,0 +1,159 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from conftest import P
+
+NAN = np.nan
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=['Company Name', 'Bank', 'Available', 'Supplier Name', 'Payable Balance'])
+
+
+def nested_groupby_walk(df, include_grand_total=True, first_row=1):
+    """The row walk of the original create_sheet, one nested groupby per level."""
+    row = first_row
+    companies = []
+    for company, company_group in df.groupby('Company Name'):
+        company_header_row = row
+        banks = []
+        for (bank, available), bank_group in company_group.groupby(['Bank', 'Available'], dropna=False):
+            bank_header_row = row
+            row += 1
+            suppliers = []
+            for supplier, supplier_group in bank_group.groupby('Supplier Name'):
+                header_row = row
+                row += 1 + len(supplier_group)
+                balance = pd.to_numeric(supplier_group['Payable Balance'], errors='coerce')
+                suppliers.append((supplier, header_row, list(supplier_group.index), row,
+                                  float(balance[np.isfinite(balance)].sum())))
+                row += 1
+            banks.append((bank, available, bank_header_row, suppliers, row))
+            row += 1
+        companies.append((company, company_header_row, banks, row))
+        row += 1
+    return companies, (row if include_grand_total else None), row
+
+
+def flatten(layout):
+    companies = []
+    for company in layout.companies:
+        banks = []
+        for bank in company.banks:
+            suppliers = [
+                (supplier.supplier, supplier.header_row, list(layout.order[supplier.start:supplier.stop]),
+                 supplier.total_row, supplier.total)
+                for supplier in bank.suppliers
+            ]
+            banks.append((bank.bank, bank.available, bank.header_row, suppliers, bank.total_row))
+        companies.append((company.company, company.header_row, banks, company.total_row))
+    return companies, layout.grand_total_row, layout.end_row
+
+
+def same(left, right):
+    """Compare nested plans, treating NaN keys as equal and totals up to summation order."""
+    if isinstance(left, (list, tuple)):
+        return len(left) == len(right) and all(same(a, b) for a, b in zip(left, right))
+    if pd.isna(left) and pd.isna(right):
+        return True
+    if isinstance(left, float) and isinstance(right, float):
+        return math.isclose(left, right)
+    return left == right
+
+
+SMALL = frame([
+    ['Beta', 'BNP', 500.0, 'Zeta', 10.0],
+    ['Alpha', 'SG', 100.0, 'Omega', 5.0],
+    ['Alpha', NAN, NAN, 'Delta', 7.0],
+    ['Alpha', 'BNP', 200.0, 'Kappa', 3.0],
+    ['Alpha', 'BNP', 200.0, NAN, 99.0],
+    [NAN, 'BNP', 200.0, 'Kappa', 1000.0],
+    ['Alpha', 'BNP', 200.0, 'Delta', 2.5],
+    ['Alpha', 'BNP', 200.0, 'Kappa', 'n/a'],
+    ['Alpha', 'SG', NAN, 'Omega', 1.0],
+    ['Beta', 'BNP', 500.0, 'Zeta', 20.0],
+    ['Alpha', 'BNP', 200.0, 'Kappa', 4.0],
+])
+
+
+def test_layout_matches_the_nested_groupby_walk():
+    for include_grand_total in (True, False):
+        expected = nested_groupby_walk(SMALL, include_grand_total)
+        assert same(flatten(P.plan_sheet_layout(SMALL, include_grand_total)), expected)
+
+
+def test_layout_matches_the_nested_groupby_walk_on_random_data():
+    rng = np.random.default_rng(7)
+    n = 400
+    df = pd.DataFrame({
+        'Company Name': rng.choice(['C1', 'C2', 'C3', None], n, p=[0.3, 0.3, 0.3, 0.1]),
+        'Bank': rng.choice(['BNP', 'SG', None], n),
+        'Available': rng.choice([100.0, 250.0, NAN], n),
+        'Supplier Name': rng.choice([f'Supplier {i:02d}' for i in range(30)] + [None], n),
+        'Payable Balance': rng.normal(1000, 500, n).round(2),
+    })
+    for include_grand_total in (True, False):
+        expected = nested_groupby_walk(df, include_grand_total, first_row=1)
+        assert same(flatten(P.plan_sheet_layout(df, include_grand_total)), expected)
+
+
+def test_groups_are_sorted_with_missing_banks_and_availables_last():
+    layout = P.plan_sheet_layout(SMALL)
+    assert [company.company for company in layout.companies] == ['Alpha', 'Beta']
+    alpha = layout.companies[0]
+    assert same([(bank.bank, bank.available) for bank in alpha.banks],
+                [('BNP', 200.0), ('SG', 100.0), ('SG', NAN), (NAN, NAN)])
+    assert [supplier.supplier for supplier in alpha.banks[0].suppliers] == ['Delta', 'Kappa']
+
+
+def test_rows_without_a_company_or_supplier_are_left_out():
+    layout = P.plan_sheet_layout(SMALL)
+    assert 5 not in layout.order  # No company
+    assert 4 not in layout.order  # No supplier
+    # Detail rows keep their frame order inside a supplier
+    kappa = layout.companies[0].banks[0].suppliers[1]
+    assert list(layout.order[kappa.start:kappa.stop]) == [3, 7, 10]
+
+
+def test_planned_rows_and_totals():
+    layout = P.plan_sheet_layout(SMALL, first_row=1)
+    alpha, beta = layout.companies
+    bnp = alpha.banks[0]
+    delta, kappa = bnp.suppliers
+    # Company and first bank share row 1; Delta header, one line, total; Kappa header, three lines, total
+    assert (alpha.header_row, bnp.header_row) == (1, 1)
+    assert (delta.header_row, delta.total_row) == (2, 4)
+    assert (kappa.header_row, kappa.total_row) == (5, 9)
+    assert bnp.total_row == 10
+    # The bank without a supplier still writes its header and total rows
+    assert (kappa.total, delta.total, bnp.total) == (7.0, 2.5, 9.5)
+    assert (bnp.available_total, bnp.net) == (200.0, 190.5)
+
+    missing_bank = alpha.banks[-1]
+    assert missing_bank.available_total is None
+    assert missing_bank.net == -7.0
+    assert alpha.total == 9.5 + 5.0 + 1.0 + 7.0
+    assert alpha.available_total == 300.0
+    assert alpha.net == 300.0 - alpha.total
+
+    assert beta.header_row == alpha.total_row + 1
+    assert beta.total == 30.0
+    assert layout.grand_total_row == beta.total_row + 1 == layout.end_row
+    assert layout.grand_total == alpha.total + beta.total
+    assert layout.grand_available_total == 800.0
+
+
+def test_without_a_grand_total():
+    layout = P.plan_sheet_layout(SMALL, include_grand_total=False, first_row=3)
+    assert layout.grand_total_row is None
+    assert layout.companies[0].header_row == 3
+    assert layout.end_row == layout.companies[-1].total_row + 1
+
+
+def test_empty_frame():
+    layout = P.plan_sheet_layout(SMALL.iloc[:0])
+    assert layout.companies == []
+    assert len(layout.order) == 0
+    assert layout.grand_total_row == layout.end_row == 1
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import P
+
+
+def old_normalize(values, key):
+    """The per-row cleaning normalize_keys did before the keys became categoricals."""
+    cleaned = values.astype(str).str.strip().replace(r'\.0$', '', regex=True).str.lower()
+    if key == 'Bank':
+        cleaned = cleaned.apply(lambda val: val.zfill(4) if val.isdigit() else 'nan')
+    return cleaned.tolist()
+
+
+def normalized(values, key):
+    codes, uniques = P.normalize_key_values(values, key)
+    return list(uniques[codes])
+
+
+@pytest.mark.parametrize('values', [
+    pd.Series([100, 200, 100]),
+    pd.Series([100.0, np.nan, 200.0, 100.0]),
+    pd.Series([100, '100', 100.0, ' 100 ', '0100', '100.0', 'ABC ', None, np.nan], dtype=object),
+    pd.Series(['12', 12, 12.0, '0012', '1234', '12345', 'x12', '', ' 7 '], dtype=object),
+    pd.Series([True, False]),
+])
+@pytest.mark.parametrize('key', ['Company', 'Building', 'Bank'])
+def test_keys_normalize_like_the_old_astype_str_path(values, key):
+    assert normalized(values, key) == old_normalize(values, key)
+
+
+def test_numeric_and_text_keys_meet_in_one_category():
+    ap = pd.DataFrame({'Company': [100, 101], 'Building': [1.0, 2.0], 'Bank': [12, 13]})
+    bb = pd.DataFrame({'Company': ['100', ' 101 '], 'Building': ['1', '2'], 'Bank': ['0012', '13.0']})
+    cm = pd.DataFrame({'Company': ['100.0'], 'Bank': [12.0]})
+    ap, bb, cm = P.normalize_keys(ap, bb, cm)
+    for key in P.merge_keys:
+        assert ap[key].dtype == bb[key].dtype
+        assert list(ap[key]) == list(bb[key])
+    assert list(ap['Bank']) == ['0012', '0013']
+    assert cm['Company'][0] == ap['Company'][0]
+
+
+def keyed(df, table):
+    """Give the key columns of df and table one shared categorical dtype, as normalize_keys does."""
+    df, table = df.copy(), table.copy()
+    for key in ['Company', 'Building']:
+        dtype = pd.CategoricalDtype(sorted(set(df[key].dropna()) | set(table[key].dropna())))
+        df[key] = df[key].astype(dtype)
+        table[key] = table[key].astype(dtype)
+    return df, table
+
+
+AP = pd.DataFrame({
+    'Company': ['100', '101', '102', None, '100'],
+    'Building': ['1', '1', '1', '1', '2'],
+    'Invoice': [1, 2, 3, 4, 5],
+})
+
+
+def test_unique_keys_join_without_adding_rows(capsys):
+    df, table = keyed(AP, pd.DataFrame({
+        'Company': ['100', '101', '100'],
+        'Building': ['1', '1', '2'],
+        'Bank': ['0001', '0002', '0003'],
+    }))
+    lookup = P.LookupIndex(table, ['Company', 'Building'], ['Bank'], 'buildings')
+    assert lookup.is_unique
+    joined = lookup.join(df)
+    pd.testing.assert_frame_equal(joined, pd.merge(df, table, on=['Company', 'Building'], how='left'))
+    # 102 has no building row and the missing company matches nothing
+    assert joined['Bank'].isna().tolist() == [False, False, True, True, False]
+    assert '2 AP line(s) have no match in buildings' in capsys.readouterr().out
+
+
+def test_repeated_table_rows_are_joined_once():
+    df, table = keyed(AP, pd.DataFrame({
+        'Company': ['100', '100', '101'],
+        'Building': ['1', '1', '1'],
+        'Bank': ['0001', '0001', '0002'],
+    }))
+    joined = P.LookupIndex(table, ['Company', 'Building'], ['Bank'], 'buildings').join(df)
+    assert len(joined) == len(df)
+    pd.testing.assert_frame_equal(
+        joined, pd.merge(df, table.drop_duplicates(), on=['Company', 'Building'], how='left')
+    )
+
+
+def test_duplicate_keys_fan_out_like_pd_merge(capsys):
+    df, table = keyed(AP, pd.DataFrame({
+        'Company': ['100', '100', '101'],
+        'Building': ['1', '1', '1'],
+        'Bank': ['0001', '0009', '0002'],
+    }))
+    lookup = P.LookupIndex(table, ['Company', 'Building'], ['Bank'], 'buildings')
+    assert not lookup.is_unique
+    joined = lookup.join(df)
+    pd.testing.assert_frame_equal(joined, pd.merge(df, table, on=['Company', 'Building'], how='left'))
+    assert joined['Invoice'].tolist() == [1, 1, 2, 3, 4, 5]
+    assert joined['Bank'].tolist()[:2] == ['0001', '0009']
+    assert '1 key(s) of buildings match several rows' in capsys.readouterr().out
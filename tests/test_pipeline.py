@@ -0,0 +1,13 @@
+import warnings
+
+from conftest import P
+
+
+def test_pipeline_raises_no_warnings(input_files, tmp_path):
+    # Jobs run in worker threads, so the pipeline avoids its warnings instead of filtering them
+    options = {'input_cache': None, 'add_vba_buttons': False}
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        P.run_pipeline(input_files, str(tmp_path / 'report.xlsx'), options)
+        P.report_summary(P.build_report_frames(input_files, options))
+        P.build_aging(input_files, options)
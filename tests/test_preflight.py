@@ -0,0 +1,63 @@
+import zipfile
+
+import pytest
+
+import Payable_Account_Automation as P
+from test_app import upload
+
+
+def rewrite_part(source, target, part, edit):
+    """Copy an .xlsx archive, passing one of its parts through edit."""
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            data = src.read(item)
+            dst.writestr(item, edit(data) if item.filename == part else data)
+    return str(target)
+
+
+def test_inputs_pass(input_files):
+    for file_type, path in input_files.items():
+        schema = P.preflight_input(file_type, path)
+        assert schema.sheet_name == {'bank_balance': 'Balance', 'account_payables': 'Export',
+                                     'cash_management': 'Latest'}[file_type]
+        assert schema.columns == {}
+
+
+def test_missing_column_is_named(input_files, tmp_path):
+    path = rewrite_part(input_files['cash_management'], tmp_path / 'cm.xlsx', 'xl/worksheets/sheet2.xml',
+                        lambda data: data.replace(b'>Available<', b'>Disponible<'))
+    with pytest.raises(ValueError, match="'Available'"):
+        P.preflight_input('cash_management', path)
+
+
+def test_header_variants_are_mapped(input_files, tmp_path):
+    path = rewrite_part(input_files['account_payables'], tmp_path / 'ap.xlsx', 'xl/worksheets/sheet1.xml',
+                        lambda data: data.replace('>Montant payé<'.encode(), b'>MONTANT  PAYE<'))
+    assert P.preflight_input('account_payables', path).columns == {'MONTANT  PAYE': 'Montant payé'}
+
+
+@pytest.mark.parametrize('part, edit', [
+    ('xl/workbook.xml', lambda data: data[:len(data) // 2]),  # Truncated XML
+    ('xl/workbook.xml', lambda data: b'not xml at all'),
+    ('xl/worksheets/sheet2.xml', lambda data: data[:data.index(b'</row>') - 20]),  # Truncated in the header
+    ('xl/worksheets/sheet2.xml', lambda data: data.replace(  # A numeric header cell that is not a number
+        b'<c r="A1" t="inlineStr"><is><t>Company</t></is></c>', b'<c r="A1"><v>abc</v></c>')),
+])
+def test_corrupt_workbook_is_rejected(input_files, tmp_path, part, edit):
+    path = rewrite_part(input_files['bank_balance'], tmp_path / 'bb.xlsx', part, edit)
+    with pytest.raises(ValueError, match='not a readable .xlsx workbook'):
+        P.preflight_input('bank_balance', path)
+
+
+def test_upload_rejects_corrupt_workbook(web_app, input_files, tmp_path):
+    path = rewrite_part(input_files['bank_balance'], tmp_path / 'bank_balance.xlsx', 'xl/workbook.xml',
+                        lambda data: data[:len(data) // 2])
+    response = upload(web_app.test_client(), 'bank_balance', path)
+    assert response.status_code == 400
+    assert 'not a readable .xlsx workbook' in response.get_data(as_text=True)
+
+
+def test_upload_rejects_non_workbook(web_app, tmp_path):
+    path = tmp_path / 'bank_balance.xlsx'
+    path.write_bytes(b'not a workbook')
+    assert upload(web_app.test_client(), 'bank_balance', str(path)).status_code == 400
@@ -0,0 +1,80 @@
+"""Per-session working directories for the web app.
+
+Every browser session gets its own workspace with its uploads, and every report job
+gets its own directory inside it holding a snapshot of the inputs and the report, so
+concurrent users never read or overwrite each other's files:
+
+    workspaces/<workspace id>/uploads/<file type>.xlsx
+    workspaces/<workspace id>/jobs/<job id>/...
+
+Workspaces not used for WORKSPACE_MAX_AGE seconds are deleted.
+"""
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Dict, Iterable
+
+WORKSPACE_MAX_AGE = 24 * 3600
+
+_WORKSPACE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class WorkspaceManager:
+    """Creates, locates and garbage-collects workspaces under a root directory.
+
+    Args:
+        root (str): Directory holding the workspaces
+        max_age (float): Seconds of inactivity after which a workspace is deleted
+    """
+
+    def __init__(self, root: str, max_age: float = WORKSPACE_MAX_AGE):
+        self.root = os.path.abspath(root)
+        self.max_age = max_age
+        os.makedirs(self.root, exist_ok=True)
+
+    def create(self) -> str:
+        """Create an empty workspace and return its id."""
+        self.collect_garbage()
+        workspace_id = uuid.uuid4().hex
+        os.makedirs(self.uploads_dir(workspace_id))
+        os.makedirs(self.jobs_dir(workspace_id))
+        return workspace_id
+
+    def exists(self, workspace_id: str) -> bool:
+        return bool(workspace_id) and _WORKSPACE_ID.match(workspace_id) is not None \
+            and os.path.isdir(os.path.join(self.root, workspace_id))
+
+    def path(self, workspace_id: str) -> str:
+        if not _WORKSPACE_ID.match(workspace_id or ''):
+            raise ValueError(f"Invalid workspace id: {workspace_id!r}")
+        return os.path.join(self.root, workspace_id)
+
+    def uploads_dir(self, workspace_id: str) -> str:
+        return os.path.join(self.path(workspace_id), 'uploads')
+
+    def jobs_dir(self, workspace_id: str) -> str:
+        return os.path.join(self.path(workspace_id), 'jobs')
+
+    def upload_paths(self, workspace_id: str, file_types: Iterable[str]) -> Dict[str, str]:
+        """Return where each uploaded input of the workspace is saved, keyed by file type."""
+        uploads = self.uploads_dir(workspace_id)
+        return {file_type: os.path.join(uploads, f"{file_type}.xlsx") for file_type in file_types}
+
+    def touch(self, workspace_id: str):
+        """Mark the workspace as in use, postponing its garbage collection."""
+        os.utime(self.path(workspace_id))
+
+    def collect_garbage(self):
+        """Delete the workspaces that have not been used for max_age seconds."""
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.root):
+            workspace = os.path.join(self.root, name)
+            if not _WORKSPACE_ID.match(name) or not os.path.isdir(workspace):
+                continue
+            try:
+                if os.path.getmtime(workspace) < cutoff:
+                    shutil.rmtree(workspace, ignore_errors=True)
+            except OSError:
+                continue